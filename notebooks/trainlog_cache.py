@@ -0,0 +1,354 @@
+"""
+trainlog_cache.py - training logs of many runs, parsed incrementally
+
+Int2Int writes the parameters of a run at the top of its train.log, and a
+line with a JSON dict of metrics (`__log__:{...}`) after every epoch. The
+notebooks used to re-read and re-parse every log (and unpickle every
+params.pkl) on each run, which takes minutes with hundreds of runs.
+
+load_runs(root) finds every run below root (every directory with a
+train.log, e.g. models/model_interCRT100_natural/mu/1), and returns a RunLog
+for each, with the run parameters and the metrics as columns (one NumPy
+array per metric, with NaN where an epoch did not log it). Each run is cached
+in train.log.cache.npz next to its log, along with how far the log was read
+and the size and mtime of the log and params.pkl. Refreshing only parses the
+lines added since, so it costs nothing for finished runs. Runs are processed
+in parallel.
+
+    from trainlog_cache import load_runs
+    runs = load_runs("../models")
+    for name, run in runs.items():
+        print(name, run.params.get("exp_name"), run['valid_arithmetic_acc'].max())
+
+Run it as a script for a table of the best value of a metric in every run.
+
+## License Information ##
+
+Copyright © 2025 David Lowry-Duda <david@lowryduda.com>
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import zlib
+
+import numpy as np
+
+try:
+    import pandas as pd
+    HAS_PANDAS = True
+except ImportError:
+    HAS_PANDAS = False
+
+
+LOG_NAME = "train.log"
+PARAMS_NAME = "params.pkl"
+CACHE_NAME = "train.log.cache.npz"
+
+# Bytes at the start of a log that are checked to see if it was rewritten
+HEAD_BYTES = 4096
+
+# Bumped whenever the format of the cache changes, to ignore old caches
+CACHE_VERSION = 1
+
+LOG_MARKER = "__log__:"
+# "key: value", indented, or (for the first parameter) after the prefix of
+# the logger, "INFO - 10/18/25 10:00:00 - 0:00:00 - "
+PARAM_LINE = re.compile(r'^(?:\w+ - \S+ \S+ - \S+ - |\s+)(\w+):\s+(.+)$')
+
+
+class RunLog:
+    """
+    The parameters (a dict) and metrics of one run. Metrics are columns: a
+    float array per numeric metric (NaN where missing), and an array of
+    JSON strings for any other metric ('' where missing).
+
+    offset is how far the log has been parsed, and in_params whether that
+    was inside the parameter section at the top of the log. head is a
+    checksum of the start of the log, to notice a log that was rewritten.
+    """
+
+    def __init__(self, path, params=None, columns=None, rows=0, offset=0,
+                 in_params=False, head=None, pkl_params=None):
+        self.path = path
+        self.params = params or {}
+        self.pkl_params = pkl_params
+        self.head = head
+        self.columns = columns or {}
+        self.rows = rows
+        self.offset = offset
+        self.in_params = in_params
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, metric):
+        return self.columns[metric]
+
+    def __contains__(self, metric):
+        return metric in self.columns
+
+    def to_frame(self):
+        """The metrics as a pandas DataFrame (needs pandas)."""
+        if not HAS_PANDAS:
+            raise ImportError("to_frame needs pandas: pip install pandas")
+        return pd.DataFrame(self.columns)
+
+    def append(self, records):
+        """Add the metric dicts in records as new rows."""
+        if not records:
+            return
+        added = {}
+        for i, record in enumerate(records):
+            for key, value in record.items():
+                added.setdefault(key, {})[i] = value
+        for key in self.columns.keys() - added.keys():
+            added[key] = {}
+        for key, values in added.items():
+            old = self.columns.get(key)
+            numeric = (old is None or old.dtype.kind == 'f') and all(
+                isinstance(v, (int, float)) for v in values.values()
+            )
+            if numeric:
+                new = np.full(len(records), np.nan)
+                for i, value in values.items():
+                    new[i] = value
+                if old is None:
+                    old = np.full(self.rows, np.nan)
+            else:
+                new = ['' if i not in values else json.dumps(values[i])
+                       for i in range(len(records))]
+                new = np.array(new, dtype=str)
+                if old is None:
+                    old = np.full(self.rows, '', dtype=str)
+                elif old.dtype.kind == 'f':
+                    # A numeric column got a value that is not a number
+                    old = np.array(['' if np.isnan(x) else json.dumps(x)
+                                    for x in old.tolist()], dtype=str)
+            self.columns[key] = np.concatenate([old, new])
+        self.rows += len(records)
+
+
+def parse_lines(run, lines):
+    """
+    Parse complete lines of a train.log into run: parameter lines at the top
+    (after "Initialized logger", until the training starts; a restarted run
+    logs them again) and the metric dicts of `__log__:` lines.
+    """
+    records = []
+    for line in lines:
+        if LOG_MARKER in line:
+            try:
+                records.append(json.loads(line.split(LOG_MARKER, 1)[1]))
+            except json.JSONDecodeError:
+                print(f"Warning: could not parse line of {run.path}: {line[:100]}")
+            continue
+        if 'Initialized logger' in line:
+            run.in_params = True
+        elif run.in_params:
+            if 'Running command' in line or 'Starting epoch' in line:
+                run.in_params = False
+            elif match := PARAM_LINE.search(line):
+                run.params[match.group(1)] = match.group(2).strip()
+    run.append(records)
+
+
+def _stamp(path):
+    """The size and mtime of path, or (-1, -1) if it does not exist."""
+    try:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    except FileNotFoundError:
+        return -1, -1
+
+
+def _head(path, size):
+    """Checksum of the first size bytes (at most HEAD_BYTES) of the file path."""
+    with open(path, "rb") as f:
+        return zlib.crc32(f.read(min(size, HEAD_BYTES)))
+
+
+def _read_params_pkl(path):
+    """The parameters pickled by Int2Int (an argparse Namespace), as JSON."""
+    with open(path, "rb") as f:
+        params = vars(pickle.load(f))
+    return {key: value if isinstance(value, (str, int, float, bool, type(None)))
+            else repr(value) for key, value in params.items()}
+
+
+def read_cache(run_dir):
+    """The cached RunLog of run_dir, and the stamps it was made with."""
+    try:
+        with np.load(os.path.join(run_dir, CACHE_NAME)) as data:
+            meta = json.loads(str(data['meta']))
+            if meta['version'] != CACHE_VERSION:
+                return None, None
+            columns = {key[len("col."):]: data[key] for key in data.files
+                       if key.startswith("col.")}
+    except (OSError, KeyError, ValueError):
+        return None, None
+    run = RunLog(os.path.join(run_dir, LOG_NAME), meta['params'], columns,
+                 meta['rows'], meta['offset'], meta['in_params'], meta['head'],
+                 meta['pkl_params'])
+    return run, meta['stamps']
+
+
+def write_cache(run_dir, run, stamps):
+    meta = {
+        'version': CACHE_VERSION,
+        'params': run.params,
+        'pkl_params': run.pkl_params,
+        'rows': run.rows,
+        'offset': run.offset,
+        'in_params': run.in_params,
+        'head': run.head,
+        'stamps': stamps,
+    }
+    path = os.path.join(run_dir, CACHE_NAME)
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, meta=np.array(json.dumps(meta)),
+             **{f"col.{key}": column for key, column in run.columns.items()})
+    os.replace(tmp, path)
+
+
+def load_run(run_dir, use_cache=True):
+    """
+    The RunLog of the run in run_dir, reading only what was added to its log
+    since it was cached (and updating the cache). A log that was rewritten
+    (it shrank, or its start changed) is parsed again from the start.
+
+    params are those of params.pkl if the run has one, and otherwise those
+    at the top of the log (as strings).
+    """
+    log_path = os.path.join(run_dir, LOG_NAME)
+    pkl_path = os.path.join(run_dir, PARAMS_NAME)
+    stamps = {'log': _stamp(log_path), 'pkl': _stamp(pkl_path)}
+    run, cached = read_cache(run_dir) if use_cache else (None, None)
+    if cached is not None:
+        cached = {key: tuple(value) for key, value in cached.items()}
+    if run is not None and cached['log'] != stamps['log']:
+        if stamps['log'][0] < run.offset or _head(log_path, run.offset) != run.head:
+            run = None
+    if run is None:
+        run = RunLog(log_path)
+        cached = None
+
+    if cached != stamps:
+        if stamps['log'][0] > run.offset:
+            with open(log_path, "rb") as f:
+                f.seek(run.offset)
+                data = f.read(stamps['log'][0] - run.offset)
+            # Leave a line that is still being written for next time
+            end = data.rfind(b"\n") + 1
+            parse_lines(run, data[:end].decode("utf8", errors="replace").splitlines())
+            run.offset += end
+            run.head = _head(log_path, run.offset)
+        if cached is None or cached['pkl'] != stamps['pkl']:
+            run.pkl_params = None
+            if stamps['pkl'][0] >= 0:
+                try:
+                    run.pkl_params = _read_params_pkl(pkl_path)
+                except Exception as e:
+                    # Pickles from other machines may not load here
+                    print(f"Warning: could not read {pkl_path}: {e}")
+        if use_cache:
+            write_cache(run_dir, run, stamps)
+
+    if run.pkl_params is not None:
+        run.params = dict(run.params, **run.pkl_params)
+    return run
+
+
+def find_runs(root):
+    """Every directory below root with a train.log, sorted."""
+    return sorted(dirpath for dirpath, _, filenames in os.walk(root)
+                  if LOG_NAME in filenames)
+
+
+def load_runs(root, processes=None, use_cache=True):
+    """
+    Dict run directory (relative to root) -> RunLog of every run below root,
+    loaded by a pool of processes (default: one per core).
+    """
+    run_dirs = find_runs(root)
+    if processes == 1 or len(run_dirs) <= 1:
+        runs = [load_run(run_dir, use_cache) for run_dir in run_dirs]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            runs = pool.starmap(load_run, [(run_dir, use_cache) for run_dir in run_dirs])
+    return {os.path.relpath(run_dir, root): run for run_dir, run in zip(run_dirs, runs)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Summarize the training logs of every run below a directory'
+    )
+    parser.add_argument(
+        'root',
+        type=str,
+        nargs='?',
+        default='../models',
+        help='Directory with the runs (Int2Int dump paths)'
+    )
+    parser.add_argument(
+        '--metric',
+        type=str,
+        default='valid_arithmetic_acc',
+        help='Metric to report the best value of'
+    )
+    parser.add_argument(
+        '--minimize',
+        action='store_true',
+        help='Lower values of the metric are better (e.g. for losses)'
+    )
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=None,
+        help='Number of processes parsing logs (default: one per core)'
+    )
+    parser.add_argument(
+        '--no_cache',
+        action='store_true',
+        help='Parse every log from the start, and do not write caches'
+    )
+    args = parser.parse_args()
+
+    runs = load_runs(args.root, args.processes, not args.no_cache)
+    print(f"{len(runs)} runs found in {args.root}")
+    best = np.nanmin if args.minimize else np.nanmax
+    arg_best = np.nanargmin if args.minimize else np.nanargmax
+    for name, run in runs.items():
+        column = run.columns.get(args.metric)
+        if column is None or column.dtype.kind != 'f' or np.isnan(column).all():
+            print(f"  {name:50} {len(run):5} epochs  (no {args.metric})")
+            continue
+        epoch = run['epoch'][arg_best(column)] if 'epoch' in run else arg_best(column)
+        print(f"  {name:50} {len(run):5} epochs  best {args.metric} "
+              f"{best(column):.4f} (epoch {int(epoch)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,16 @@
  * wheel factorization. This is wrapped in C-style linkage so that it can be
  * called by a python module via ctypes.
  *
+ * The batch entry point `mobius_array` evaluates the Mobius function on a
+ * whole buffer of integers in one call, optionally across OpenMP threads.
+ * `factor_stats_array` similarly factors each integer once and records the
+ * statistics from which the other arithmetic labels are derived.
+ *
+ * Trial division takes time proportional to sqrt(n). For large n,
+ * `rho_factor_stats_array` computes the same statistics for any unsigned
+ * 64-bit n using deterministic Miller-Rabin and Pollard rho (with Brent's
+ * cycle detection), which takes roughly n^(1/4) steps.
+ *
  *
  * // LICENSE INFORMATION //
  *
@@ -31,6 +41,15 @@
  * OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
  */
 
+#include <algorithm>
+
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+typedef unsigned long long u64;
+typedef unsigned __int128 u128;
+
 extern "C" {
 
 int mobius(long long n) {
@@ -61,4 +80,248 @@ int mobius(long long n) {
   return ret;
 }
 
+/*
+ * Write mobius(ns[i]) into out[i] for 0 <= i < count.
+ *
+ * If compiled with OpenMP, this uses nthreads threads (or the OpenMP default
+ * if nthreads <= 0). Otherwise nthreads is ignored.
+ */
+void mobius_array(const long long *ns, signed char *out, long long count,
+                  int nthreads) {
+#ifdef _OPENMP
+  if (nthreads <= 0) { nthreads = omp_get_max_threads(); }
+  #pragma omp parallel for schedule(dynamic, 1024) num_threads(nthreads)
+#endif
+  for (long long i = 0; i < count; ++i) {
+    out[i] = (signed char) mobius(ns[i]);
+  }
+}
+
+struct FactorStats {
+  signed char omega, bigomega, squarefree;
+  long long spf, rad;
+};
+
+/*
+ * Divide every factor of p out of n, updating the statistics.
+ */
+static void remove_prime(long long &n, long long p, FactorStats &s) {
+  if (n % p != 0) { return; }
+  if (s.omega == 0) { s.spf = p; }
+  s.omega += 1;
+  s.rad *= p;
+  int e = 0;
+  while (n % p == 0) { n /= p; e += 1; }
+  s.bigomega += e;
+  if (e > 1) { s.squarefree = 0; }
+}
+
+/*
+ * Completely factor n by wheel factorization and record
+ *   omega:      the number of distinct prime factors,
+ *   bigomega:   the number of prime factors with multiplicity,
+ *   squarefree: 1 if no square of a prime divides n, else 0,
+ *   spf:        the smallest prime factor (1 for n = 1),
+ *   rad:        the product of the distinct prime factors.
+ * For n < 1, everything is 0.
+ *
+ * Unlike mobius, this cannot stop at the first square factor.
+ */
+FactorStats factor_stats(long long n) {
+  FactorStats s = {0, 0, 0, 0, 0};
+  if (n < 1) { return s; }
+  s.squarefree = 1; s.spf = 1; s.rad = 1;
+
+  remove_prime(n, 2, s);
+  remove_prime(n, 3, s);
+  remove_prime(n, 5, s);
+
+  long long incs[] = {4, 2, 4, 2, 4, 6, 2, 6};
+  int i = 0;
+  long long p = 7;
+
+  while (p*p <= n) {
+    remove_prime(n, p, s);
+    p += incs[i];
+    i = (i + 1) % 8;
+  }
+  if (n > 1) { remove_prime(n, n, s); }
+  return s;
+}
+
+/*
+ * Batch version of factor_stats, filling out[i] for each output buffer from
+ * ns[i]. Threads are used as in mobius_array.
+ */
+void factor_stats_array(const long long *ns, signed char *omega,
+                        signed char *bigomega, signed char *squarefree,
+                        long long *spf, long long *rad, long long count,
+                        int nthreads) {
+#ifdef _OPENMP
+  if (nthreads <= 0) { nthreads = omp_get_max_threads(); }
+  #pragma omp parallel for schedule(dynamic, 1024) num_threads(nthreads)
+#endif
+  for (long long i = 0; i < count; ++i) {
+    FactorStats s = factor_stats(ns[i]);
+    omega[i] = s.omega;
+    bigomega[i] = s.bigomega;
+    squarefree[i] = s.squarefree;
+    spf[i] = s.spf;
+    rad[i] = s.rad;
+  }
+}
+
+struct RhoFactorStats {
+  signed char omega, bigomega, squarefree;
+  u64 spf, rad;
+};
+
+static inline u64 mulmod(u64 a, u64 b, u64 m) {
+  return (u64) ((u128) a * b % m);
+}
+
+static u64 powmod(u64 a, u64 e, u64 m) {
+  u64 result = 1;
+  a %= m;
+  while (e) {
+    if (e & 1) { result = mulmod(result, a, m); }
+    a = mulmod(a, a, m);
+    e >>= 1;
+  }
+  return result;
+}
+
+static const u64 SMALL_PRIMES[] = {
+  2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37
+};
+
+/*
+ * Miller-Rabin with the first 12 primes as bases, which is deterministic for
+ * n < 3.3 * 10^24, and so for every 64-bit n.
+ */
+static bool is_prime_u64(u64 n) {
+  if (n < 2) { return false; }
+  for (u64 p : SMALL_PRIMES) {
+    if (n % p == 0) { return n == p; }
+  }
+  u64 d = n - 1;
+  int s = 0;
+  while ((d & 1) == 0) { d >>= 1; s += 1; }
+  for (u64 a : SMALL_PRIMES) {
+    u64 x = powmod(a, d, n);
+    if (x == 1 || x == n - 1) { continue; }
+    bool composite = true;
+    for (int r = 1; r < s; ++r) {
+      x = mulmod(x, x, n);
+      if (x == n - 1) { composite = false; break; }
+    }
+    if (composite) { return false; }
+  }
+  return true;
+}
+
+static u64 gcd_u64(u64 a, u64 b) {
+  while (b) { u64 t = a % b; a = b; b = t; }
+  return a;
+}
+
+/*
+ * A nontrivial factor of the odd composite n, by Pollard rho with Brent's
+ * cycle detection, accumulating products of differences to share gcds.
+ */
+static u64 pollard_brent(u64 n) {
+  for (u64 c = 1;; ++c) {
+    u64 y = 2, x = 2, ys = 2, q = 1, g = 1;
+    const u64 m = 128;
+    for (u64 r = 1; g == 1; r <<= 1) {
+      x = y;
+      for (u64 i = 0; i < r; ++i) { y = (mulmod(y, y, n) + c) % n; }
+      for (u64 k = 0; k < r && g == 1; k += m) {
+        ys = y;
+        for (u64 i = 0; i < m && i < r - k; ++i) {
+          y = (mulmod(y, y, n) + c) % n;
+          q = mulmod(q, x > y ? x - y : y - x, n);
+        }
+        g = gcd_u64(q, n);
+      }
+    }
+    if (g == n) {
+      // The batched product overshot; redo the last batch one step at a time
+      do {
+        ys = (mulmod(ys, ys, n) + c) % n;
+        g = gcd_u64(x > ys ? x - ys : ys - x, n);
+      } while (g == 1);
+    }
+    if (g != n) { return g; }
+  }
+}
+
+/*
+ * Append the prime factors (with multiplicity) of n > 1, which has no prime
+ * factors below 1000, to factors.
+ */
+static void collect_prime_factors(u64 n, u64 *factors, int &count) {
+  if (n < 1000 * 1000 || is_prime_u64(n)) {
+    factors[count++] = n;
+    return;
+  }
+  u64 d = pollard_brent(n);
+  collect_prime_factors(d, factors, count);
+  collect_prime_factors(n / d, factors, count);
+}
+
+/*
+ * The same statistics as factor_stats, for any unsigned 64-bit n. Primes
+ * below 1000 are removed by trial division, and the remaining cofactor is
+ * split by Pollard rho. For n = 0, everything is 0.
+ */
+RhoFactorStats rho_factor_stats(u64 n) {
+  RhoFactorStats s = {0, 0, 0, 0, 0};
+  if (n < 1) { return s; }
+  s.squarefree = 1; s.spf = 1; s.rad = 1;
+
+  // 64 is more than the number of prime factors of any 64-bit n
+  u64 factors[64];
+  int count = 0;
+  for (u64 p = 2; p < 1000 && p * p <= n; p += (p == 2 ? 1 : 2)) {
+    while (n % p == 0) { factors[count++] = p; n /= p; }
+  }
+  if (n > 1) { collect_prime_factors(n, factors, count); }
+
+  std::sort(factors, factors + count);
+  for (int i = 0; i < count; ++i) {
+    s.bigomega += 1;
+    if (i > 0 && factors[i] == factors[i - 1]) {
+      s.squarefree = 0;
+      continue;
+    }
+    if (s.omega == 0) { s.spf = factors[i]; }
+    s.omega += 1;
+    s.rad *= factors[i];
+  }
+  return s;
+}
+
+/*
+ * Batch version of rho_factor_stats, filling out[i] for each output buffer
+ * from ns[i]. Threads are used as in mobius_array.
+ */
+void rho_factor_stats_array(const u64 *ns, signed char *omega,
+                            signed char *bigomega, signed char *squarefree,
+                            u64 *spf, u64 *rad, long long count,
+                            int nthreads) {
+#ifdef _OPENMP
+  if (nthreads <= 0) { nthreads = omp_get_max_threads(); }
+  #pragma omp parallel for schedule(dynamic, 256) num_threads(nthreads)
+#endif
+  for (long long i = 0; i < count; ++i) {
+    RhoFactorStats s = rho_factor_stats(ns[i]);
+    omega[i] = s.omega;
+    bigomega[i] = s.bigomega;
+    squarefree[i] = s.squarefree;
+    spf[i] = s.spf;
+    rad[i] = s.rad;
+  }
+}
+
 }
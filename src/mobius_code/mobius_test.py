@@ -2,10 +2,70 @@ import ctypes
 import os
 import unittest
 
+import numpy as np
+
 
 dldlib = ctypes.CDLL(os.path.abspath('mobius.so'))
 dldmobius = dldlib.mobius
 dldmobius.argtypes = [ctypes.c_longlong]
+dldmobius_array = dldlib.mobius_array
+dldmobius_array.argtypes = [
+    ctypes.c_void_p, ctypes.c_void_p, ctypes.c_longlong, ctypes.c_int
+]
+dldmobius_array.restype = None
+
+
+dldfactor_stats_array = dldlib.factor_stats_array
+dldfactor_stats_array.argtypes = [ctypes.c_void_p] * 6 + [
+    ctypes.c_longlong, ctypes.c_int
+]
+dldfactor_stats_array.restype = None
+
+
+def factor_stats(ns, nthreads=1):
+    ns = np.ascontiguousarray(ns, dtype=np.int64)
+    out = {
+        'omega': np.empty(len(ns), dtype=np.int8),
+        'bigomega': np.empty(len(ns), dtype=np.int8),
+        'squarefree': np.empty(len(ns), dtype=np.int8),
+        'spf': np.empty(len(ns), dtype=np.int64),
+        'rad': np.empty(len(ns), dtype=np.int64),
+    }
+    dldfactor_stats_array(
+        ns.ctypes.data, *(arr.ctypes.data for arr in out.values()), len(ns),
+        nthreads
+    )
+    return out
+
+
+dldrho_factor_stats_array = dldlib.rho_factor_stats_array
+dldrho_factor_stats_array.argtypes = [ctypes.c_void_p] * 6 + [
+    ctypes.c_longlong, ctypes.c_int
+]
+dldrho_factor_stats_array.restype = None
+
+
+def rho_factor_stats(ns, nthreads=1):
+    ns = np.ascontiguousarray(ns, dtype=np.uint64)
+    out = {
+        'omega': np.empty(len(ns), dtype=np.int8),
+        'bigomega': np.empty(len(ns), dtype=np.int8),
+        'squarefree': np.empty(len(ns), dtype=np.int8),
+        'spf': np.empty(len(ns), dtype=np.uint64),
+        'rad': np.empty(len(ns), dtype=np.uint64),
+    }
+    dldrho_factor_stats_array(
+        ns.ctypes.data, *(arr.ctypes.data for arr in out.values()), len(ns),
+        nthreads
+    )
+    return out
+
+
+def mobius_array(ns, nthreads=1):
+    ns = np.ascontiguousarray(ns, dtype=np.int64)
+    out = np.empty(len(ns), dtype=np.int8)
+    dldmobius_array(ns.ctypes.data, out.ctypes.data, len(ns), nthreads)
+    return out
 
 
 class TestMobius(unittest.TestCase):
@@ -30,3 +90,59 @@ class TestMobius(unittest.TestCase):
         self.assertEqual(dldmobius(2*3*5*7*11), -1)
         self.assertEqual(dldmobius(2*3*5*7*11*11), 0)
         self.assertEqual(dldmobius(2*3*5*7*11*13), 1)
+
+    def test_mobius_array(self):
+        ns = list(range(-5, 2000)) + [10**13 - k for k in range(2000)]
+        expected = [dldmobius(n) for n in ns]
+        self.assertEqual(mobius_array(ns).tolist(), expected)
+        self.assertEqual(mobius_array(ns, nthreads=4).tolist(), expected)
+        self.assertEqual(mobius_array(ns, nthreads=0).tolist(), expected)
+        self.assertEqual(len(mobius_array([])), 0)
+
+    def test_factor_stats(self):
+        n = 2**3 * 3 * 7**2 * 101
+        stats = factor_stats([0, 1, 2, 97, n, 999983**2, 3 * 999983])
+        self.assertEqual(stats['omega'].tolist(), [0, 0, 1, 1, 4, 1, 2])
+        self.assertEqual(stats['bigomega'].tolist(), [0, 0, 1, 1, 7, 2, 2])
+        self.assertEqual(stats['squarefree'].tolist(), [0, 1, 1, 1, 0, 0, 1])
+        self.assertEqual(
+            stats['spf'].tolist(), [0, 1, 2, 97, 2, 999983, 3]
+        )
+        self.assertEqual(
+            stats['rad'].tolist(),
+            [0, 1, 2, 97, 2 * 3 * 7 * 101, 999983, 3 * 999983]
+        )
+
+    def test_factor_stats_agrees_with_mobius(self):
+        ns = list(range(-5, 5000)) + [10**12 - k for k in range(500)]
+        stats = factor_stats(ns, nthreads=2)
+        mu = [
+            (-1)**int(w) if sf else 0
+            for w, sf in zip(stats['omega'], stats['squarefree'])
+        ]
+        self.assertEqual(mu, [dldmobius(n) for n in ns])
+
+    def test_rho_factor_stats_agrees_with_factor_stats(self):
+        ns = list(range(0, 5000)) + [10**12 - k for k in range(500)]
+        ns += [999983**2, 3 * 999983, 1000003 * 1000033]
+        expected = factor_stats(ns)
+        for nthreads in (1, 2):
+            stats = rho_factor_stats(ns, nthreads=nthreads)
+            for key in expected:
+                self.assertEqual(
+                    stats[key].tolist(), expected[key].tolist(), key
+                )
+
+    def test_rho_factor_stats_64_bit(self):
+        p, q = 2**61 - 1, 2**31 - 1  # Mersenne primes
+        n = 2**64 - 1  # 3 * 5 * 17 * 257 * 641 * 65537 * 6700417
+        stats = rho_factor_stats([p, 2 * p, q * q * 3, n, 4294967291**2])
+        self.assertEqual(stats['omega'].tolist(), [1, 2, 2, 7, 1])
+        self.assertEqual(stats['bigomega'].tolist(), [1, 2, 3, 7, 2])
+        self.assertEqual(stats['squarefree'].tolist(), [1, 1, 0, 1, 0])
+        self.assertEqual(
+            stats['spf'].tolist(), [p, 2, 3, 3, 4294967291]
+        )
+        self.assertEqual(
+            stats['rad'].tolist(), [p, 2 * p, 3 * q, n, 4294967291]
+        )
@@ -0,0 +1,259 @@
+"""
+artifacts.py - a content-addressed cache of generated datasets
+
+A generated dataset is determined by its parameters (encoding, dataset type,
+range, seed, number of samples, ...) and by the code that generated it. An
+ArtifactStore keeps each dataset in a directory named by a hash of both:
+
+    artifact_dir/{key}/manifest.json   the parameters, code version, and the
+                                       size and sha256 of each file
+    artifact_dir/{key}/...             the generated files
+
+so a request with exactly the same parameters and code is a cache hit, and
+anything else is generated anew. Files are then hard linked (or copied) to
+the paths where the rest of the pipeline expects them.
+
+Old artifacts can be pruned by age or total size, e.g.
+
+    python artifacts.py ../../input/artifacts --max_age_days 30 --max_gb 100
+
+## License Information ##
+
+Copyright © 2025 David Lowry-Duda <david@lowryduda.com>
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+
+MANIFEST = "manifest.json"
+
+
+def file_sha256(path, chunk_size=2**20):
+    """Hex sha256 of the contents of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def code_version(paths):
+    """
+    Hex sha256 of the source files in paths, so that any change to the code
+    that generates a dataset changes the keys of its artifacts.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(path).encode("utf8"))
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def artifact_key(params, version):
+    """Hex key of the artifact for a dict of parameters and a code version."""
+    canonical = json.dumps(
+        {'params': params, 'code_version': version}, sort_keys=True
+    )
+    return hashlib.sha256(canonical.encode("utf8")).hexdigest()[:32]
+
+
+class ArtifactStore:
+    """
+    The artifacts in the directory root, for code with the given version.
+
+    To generate a dataset, write its files into stage(params) and then call
+    commit(staging, params). lookup(params) finds a committed artifact. Only
+    committed artifacts (with a manifest) are ever used, so files from an
+    interrupted run are never mistaken for finished ones.
+    """
+
+    def __init__(self, root, version):
+        self.root = root
+        self.version = version
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, params):
+        return os.path.join(self.root, artifact_key(params, self.version))
+
+    def lookup(self, params, verify=False):
+        """
+        Directory of the artifact for params, or None if there is none. The
+        files must exist with the sizes in the manifest, and if verify is true
+        their checksums must match as well.
+        """
+        path = self.path(params)
+        manifest = read_manifest(path)
+        if manifest is None:
+            return None
+        for name, entry in manifest['files'].items():
+            fname = os.path.join(path, name)
+            if not os.path.exists(fname) or os.path.getsize(fname) != entry['bytes']:
+                return None
+            if verify and file_sha256(fname) != entry['sha256']:
+                return None
+        manifest['last_used'] = time.time()
+        write_manifest(path, manifest)
+        return path
+
+    def stage(self, params, keep=False):
+        """
+        The staging directory to generate the artifact for params in. It is
+        emptied first, unless keep is true (to resume an interrupted run).
+        """
+        staging = f"{self.path(params)}.partial"
+        if not keep:
+            shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging, exist_ok=True)
+        return staging
+
+    def commit(self, staging, params):
+        """
+        Write the manifest for the files in staging, and move it into place.
+        Returns the directory of the artifact.
+        """
+        files = {}
+        for name in sorted(os.listdir(staging)):
+            fname = os.path.join(staging, name)
+            files[name] = {
+                'bytes': os.path.getsize(fname),
+                'sha256': file_sha256(fname),
+            }
+        now = time.time()
+        write_manifest(staging, {
+            'params': params,
+            'code_version': self.version,
+            'created': now,
+            'last_used': now,
+            'files': files,
+        })
+        path = self.path(params)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(staging, path)
+        return path
+
+    def artifacts(self):
+        """List of (directory, manifest) of every committed artifact."""
+        found = []
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            manifest = read_manifest(path)
+            if manifest is not None:
+                found.append((path, manifest))
+        return found
+
+    def prune(self, max_age_days=None, max_bytes=None):
+        """
+        Delete artifacts not used in max_age_days, and then the least recently
+        used artifacts until the rest take at most max_bytes. Returns the list
+        of deleted directories.
+        """
+        now = time.time()
+        artifacts = sorted(self.artifacts(), key=lambda a: a[1]['last_used'])
+        deleted = []
+        total = sum(artifact_bytes(manifest) for _, manifest in artifacts)
+        for path, manifest in artifacts:
+            too_old = (max_age_days is not None
+                       and now - manifest['last_used'] > max_age_days * 86400)
+            too_big = max_bytes is not None and total > max_bytes
+            if too_old or too_big:
+                shutil.rmtree(path, ignore_errors=True)
+                total -= artifact_bytes(manifest)
+                deleted.append(path)
+        return deleted
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+    except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+        return None
+
+
+def write_manifest(path, manifest):
+    tmp = os.path.join(path, MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(path, MANIFEST))
+
+
+def artifact_bytes(manifest):
+    return sum(entry['bytes'] for entry in manifest['files'].values())
+
+
+def materialize(path, destinations):
+    """
+    Hard link (or, across filesystems, copy) the files of the artifact in path
+    to destinations, a dict mapping file name -> destination path.
+    """
+    for name, dest in destinations.items():
+        src = os.path.join(path, name)
+        if os.path.exists(dest):
+            if os.path.samefile(src, dest):
+                continue
+            os.remove(dest)
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copy2(src, dest)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='List or prune cached dataset artifacts'
+    )
+    parser.add_argument('root', type=str, help='Artifact directory')
+    parser.add_argument(
+        '--max_age_days',
+        type=float,
+        default=None,
+        help='Delete artifacts not used in this many days'
+    )
+    parser.add_argument(
+        '--max_gb',
+        type=float,
+        default=None,
+        help='Then delete the least recently used artifacts beyond this total size'
+    )
+    args = parser.parse_args()
+
+    store = ArtifactStore(args.root, version=None)
+    if args.max_age_days is not None or args.max_gb is not None:
+        max_bytes = None if args.max_gb is None else int(args.max_gb * 2**30)
+        for path in store.prune(args.max_age_days, max_bytes):
+            print(f"Deleted {path}")
+    for path, manifest in store.artifacts():
+        age = (time.time() - manifest['last_used']) / 86400
+        size = artifact_bytes(manifest) / 2**20
+        params = ", ".join(f"{k}={v}" for k, v in manifest['params'].items())
+        print(f"{os.path.basename(path)}  {size:10.1f} MB  "
+              f"used {age:.1f} days ago  {params}")
+
+
+if __name__ == "__main__":
+    main()
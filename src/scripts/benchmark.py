@@ -0,0 +1,376 @@
+"""
+benchmark.py - throughput and memory benchmarks of the data pipeline
+
+Each benchmark times one component (an encoder, a Mobius backend, a sieve,
+the shuffle) or the whole generator on a fixed, seeded workload of integers
+near 10^13, and reports samples per second and peak resident memory. Every
+benchmark runs in a fresh subprocess, so no benchmark inherits the memory of
+another. The peak includes the interpreter and the untimed setup of the
+workload (setup_rss_mb is the peak before the timed work), so work_rss_mb,
+how much the timed work raised the peak, is reported separately.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json --threshold 0.15
+
+The second form compares against earlier results, and exits with a nonzero
+status if any benchmark got slower (or used more memory) by more than the
+threshold. Select benchmarks with --only, and scale every workload with
+--scale (e.g. --scale 0.1 for a quick check, --scale 10 for nightly runs).
+
+## License Information ##
+
+Copyright © 2025 David Lowry-Duda <david@lowryduda.com>
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import argparse
+import atexit
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Samples are drawn from [N_MIN, N_MAX], the range of the natural dataset
+N_MIN = 10**12
+N_MAX = 10**13
+
+
+def sample_ns(size, seed):
+    return np.random.default_rng(seed).integers(N_MIN, N_MAX, size, dtype=np.int64)
+
+
+def scratch_dir(prefix):
+    """A temporary directory, deleted when the benchmark process exits."""
+    path = tempfile.mkdtemp(prefix=prefix)
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+# Each benchmark prepares its workload (untimed) from a size and seed, and
+# returns a function that does the timed work.
+
+def bench_encode_integer(size, seed):
+    from utils import encode_integer
+    ns = sample_ns(size, seed).tolist()
+    return lambda: [encode_integer(n) for n in ns]
+
+
+def bench_make_input_interCRT100(size, seed):
+    from generate_datafiles import make_input_interCRT100
+    ns = sample_ns(size, seed).tolist()
+    return lambda: [make_input_interCRT100(n) for n in ns]
+
+
+def bench_make_inputs_interCRT100(size, seed):
+    from generate_datafiles import make_inputs_interCRT100
+    ns = sample_ns(size, seed)
+    return lambda: make_inputs_interCRT100(ns)
+
+
+def bench_dldmobius(size, seed):
+    from utils import dldmobius
+    ns = sample_ns(size, seed).tolist()
+    return lambda: [dldmobius(n) for n in ns]
+
+
+def bench_mobius_array(size, seed):
+    from utils import mobius_array
+    ns = sample_ns(size, seed)
+    return lambda: mobius_array(ns)
+
+
+def bench_label_mobius_array(size, seed):
+    from utils import label_mobius_array
+    ns = sample_ns(size, seed)
+    return lambda: label_mobius_array(ns)
+
+
+def bench_wheel_mobius(size, seed):
+    from utils import wheel_mobius
+    ns = sample_ns(size, seed).tolist()
+    return lambda: [wheel_mobius(n) for n in ns]
+
+
+def bench_mobius_up_to(size, seed):
+    from utils import mobius_up_to
+    return lambda: mobius_up_to(size)
+
+
+def bench_mobius_segment(size, seed):
+    from utils import mobius_segment
+    start = int(sample_ns(1, seed)[0])
+    return lambda: mobius_segment(start, size)
+
+
+def bench_shuffle_and_create(size, seed):
+    from generate_datafiles import make_inputs_interCRT100, make_lines
+    from utils import shuffle_and_create
+    tmpdir = scratch_dir("bench_shuffle_")
+    fname = os.path.join(tmpdir, "mu_bench.txt")
+    ns = sample_ns(size, seed)
+    with open(fname, "w", encoding="utf8") as f:
+        for start in range(0, size, 10_000):
+            block = ns[start:start + 10_000]
+            f.write(make_lines(make_inputs_interCRT100(block), ["0"] * len(block)))
+    ntest = size // 10
+    return lambda: shuffle_and_create(fname, size - ntest, ntest, seed=seed)
+
+
+def bench_generate_natural(size, seed):
+    outdir = scratch_dir("bench_generate_")
+    cmd = [
+        sys.executable, os.path.join(SCRIPT_DIR, "generate_datafiles.py"),
+        "--dataset_type", "natural", "--num_samples", str(size),
+        "--seed", str(seed), "--output_dir", outdir, "--force",
+    ]
+    return lambda: subprocess.run(
+        cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+# Benchmark registry: name -> (function, default size). Sizes are chosen so
+# that each takes a few seconds; the pure Python ones are smaller.
+BENCHMARKS = {
+    'encode_integer': (bench_encode_integer, 10**6),
+    'make_input_interCRT100': (bench_make_input_interCRT100, 10**4),
+    'make_inputs_interCRT100': (bench_make_inputs_interCRT100, 10**5),
+    'dldmobius': (bench_dldmobius, 10**4),
+    'mobius_array': (bench_mobius_array, 10**4),
+    'label_mobius_array': (bench_label_mobius_array, 10**5),
+    'wheel_mobius': (bench_wheel_mobius, 10**3),
+    'mobius_up_to': (bench_mobius_up_to, 10**6),
+    'mobius_segment': (bench_mobius_segment, 10**7),
+    'shuffle_and_create': (bench_shuffle_and_create, 10**5),
+    'generate_natural': (bench_generate_natural, 10**5),
+}
+
+
+# Memory figures of a result, in MB
+RSS_KEYS = ('peak_rss_mb', 'setup_rss_mb', 'work_rss_mb')
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak resident memory of this process (or its children) in MB."""
+    rss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+def process_peak_rss_mb():
+    """Peak resident memory of this process or any of its children in MB."""
+    return max(peak_rss_mb(), peak_rss_mb(resource.RUSAGE_CHILDREN))
+
+
+def run_child(name, size, seed, output):
+    """Run one benchmark in this process, and write its result to output."""
+    sys.path.insert(0, SCRIPT_DIR)
+    work = BENCHMARKS[name][0](size, seed)
+    setup_rss = process_peak_rss_mb()
+    t = time.perf_counter()
+    work()
+    seconds = time.perf_counter() - t
+    peak_rss = process_peak_rss_mb()
+    result = {
+        'size': size,
+        'seconds': seconds,
+        'samples_per_sec': size / seconds,
+        'peak_rss_mb': peak_rss,
+        'setup_rss_mb': setup_rss,
+        'work_rss_mb': peak_rss - setup_rss,
+    }
+    with open(output, "w") as f:
+        json.dump(result, f)
+
+
+def run_benchmark(name, size, seed, repeat=1):
+    """
+    Run a benchmark repeat times, each in a fresh subprocess. Returns the
+    result of the fastest run, with the largest memory figures of any run.
+    """
+    best = None
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output = os.path.join(tmpdir, "result.json")
+        for _ in range(repeat):
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", name,
+                 "--size", str(size), "--seed", str(seed), "--output", output],
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+            )
+            if proc.returncode != 0:
+                sys.stderr.write(proc.stderr)
+                raise SystemExit(f"benchmark {name} failed")
+            with open(output) as f:
+                result = json.load(f)
+            if best is None:
+                best = result
+            else:
+                rss = {key: max(best[key], result[key]) for key in RSS_KEYS}
+                if result['seconds'] < best['seconds']:
+                    best = result
+                best.update(rss)
+    return best
+
+
+def environment():
+    """Where the benchmarks were run, for the JSON results."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results to baseline results. Returns a list of report lines and
+    whether any benchmark regressed by more than threshold (a fraction).
+    """
+    lines = []
+    regressed = False
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            lines.append(f"  {name:24} (not in baseline)")
+            continue
+        if base['size'] != result['size']:
+            lines.append(f"  {name:24} (baseline has size {base['size']:,})")
+            continue
+        speed = result['samples_per_sec'] / base['samples_per_sec'] - 1
+        memory = result['peak_rss_mb'] / base['peak_rss_mb'] - 1
+        flags = []
+        if speed < -threshold:
+            flags.append("SLOWER")
+        if memory > threshold:
+            flags.append("MORE MEMORY")
+        regressed = regressed or bool(flags)
+        lines.append(f"  {name:24} speed {speed:+7.1%}  memory {memory:+7.1%}  "
+                     + " ".join(flags))
+    return lines, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the throughput and memory use of the data pipeline'
+    )
+    parser.add_argument(
+        '--only',
+        type=str,
+        default=None,
+        help=f'Comma-separated benchmarks to run (from {", ".join(BENCHMARKS)})'
+    )
+    parser.add_argument(
+        '--scale',
+        type=float,
+        default=1.0,
+        help='Multiply the size of every workload by this'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed of the workloads'
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=1,
+        help='Run each benchmark this many times and keep the fastest'
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help='Write the results to this JSON file'
+    )
+    parser.add_argument(
+        '--baseline',
+        type=str,
+        default=None,
+        help='JSON results of an earlier run to compare against'
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.1,
+        help='Fraction by which a benchmark may be slower (or use more memory) than the baseline'
+    )
+    parser.add_argument('--child', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(args.child, args.size, args.seed, args.output)
+        return
+
+    names = list(BENCHMARKS)
+    if args.only is not None:
+        names = args.only.split(',')
+        for name in names:
+            if name not in BENCHMARKS:
+                parser.error(f"unknown benchmark {name}")
+
+    results = {}
+    for name in names:
+        size = max(1, int(BENCHMARKS[name][1] * args.scale))
+        result = run_benchmark(name, size, args.seed, args.repeat)
+        results[name] = result
+        print(f"{name:24} {size:>11,} samples  {result['samples_per_sec']:>13,.0f} samples/s  "
+              f"{result['peak_rss_mb']:8.1f} MB peak  {result['work_rss_mb']:+8.1f} MB in work")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({'environment': environment(), 'seed': args.seed,
+                       'results': results}, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        lines, regressed = compare(results, baseline, args.threshold)
+        print(f"Compared to {args.baseline} (threshold {args.threshold:.0%}):")
+        print("\n".join(lines))
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
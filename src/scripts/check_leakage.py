@@ -0,0 +1,210 @@
+"""
+check_leakage.py - check Int2Int datafiles for shared integers
+
+Each line of a datafile encodes an integer n through its residues modulo the
+first 100 primes. This script streams datafiles, recovers n from the residues
+modulo the first 25 primes with the Chinese Remainder Theorem, as a key of two
+int64 words (n modulo 2*3*...*47 and modulo 53*59*...*97), and keeps only a
+sorted array of these keys for each file. The keys are exact for
+n < 2*3*5*...*97 ~ 2.3 * 10^36, which covers every int64. It then reports how
+many integers each pair of files has in common, e.g. to verify that no test
+integer appears in the training data.
+
+Any argument ending in `.npy` is read as an index saved earlier with
+`--save_index`, so the (large) training set only has to be read once.
+
+## License Information ##
+
+Copyright © 2025 David Lowry-Duda <david@lowryduda.com>
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import argparse
+import itertools
+import sys
+
+import numpy as np
+
+from shards import open_binary
+from utils import primes_100
+
+
+# The primes of each word of a key; the product of each group is below 2^63,
+# and the product of all of them is above 2^64
+KEY_WORDS = (primes_100[:15], primes_100[15:25])
+KEY_PRIMES = [p for word in KEY_WORDS for p in word]
+NUM_KEY_PRIMES = len(KEY_PRIMES)
+KEY_DTYPE = np.dtype([('high', np.int64), ('low', np.int64)])
+
+# Number of lines decoded at a time
+CHUNK_LINES = 100_000
+
+# Vector length (from the leading "V..." token) -> whether the residues are
+# interleaved with the primes, as in interCRT100 and interCRT100_with_n
+INTERLEAVED = {
+    b'V200': True,
+    b'V201': True,
+    b'V100': False,
+    b'V103': False,
+}
+
+
+def crt_word(residues, primes):
+    """
+    Array of residues modulo primes (one row per n) -> int64 array of
+    n mod prod(primes), by Garner's algorithm.
+    """
+    keys = residues[:, 0].copy()
+    modulus = primes[0]
+    for i, p in enumerate(primes[1:], start=1):
+        inverse = pow(modulus % p, -1, p)
+        digit = ((residues[:, i] - keys % p) * inverse) % p
+        keys += digit * modulus
+        modulus *= p
+    return keys
+
+
+def crt_keys(residues):
+    """
+    Array of residues modulo KEY_PRIMES (one row per n) -> array of keys of
+    KEY_DTYPE, one word per group of KEY_WORDS. Two keys are equal exactly
+    when the integers agree modulo prod(KEY_PRIMES).
+    """
+    residues = np.asarray(residues, dtype=np.int64)
+    split = len(KEY_WORDS[0])
+    keys = np.empty(len(residues), dtype=KEY_DTYPE)
+    keys['high'] = crt_word(residues[:, split:], KEY_WORDS[1])
+    keys['low'] = crt_word(residues[:, :split], KEY_WORDS[0])
+    return keys
+
+
+def decode_residues(line, fname=None):
+    """
+    One line of an Int2Int datafile (as bytes) -> residues mod KEY_PRIMES.
+    Raises ValueError, naming fname, for lines of an unknown format.
+
+    Every residue is below 1000, so each one is the two tokens "+ r".
+    """
+    header = line.split(b' ', 1)[0]
+    if header not in INTERLEAVED:
+        raise ValueError(
+            f"{fname}: unknown datafile format (line starts with"
+            f" {header.decode(errors='replace')!r}, expected one of"
+            f" {', '.join(h.decode() for h in INTERLEAVED)})"
+        )
+    stride = 4 if INTERLEAVED[header] else 2
+    tokens = line.split(b' ', stride * NUM_KEY_PRIMES + 1)
+    return tokens[2:stride * NUM_KEY_PRIMES + 2:stride]
+
+
+def file_keys(fname):
+    """
+    Stream a datafile and return the sorted array of distinct keys, along
+    with the number of lines read.
+    """
+    chunks = []
+    num_lines = 0
+    with open_binary(fname) as f:
+        while True:
+            lines = list(itertools.islice(f, CHUNK_LINES))
+            if not lines:
+                break
+            num_lines += len(lines)
+            residues = np.array(
+                [decode_residues(line, fname) for line in lines],
+                dtype=np.int64
+            )
+            chunks.append(np.unique(crt_keys(residues)))
+    if not chunks:
+        return np.array([], dtype=KEY_DTYPE), 0
+    return np.unique(np.concatenate(chunks)), num_lines
+
+
+def load_index(fname):
+    """
+    Load keys for a datafile, or a saved index if fname ends with `.npy`.
+    Returns the sorted array of distinct keys and the number of lines, where
+    the number of lines is None for saved indices.
+    """
+    if fname.endswith(".npy"):
+        keys = np.load(fname, mmap_mode='r')
+        if keys.dtype != KEY_DTYPE:
+            raise ValueError(f"{fname} is an index in an older format;"
+                             " save it again with --save_index")
+        return keys, None
+    return file_keys(fname)
+
+
+def count_overlap(a, b):
+    """Number of common elements of two sorted arrays of distinct keys."""
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return 0
+    idx = np.searchsorted(b, a)
+    idx[idx == len(b)] = 0
+    return int(np.count_nonzero(b[idx] == a))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Count integers shared between Int2Int datafiles'
+    )
+    parser.add_argument(
+        'files',
+        nargs='+',
+        help='Datafiles (or .npy indices from --save_index) to compare'
+    )
+    parser.add_argument(
+        '--save_index',
+        action='store_true',
+        help='Save the key index of each datafile as FILE.keys.npy'
+    )
+    args = parser.parse_args()
+
+    indices = []
+    for fname in args.files:
+        keys, num_lines = load_index(fname)
+        indices.append(keys)
+        if num_lines is None:
+            print(f"{fname}: {len(keys):,} distinct integers (saved index)")
+            continue
+        duplicates = num_lines - len(keys)
+        print(f"{fname}: {num_lines:,} lines, {len(keys):,} distinct integers"
+              f" ({duplicates:,} duplicates)")
+        if args.save_index:
+            np.save(f"{fname}.keys.npy", keys)
+
+    print("\nOverlaps:")
+    leaked = False
+    for (i, a), (j, b) in itertools.combinations(enumerate(indices), 2):
+        overlap = count_overlap(a, b)
+        leaked = leaked or overlap > 0
+        print(f"  {overlap:>12,}  {args.files[i]}  <->  {args.files[j]}")
+
+    if leaked:
+        print("\nWARNING: some files share integers.")
+        sys.exit(1)
+    print("\nNo shared integers.")
+
+
+if __name__ == "__main__":
+    main()
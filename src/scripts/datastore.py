@@ -0,0 +1,254 @@
+"""
+datastore.py - compact binary datasets, rendered to Int2Int text on demand
+
+A text datafile is completely determined by the integers n and their labels,
+and most of each line is the (redundant) encoding of n. A store instead keeps
+one fixed-size record per sample: n as an int64, then one column per label
+target (mu, musq, ...). The file is
+
+    MAGIC (8 bytes) | header length (uint64, little endian) | JSON header |
+    packed records
+
+where the JSON header records the columns and how the data was sampled
+(dataset type, range, seed, ...), and the records can be memory-mapped
+directly as a NumPy structured array.
+
+The store can be rendered in any registered encoding, to a file, to stdout,
+or to a named pipe that Int2Int reads as its --train_data or --eval_data:
+
+    python datastore.py ../../input/store_natural.bin --encoding CRT100 \
+        --target mu --output mu_CRT100_natural.txt
+
+## License Information ##
+
+Copyright © 2025 David Lowry-Duda <david@lowryduda.com>
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import argparse
+import json
+import os
+import shutil
+import struct
+import sys
+
+import numpy as np
+
+
+MAGIC = b"MOBIUSDS"
+FORMAT_VERSION = 1
+
+# Records are aligned to this many bytes from the start of the file
+HEADER_ALIGNMENT = 64
+
+# Column types of the label targets in generate_datafiles.LABEL_TARGETS
+TARGET_DTYPES = {
+    'mu': '<i1',
+    'musq': '<i1',
+    'omega': '<i1',
+    'bigomega': '<i1',
+    'liouville': '<i1',
+    'rad': '<i8',
+    'spf': '<i8',
+}
+
+
+def record_dtype(targets):
+    """The packed structured dtype with column n and one column per target."""
+    return np.dtype(
+        [('n', '<i8')] + [(target, TARGET_DTYPES[target]) for target in targets]
+    )
+
+
+def make_header(targets, metadata):
+    """
+    Bytes of the magic, header length, and JSON header for a store with the
+    given label targets, padded so that the records start aligned.
+    """
+    header = {
+        'format_version': FORMAT_VERSION,
+        'columns': [[name, dt.str] for name, (dt, _) in record_dtype(targets).fields.items()],
+        'metadata': metadata,
+    }
+    body = json.dumps(header).encode("utf8")
+    prefix_length = len(MAGIC) + 8
+    padding = -(prefix_length + len(body)) % HEADER_ALIGNMENT
+    body += b" " * padding
+    return MAGIC + struct.pack("<Q", len(body)) + body
+
+
+class DataStoreWriter:
+    """
+    Append-only writer for a store.
+
+    If header is False, only the packed records are written. Shards write
+    their records this way, and concatenate_stores joins them under a single
+    header. If append is True, records are added to the end of an existing
+    file (and no header is written).
+    """
+
+    def __init__(self, path, targets, metadata=None, header=True,
+                 append=False):
+        self.path = path
+        self.targets = list(targets)
+        self.dtype = record_dtype(self.targets)
+        self.file = open(path, "ab" if append else "wb")
+        if header and not append:
+            self.file.write(make_header(self.targets, metadata or {}))
+
+    def write(self, ns, labels):
+        """Append records for the array ns and the dict of label arrays."""
+        records = np.empty(len(ns), dtype=self.dtype)
+        records['n'] = ns
+        for target in self.targets:
+            records[target] = labels[target]
+        self.file.write(records.tobytes())
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def concatenate_stores(path, targets, metadata, shard_paths):
+    """
+    Write a store at path from shards written with header=False, in order,
+    and then delete the shards.
+    """
+    with open(path, "wb") as outfile:
+        outfile.write(make_header(targets, metadata))
+        for shard_path in shard_paths:
+            with open(shard_path, "rb") as infile:
+                shutil.copyfileobj(infile, outfile)
+    for shard_path in shard_paths:
+        os.remove(shard_path)
+
+
+def read_header(path):
+    """Return (header dict, offset of the first record) for a store."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a datastore")
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    if header['format_version'] != FORMAT_VERSION:
+        raise ValueError(
+            f"{path} has unsupported format version {header['format_version']}"
+        )
+    return header, len(MAGIC) + 8 + length
+
+
+def open_store(path):
+    """
+    Memory-map a store. Returns (header dict, structured array of records).
+
+    A partially written store is truncated to its last complete record.
+    """
+    header, offset = read_header(path)
+    dtype = np.dtype([tuple(column) for column in header['columns']])
+    num_records = (os.path.getsize(path) - offset) // dtype.itemsize
+    if num_records == 0:
+        return header, np.empty(0, dtype=dtype)
+    records = np.memmap(
+        path, dtype=dtype, mode='r', offset=offset, shape=(num_records,)
+    )
+    return header, records
+
+
+def render(path, encoding, target, outfile, block_size=10_000):
+    """
+    Stream a store to outfile as Int2Int lines "INPUT\\tOUTPUT\\n" for the
+    given encoding (a key of generate_datafiles.BATCH_ENCODING_FORMATS) and
+    label target.
+    """
+    from generate_datafiles import BATCH_ENCODING_FORMATS, make_lines
+
+    input_encoder = BATCH_ENCODING_FORMATS[encoding]
+    _, records = open_store(path)
+    if target not in records.dtype.names:
+        raise ValueError(f"{path} has no labels for target {target}")
+    for start in range(0, len(records), block_size):
+        block = records[start:start + block_size]
+        inputs = input_encoder(np.asarray(block['n']))
+        outputs = [str(x) for x in block[target].tolist()]
+        outfile.write(make_lines(inputs, outputs))
+
+
+def main():
+    from generate_datafiles import BATCH_ENCODING_FORMATS
+
+    parser = argparse.ArgumentParser(
+        description='Render a binary datastore as Int2Int text'
+    )
+    parser.add_argument('store', type=str, help='Path to the datastore')
+    parser.add_argument(
+        '--encoding',
+        type=str,
+        default='interCRT100',
+        choices=list(BATCH_ENCODING_FORMATS.keys()),
+        help='Encoding format for input data'
+    )
+    parser.add_argument(
+        '--target',
+        type=str,
+        default='mu',
+        help='Label target to use as the output'
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default='-',
+        help='Output file, or - for stdout'
+    )
+    parser.add_argument(
+        '--mkfifo',
+        action='store_true',
+        help='Create --output as a named pipe first (if it does not exist)'
+    )
+    parser.add_argument(
+        '--info',
+        action='store_true',
+        help='Print the header and number of records instead of rendering'
+    )
+    args = parser.parse_args()
+
+    if args.info:
+        header, records = open_store(args.store)
+        print(json.dumps(header, indent=2))
+        print(f"{len(records):,} records")
+        return
+
+    if args.output == '-':
+        render(args.store, args.encoding, args.target, sys.stdout)
+        return
+    if args.mkfifo and not os.path.exists(args.output):
+        os.mkfifo(args.output)
+    # Opening a named pipe blocks until the reader (e.g. Int2Int) opens it
+    with open(args.output, "w", encoding="utf8") as outfile:
+        render(args.store, args.encoding, args.target, outfile)
+
+
+if __name__ == "__main__":
+    main()
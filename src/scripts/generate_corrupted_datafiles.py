@@ -1,7 +1,22 @@
 """
 generate_corrupted_datafiles.py - make mobius datafiles for Int2Int
 
-This also makes datafiles with incorrect values at the primes 2 and 3.
+This also makes datafiles with deliberately incorrect residues. Each variant
+is described by a corruption spec:
+
+    true                  no corruption
+    randomize:2,3         replace n mod 2 and n mod 3 by random residues
+    keep:2,3              randomize every residue except n mod 2 and n mod 3
+    randomize:each        one variant per prime p, randomizing only n mod p
+    keep:each             one variant per prime p, keeping only n mod p
+
+optionally prefixed by `name=` to choose the output names mu_{name}.txt and
+musq_{name}.txt. By default, this makes the variants used in the paper: the
+true data, randomized 2, randomized 3, randomized 2 and 3, and only 2 and 3
+correct.
+
+The integers, their residues, and their labels are computed once per batch
+and shared by every variant, which only overwrites the corrupted columns.
 
 NOTE: this implicitly assumes python3.10+. This could be made to work with
 earlier version of python by using different context-manager syntax for opening
@@ -32,129 +47,221 @@ TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
 OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 """
-import random
+import argparse
+import multiprocessing
+import os
+import zlib
+
+import numpy as np
+
+from generate_datafiles import (
+    BLOCK_SIZE, make_lines, render_interCRT100, WRITE_BUFFER_SIZE,
+)
+from label_cache import DEFAULT_MAX_MB, LabelCache
+from pipeline import Batch, Pipeline
+from utils import (
+    KeyedPermutation, label_mobius_array, primes_100, residue_matrix,
+    stats_mobius,
+)
+
 
+# The variants studied in the paper, with their historical filenames
+DEFAULT_SPECS = [
+    "only23_correct=keep:2,3",
+    "2_random=randomize:2",
+    "p_3_random=randomize:3",
+    "23_random=randomize:2,3",
+    "true=true",
+]
 
-from utils import dldmobius, encode_integer, primes_100
 
+def parse_spec(spec):
+    """
+    Corruption spec -> list of (name, indices of the randomized primes).
+    """
+    name, _, spec = spec.rpartition("=")
+    kind, _, primes = spec.partition(":")
+    if kind == "true" and not primes:
+        return [(name or "true", [])]
+    if kind not in ("randomize", "keep") or not primes:
+        raise ValueError(f"Invalid corruption spec {spec}")
 
-def make_line(input_func, output_func, n):
-    return input_func(n) + "\t" + output_func(n) + "\n"
+    if primes == "each":
+        if name:
+            raise ValueError("Specs using 'each' cannot be named")
+        groups = [[p] for p in primes_100]
+    else:
+        groups = [[int(p) for p in primes.split(",")]]
 
+    variants = []
+    for group in groups:
+        for p in group:
+            if p not in primes_100:
+                raise ValueError(f"{p} is not one of the first 100 primes")
+        joined = "_".join(str(p) for p in group)
+        if kind == "randomize":
+            columns = [primes_100.index(p) for p in group]
+            default_name = f"{joined}_random"
+        else:
+            columns = [i for i, p in enumerate(primes_100) if p not in group]
+            default_name = f"only{joined}_correct"
+        variants.append((name or default_name, columns))
+    return variants
 
-def make_correct_input(n):
-    ret = []
-    count = len(primes_100)
-    ret.append(f"V{2*count}")
-    for p in primes_100:
-        ret.append(encode_integer(n % p))
-        ret.append(encode_integer(p))
-    return ' '.join(ret)
 
+def variant_rng(seed, name):
+    """Random stream for the corruptions of one variant."""
+    return np.random.default_rng([seed, zlib.crc32(name.encode("utf8"))])
 
-def make_23_wrong_input(n):
-    ret = []
-    count = len(primes_100)
-    ret.append(f"V{2*count}")
-    for p in primes_100[:2]:
-        ret.append(encode_integer(random.randint(0, p-1)))
-        ret.append(encode_integer(p))
-    for p in primes_100[2:]:
-        ret.append(encode_integer(n % p))
-        ret.append(encode_integer(p))
-    return ' '.join(ret)
 
+def corrupt(residues, columns, rng):
+    """Copy of residues with the given columns replaced by random residues."""
+    residues = residues.copy()
+    if columns:
+        moduli = np.array([primes_100[i] for i in columns])
+        residues[:, columns] = rng.integers(0, moduli, size=(len(residues), len(columns)))
+    return residues
 
-def make_23_only_right_input(n):
-    ret = []
-    count = len(primes_100)
-    ret.append(f"V{2*count}")
-    for p in primes_100[:2]:
-        ret.append(encode_integer(n % p))
-        ret.append(encode_integer(p))
-    for p in primes_100[2:]:
-        ret.append(encode_integer(random.randint(0, p-1)))
-        ret.append(encode_integer(p))
-    return ' '.join(ret)
 
+def write_variants(outdir, variants, ns, mu, seed):
+    """
+    Write the mu and musq datafiles of each (name, columns) variant for the
+    integers ns, whose Mobius values are mu.
+    """
+    rngs = [variant_rng(seed, name) for name, _ in variants]
 
-def make_p_random_input_func(q):
-    def inner(n):
-        ret = []
-        count = len(primes_100)
-        ret.append(f"V{2*count}")
-        for p in primes_100:
-            if p != q:
-                ret.append(encode_integer(n % p))
-                ret.append(encode_integer(p))
-            else:
-                ret.append(encode_integer(random.randint(0, p-1)))
-                ret.append(encode_integer(p))
-        return ' '.join(ret)
-    return inner
+    def blocks():
+        for start in range(0, len(ns), BLOCK_SIZE):
+            yield Batch(ns[start:start + BLOCK_SIZE],
+                        known={"mu": mu[start:start + BLOCK_SIZE]})
 
+    def encode(batch):
+        block_mu = batch.known["mu"]
+        mu_outputs = [str(x) for x in block_mu.tolist()]
+        musq_outputs = [str(x) for x in (block_mu * block_mu).tolist()]
+        residues = residue_matrix(batch.ns)
+        batch.lines = {}
+        for (name, columns), rng in zip(variants, rngs):
+            inputs = render_interCRT100(corrupt(residues, columns, rng))
+            batch.lines[name, "mu"] = make_lines(inputs, mu_outputs)
+            batch.lines[name, "musq"] = make_lines(inputs, musq_outputs)
+        return batch
 
-def make_output(n):
-    return str(dldmobius(n))
+    files = {}
+    try:
+        for name, _ in variants:
+            for target in ("mu", "musq"):
+                files[name, target] = open(
+                    os.path.join(outdir, f"{target}_{name}.txt"), "w",
+                    encoding="utf8", buffering=WRITE_BUFFER_SIZE
+                )
 
+        def write(batch):
+            for key, outfile in files.items():
+                outfile.write(batch.lines[key])
+            return batch
 
-def make_output_sq(n):
-    return str(dldmobius(n)**2)
+        Pipeline(blocks(), [("encode", encode), ("write", write)],
+                 source_name="slice").run()
+    finally:
+        for outfile in files.values():
+            outfile.close()
+    return [name for name, _ in variants]
+
+
+def _write_variants_star(task):
+    return write_variants(*task)
 
 
 def main():
-    outdir = "../../input/"
-    seen = set()
-    with (
-        open(outdir + "mu_only23_correct.txt", "w", encoding="utf8") as mu23file,
-        open(outdir + "musq_only23_correct.txt", "w", encoding="utf8") as musq23file,
-        open(outdir + "mu_2_random.txt", "w", encoding="utf8") as mu2hatfile,
-        open(outdir + "musq_2_random.txt", "w", encoding="utf8") as musq2hatfile,
-        open(outdir + "mu_p_3_random.txt", "w", encoding="utf8") as mu3hatfile,
-        open(outdir + "musq_p_3_random.txt", "w", encoding="utf8") as musq3hatfile,
-        open(outdir + "mu_23_random.txt", "w", encoding="utf8") as mu23hatfile,
-        open(outdir + "musq_23_random.txt", "w", encoding="utf8") as musq23hatfile,
-        open(outdir + "mu_true.txt", "w", encoding="utf8") as mu23truefile,
-        open(outdir + "musq_true.txt", "w", encoding="utf8") as musq23truefile,
-    ):
-        while len(seen) < 10**5:
-            n = random.randint(2, 10**13)
-            if n in seen:
-                continue
-            seen.add(n)
-            mu23file.write(
-                make_line(make_23_only_right_input, make_output, n)
-            )
-            musq23file.write(
-                make_line(make_23_only_right_input, make_output_sq, n)
-            )
-            mu2hatfile.write(
-                make_line(make_p_random_input_func(2), make_output, n)
-            )
-            musq2hatfile.write(
-                make_line(make_p_random_input_func(2), make_output_sq, n)
-            )
-            mu3hatfile.write(
-                make_line(make_p_random_input_func(3), make_output, n)
-            )
-            musq3hatfile.write(
-                make_line(make_p_random_input_func(3), make_output_sq, n)
-            )
-            mu23hatfile.write(
-                make_line(make_23_wrong_input, make_output, n)
-            )
-            musq23hatfile.write(
-                make_line(make_23_wrong_input, make_output_sq, n)
-            )
-            mu23truefile.write(
-                make_line(make_correct_input, make_output, n)
-            )
-            musq23truefile.write(
-                make_line(make_correct_input, make_output_sq, n)
-            )
+    parser = argparse.ArgumentParser(
+        description='Generate Möbius datafiles with corrupted residues'
+    )
+    parser.add_argument(
+        '--spec',
+        type=str,
+        action='append',
+        help='Corruption spec (may be repeated); see the module docstring'
+    )
+    parser.add_argument(
+        '--num_samples',
+        type=int,
+        default=10**5,
+        help='Number of samples in each datafile'
+    )
+    parser.add_argument(
+        '--output_dir',
+        type=str,
+        default='../../input/',
+        help='Output directory for generated files'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=None,
+        help='Random seed for reproducibility'
+    )
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=1,
+        help='Number of OpenMP threads for computing mu (0 means all cores)'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of worker processes writing variants in parallel'
+    )
+    parser.add_argument(
+        '--label_cache',
+        type=str,
+        default=None,
+        help='Directory of a persistent label cache (see label_cache.py)'
+    )
+    parser.add_argument(
+        '--label_cache_mb',
+        type=float,
+        default=DEFAULT_MAX_MB,
+        help='Size bound of the label cache in MB'
+    )
+    args = parser.parse_args()
+
+    variants = []
+    for spec in args.spec or DEFAULT_SPECS:
+        try:
+            variants.extend(parse_spec(spec))
+        except ValueError as e:
+            parser.error(str(e))
+    names = [name for name, _ in variants]
+    if len(set(names)) != len(names):
+        parser.error("corruption specs produce duplicate names")
+
+    seed = np.random.SeedSequence(args.seed).entropy
+    os.makedirs(args.output_dir, exist_ok=True)
+    print(f"Making {len(variants)} variants of {args.num_samples:,} samples in {args.output_dir}")
+
+    # Distinct n in [2, 10^13], as the images of 0, 1, ... under a permutation,
+    # and their labels, shared by every variant
+    perm = KeyedPermutation(10**13 - 1, seed)
+    ns = perm(np.arange(args.num_samples)).astype(np.int64) + 2
+    if args.label_cache is not None:
+        with LabelCache(args.label_cache, args.label_cache_mb) as cache:
+            mu = stats_mobius(cache.factor_stats(ns, args.threads))
+    else:
+        mu = label_mobius_array(ns, args.threads)
+
+    groups = [variants[i::args.workers] for i in range(args.workers)]
+    tasks = [(args.output_dir, group, ns, mu, seed) for group in groups if group]
+    if args.workers == 1:
+        for task in tasks:
+            print("  Wrote:", ", ".join(write_variants(*task)))
+    else:
+        with multiprocessing.Pool(args.workers) as pool:
+            for done in pool.imap_unordered(_write_variants_star, tasks):
+                print("  Wrote:", ", ".join(done))
 
 
 if __name__ == "__main__":
-    print("Making good and corrupt datafiles in ../../input")
     main()
     print("Done")
@@ -32,7 +32,15 @@ OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 import random
 import argparse
+import contextlib
+import json
+import math
+import multiprocessing
 import os
+import shutil
+import time
+
+import numpy as np
 
 try:
     from tqdm import tqdm
@@ -41,18 +49,77 @@ except ImportError:
     HAS_TQDM = False
     print("Note: Install tqdm for progress bar support: pip install tqdm")
 
-from utils import dldmobius, encode_integer, primes_100
+from artifacts import ArtifactStore, code_version, materialize, read_manifest
+from datastore import concatenate_stores, DataStoreWriter
+from label_cache import DEFAULT_MAX_MB, LabelCache
+from pipeline import Batch, merge_stats, Pipeline, StageStats
+from profiling import MetricsStream, SamplingProfiler
+from shards import (
+    CODECS, DEFAULT_SHARD_LINES, HAS_ZSTD, join_shards, remove_shards,
+    ShardWriter,
+)
+from tokens import (
+    encoding_tokenizer, join_tokens, remove_tokens, sequence_length,
+    TokenWriter,
+)
+from utils import (
+    encode_integer, encode_token_matrix, is_smooth_array, KeyedPermutation,
+    label_factor_stats, label_mobius_array, mix64_array, mobius,
+    mobius_segment, primes_100, PRIMES_100, residue_matrix,
+    small_integer_tokens, smooth_counter, use_smooth_counter,
+)
+
+
+# Number of samples encoded and written at a time
+BLOCK_SIZE = 10_000
+
+# Width of each sieved window in range mode
+SIEVE_SEGMENT_SIZE = 2**20
+
+# Bytes buffered for each output file between writes to disk
+WRITE_BUFFER_SIZE = 2**22
 
 
 def make_line(inputfunc, outputfunc, n):
     return inputfunc(n) + "\t" + outputfunc(n) + "\n"
 
 
+def make_lines(inputs, outputs):
+    """Batch version of make_line, from already encoded inputs and outputs."""
+    return "".join(f"{x}\t{y}\n" for x, y in zip(inputs, outputs))
+
+
 def generate_natural_number(min_val, max_val):
     """Generate a uniform random number between min_val and max_val."""
     return random.randint(min_val, max_val)
 
 
+class NaturalSampler:
+    """
+    Distinct uniform random numbers between min_val and max_val, by design.
+
+    The i-th sample is min_val + perm(i) for a seeded permutation perm of
+    [0, max_val - min_val], so any slice of samples can be computed directly
+    (e.g. by a shard) and no set of previous samples is needed.
+    """
+
+    def __init__(self, min_val, max_val, seed=None):
+        self.min_val = min_val
+        self.perm = KeyedPermutation(max_val - min_val + 1, seed)
+
+    def __len__(self):
+        return self.perm.size
+
+    def take(self, start, stop):
+        """int64 array of samples start, start + 1, ..., stop - 1."""
+        indices = np.arange(start, stop, dtype=np.uint64)
+        return self.perm(indices).astype(np.int64) + self.min_val
+
+
+# Natural logarithms of primes_100, shared by the cheat samplers
+LOG_PRIMES_100 = [math.log(p) for p in primes_100]
+
+
 def generate_cheat_number(min_val, max_val):
     """
     Generate a number whose prime factors are all within the first 100 primes.
@@ -60,8 +127,6 @@ def generate_cheat_number(min_val, max_val):
     Use logarithms to control the size more precisely.
     Target a specific log value and build the number incrementally.
     """
-    import math
-
     # Target log range
     log_min = math.log(max(min_val, 2))
     log_max = math.log(max_val)
@@ -72,7 +137,7 @@ def generate_cheat_number(min_val, max_val):
     # Build number by selecting primes and powers
     n = 1
     current_log = 0.0
-    log_primes = [math.log(p) for p in primes_100]
+    log_primes = LOG_PRIMES_100
 
     # Shuffle primes for randomness
     indices = list(range(len(primes_100)))
@@ -129,7 +194,11 @@ def generate_cheat_number(min_val, max_val):
 
 
 def is_composed_only_of_first_100_primes(n):
-    """Check if n has only prime factors within the first 100 primes."""
+    """
+    Check if n has only prime factors within the first 100 primes.
+
+    See utils.is_smooth_array for the vectorized version.
+    """
     for p in primes_100:
         while n % p == 0:
             n //= p
@@ -153,6 +222,103 @@ def generate_non_cheat_number(min_val, max_val, max_attempts=10000):
     return random.randint(min_val // 547, max_val // 547) * 547
 
 
+def generate_cheat_numbers(rng, min_val, max_val, count):
+    """
+    An int64 array of count independent uniform random numbers in
+    [min_val, max_val] whose prime factors are all within the first 100
+    primes, drawn with the NumPy Generator rng.
+
+    Unlike generate_cheat_number, this is exactly uniform over all such
+    numbers. It uses the counts of utils.SmoothCounter, which are computed
+    on the first call for a range and then cached.
+    """
+    return smooth_counter(min_val, max_val).sample(rng, count)
+
+
+def owned(ns, owner, counts=None):
+    """
+    The values of ns that belong to owner, a pair (shard, workers): those n
+    with mix64(n) % workers == shard. The number of values of other shards
+    is added to counts['not_owned'] (if counts is a dict).
+    """
+    shard, workers = owner
+    keep = ns[mix64_array(ns) % np.uint64(workers) == shard]
+    if counts is not None:
+        counts['not_owned'] = counts.get('not_owned', 0) + len(ns) - len(keep)
+    return keep
+
+
+def generate_non_cheat_numbers(rng, min_val, max_val, count,
+                               max_attempts=10000, counts=None, owner=None):
+    """
+    Batch version of generate_non_cheat_number: an int64 array of count
+    uniform random numbers with at least one prime factor outside the first
+    100 primes, drawn with the NumPy Generator rng.
+
+    Candidates are drawn and filtered with is_smooth_array in batches. If some
+    samples are still missing after max_attempts candidates per sample, they
+    are random multiples of 547 (the 101st prime).
+
+    If owner is a pair (shard, workers), only the numbers of that shard are
+    kept (see owned). Candidates are filtered by owner before the smoothness
+    test, so the candidates of other shards are never tested; the multiples
+    of 547 are filtered afterwards, so there may then be fewer than count.
+
+    If counts is a dict, the numbers of candidates tested, of smooth
+    candidates rejected, of candidates of other shards, and of fallback
+    multiples of 547 are added to it.
+    """
+    workers = owner[1] if owner is not None else 1
+    chunks = []
+    missing = count
+    attempts = 0
+    while missing > 0 and attempts < max_attempts * count * workers:
+        # Almost all large integers are not smooth, so a little slack suffices
+        size = (missing + missing // 8 + 16) * workers
+        candidates = rng.integers(min_val, max_val, size=size, endpoint=True)
+        attempts += size
+        if owner is not None:
+            candidates = owned(candidates, owner, counts)
+        smooth = is_smooth_array(candidates)
+        if counts is not None:
+            counts['candidates'] = counts.get('candidates', 0) + len(candidates)
+            counts['smooth_rejected'] = (
+                counts.get('smooth_rejected', 0) + int(np.count_nonzero(smooth))
+            )
+        candidates = candidates[~smooth][:missing]
+        chunks.append(candidates)
+        missing -= len(candidates)
+    if counts is not None:
+        counts['fallback_547'] = counts.get('fallback_547', 0) + missing
+    if missing > 0:
+        multiples = rng.integers(min_val // 547, max_val // 547, size=missing,
+                                 endpoint=True) * 547
+        if owner is not None:
+            multiples = owned(multiples, owner, counts)
+        chunks.append(multiples)
+    return np.concatenate(chunks).astype(np.int64)
+
+
+def range_blocks(start, step, count):
+    """
+    Iterate over blocks (ns, mu) for n = start, start + step, ... (count total).
+
+    The integers are labelled by sieving one window of at most
+    SIEVE_SEGMENT_SIZE with mobius_segment at a time, instead of factoring
+    each n separately, and each window is yielded in blocks of BLOCK_SIZE,
+    like the batches of the other dataset types.
+    """
+    per_segment = max(1, SIEVE_SEGMENT_SIZE // step)
+    for i in range(0, count, per_segment):
+        num = min(per_segment, count - i)
+        lo = start + i*step
+        mu = mobius_segment(lo, (num - 1)*step + 1)[::step]
+        for j in range(0, num, BLOCK_SIZE):
+            block = min(BLOCK_SIZE, num - j)
+            ns = lo + step*np.arange(j, j + block, dtype=np.int64)
+            yield ns, mu[j:j + block]
+
+
 # Encoding format implementations
 def make_input_interCRT100(n):
     """
@@ -233,6 +399,58 @@ def make_input_CRT100_with_stats(n):
     return ' '.join(ret)
 
 
+# Batch encoding format implementations
+#
+# These take an int64 array of n and return the list of encoded inputs. They
+# produce exactly the same strings as the per-n functions above, but compute
+# all residues in one vectorized step and render a block of lines at a time.
+def _interleaved_tokens(residues):
+    tokens = np.empty((len(residues), 2*len(primes_100)), dtype=object)
+    tokens[:, 0::2] = small_integer_tokens(residues)
+    tokens[:, 1::2] = small_integer_tokens(PRIMES_100)
+    return tokens
+
+
+def render_interCRT100(residues):
+    """
+    Residue matrix (one row of residues mod primes_100 per sample) -> list of
+    interCRT100 inputs. The residues need not be correct.
+    """
+    return encode_token_matrix(_interleaved_tokens(residues))
+
+
+def make_inputs_interCRT100(ns):
+    """Batch version of make_input_interCRT100."""
+    return render_interCRT100(residue_matrix(ns))
+
+
+def make_inputs_CRT100(ns):
+    """Batch version of make_input_CRT100."""
+    return encode_token_matrix(small_integer_tokens(residue_matrix(ns)))
+
+
+def make_inputs_interCRT100_with_n(ns):
+    """Batch version of make_input_interCRT100_with_n."""
+    residues = residue_matrix(ns)
+    tokens = np.empty((len(residues), 2*len(primes_100) + 1), dtype=object)
+    tokens[:, :-1] = _interleaved_tokens(residues)
+    tokens[:, -1] = [encode_integer(n) for n in np.asarray(ns).tolist()]
+    return encode_token_matrix(tokens)
+
+
+def make_inputs_CRT100_with_stats(ns):
+    """Batch version of make_input_CRT100_with_stats."""
+    residues = residue_matrix(ns)
+    num_dividing_primes = np.count_nonzero(residues == 0, axis=1)
+    stats = np.empty((len(residues), 3), dtype=np.int64)
+    stats[:, 0] = num_dividing_primes
+    stats[:, 1] = len(primes_100)
+    stats[:, 2] = num_dividing_primes % 2
+    return encode_token_matrix(
+        small_integer_tokens(np.concatenate([residues, stats], axis=1))
+    )
+
+
 # Encoding format registry
 ENCODING_FORMATS = {
     'interCRT100': make_input_interCRT100,
@@ -241,13 +459,773 @@ ENCODING_FORMATS = {
     'CRT100_with_stats': make_input_CRT100_with_stats,
 }
 
+# Batch encoding format registry, with the same keys as ENCODING_FORMATS
+BATCH_ENCODING_FORMATS = {
+    'interCRT100': make_inputs_interCRT100,
+    'CRT100': make_inputs_CRT100,
+    'interCRT100_with_n': make_inputs_interCRT100_with_n,
+    'CRT100_with_stats': make_inputs_CRT100_with_stats,
+}
+
 
 def make_output_mu(n):
-    return str(dldmobius(n))
+    return str(mobius(n))
 
 
 def make_output_musq(n):
-    return str(dldmobius(n)**2)
+    return str(mobius(n)**2)
+
+
+# Label target registry: target name -> function of the dict of arrays
+# returned by utils.factor_stats
+LABEL_TARGETS = {
+    'mu': lambda s: np.where(s['squarefree'] == 1, 1 - 2*(s['omega'] % 2), 0),
+    'musq': lambda s: s['squarefree'],
+    'omega': lambda s: s['omega'],
+    'bigomega': lambda s: s['bigomega'],
+    'liouville': lambda s: 1 - 2*(s['bigomega'] % 2),
+    'rad': lambda s: s['rad'],
+    'spf': lambda s: s['spf'],
+}
+
+
+def make_labels(ns, targets, nthreads=1, known=None, cache=None):
+    """
+    Compute each label in targets for an array of n, factoring each n once.
+
+    known is an optional dict of labels that are already computed (such as mu
+    in range mode). If only mu and musq are needed, this uses mobius_array,
+    which can stop at the first square factor. Otherwise every target comes
+    from a single call to factor_stats. Large n are factored by Pollard rho
+    instead of trial division (see utils.label_factor_stats).
+
+    If cache is a label_cache.LabelCache, the statistics are looked up there
+    first, and only the n not found are factored. The cache is only used for
+    targets that cannot be derived from known.
+    """
+    labels = dict(known or {})
+    if 'musq' in targets and 'musq' not in labels and 'mu' in labels:
+        labels['musq'] = labels['mu'] * labels['mu']
+    missing = [target for target in targets if target not in labels]
+    if not missing:
+        return {target: labels[target] for target in targets}
+    if cache is not None:
+        stats = cache.factor_stats(ns, nthreads)
+        for target in missing:
+            labels[target] = LABEL_TARGETS[target](stats)
+    elif set(missing) <= {'mu', 'musq'}:
+        if 'mu' not in labels:
+            labels['mu'] = label_mobius_array(ns, nthreads)
+        if 'musq' in missing:
+            labels['musq'] = labels['mu'] * labels['mu']
+    else:
+        stats = label_factor_stats(ns, nthreads)
+        for target in missing:
+            labels[target] = LABEL_TARGETS[target](stats)
+    return {target: labels[target] for target in targets}
+
+
+class Outputs:
+    """
+    Where generated samples are written: one Int2Int text file for each label
+    target in text_paths (a dict target -> filename), and, if store_path is
+    given, a binary datastore with n and every target in targets.
+
+    Shards pass store_header=False and are joined by concatenate_stores.
+    If label_cache is a LabelCache, labels are looked up there first, and the
+    cache is closed (saving new labels) with the outputs.
+
+    If checkpoint_path is given, every n written is also logged to
+    checkpoint_path.ns, and checkpoint() saves the number of samples written,
+    the size of every file, and the sampler state to checkpoint_path.json,
+    at most once every checkpoint_every seconds. With resume=True, the files
+    are truncated to the sizes in the last checkpoint (if there is one) and
+    appended to; count and state are then those of the checkpoint.
+
+    If compress is a codec ('gzip' or 'zstd'), text files are written as
+    compressed shards of shard_lines lines instead (see shards.ShardWriter).
+
+    If tokens_path is given, the token ids of the inputs (of the given
+    encoding, token_length per sample) and the labels are also written there
+    (see tokens.TokenWriter).
+    """
+
+    def __init__(self, targets, text_paths, store_path=None, metadata=None,
+                 store_header=True, label_cache=None, checkpoint_path=None,
+                 checkpoint_every=300, resume=False, compress=None,
+                 shard_lines=DEFAULT_SHARD_LINES, compress_threads=None,
+                 tokens_path=None, encoding=None, token_length=None):
+        self.targets = list(targets)
+        self.label_cache = label_cache
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.last_checkpoint = time.monotonic()
+        self.count = 0
+        self.state = None
+
+        checkpoint = None
+        if resume and checkpoint_path is not None:
+            checkpoint = read_checkpoint(checkpoint_path)
+        if checkpoint is not None:
+            # Drop whatever was written after the checkpoint
+            for path, size in checkpoint['sizes'].items():
+                os.truncate(path, size)
+            self.count = checkpoint['count']
+            self.state = checkpoint['state']
+        mode = "a" if checkpoint is not None else "w"
+
+        if compress is not None:
+            resume_shards = checkpoint.get('shards', {}) if checkpoint else {}
+            self.text_files = {
+                target: ShardWriter(path, compress, shard_lines,
+                                    threads=compress_threads,
+                                    resume=resume_shards.get(target))
+                for target, path in text_paths.items()
+            }
+        else:
+            if checkpoint is None:
+                for path in text_paths.values():
+                    remove_shards(path)
+            self.text_files = {
+                target: open(path, mode, encoding="utf8", buffering=WRITE_BUFFER_SIZE)
+                for target, path in text_paths.items()
+            }
+        self.tokens = None
+        if tokens_path is not None:
+            self.tokens = TokenWriter(tokens_path, self.targets, token_length,
+                                      encoding, rows=self.count)
+        self.store = None
+        if store_path is not None:
+            self.store = DataStoreWriter(
+                store_path, self.targets, metadata, header=store_header,
+                append=checkpoint is not None
+            )
+        self.ns_log = None
+        if checkpoint_path is not None:
+            self.ns_log = open(f"{checkpoint_path}.ns", mode + "b")
+
+    def files(self):
+        """Every open file, except for sharded text files."""
+        files = [f for f in self.text_files.values()
+                 if not isinstance(f, ShardWriter)]
+        if self.tokens is not None:
+            files += self.tokens.files()
+        if self.store is not None:
+            files.append(self.store.file)
+        if self.ns_log is not None:
+            files.append(self.ns_log)
+        return files
+
+    def record(self, ns):
+        """Note that the samples ns were written."""
+        self.count += len(ns)
+        if self.ns_log is not None:
+            self.ns_log.write(np.asarray(ns, dtype='<i8').tobytes())
+
+    def written(self):
+        """int64 array of every n written so far (from the log)."""
+        self.ns_log.flush()
+        return np.fromfile(f"{self.checkpoint_path}.ns", dtype='<i8')
+
+    def write(self, batch):
+        """
+        Write a labelled (and, for text files, encoded, and for tokens,
+        tokenized) Batch, and save a checkpoint with its state if one is due.
+        Returns the number of bytes written.
+        """
+        written = 0
+        for target, outfile in self.text_files.items():
+            # The lines are ASCII, so characters are bytes
+            written += outfile.write(batch.lines[target])
+        if self.tokens is not None:
+            written += self.tokens.write(batch.tokens, batch.labels)
+        if self.store is not None:
+            start = self.store.file.tell()
+            self.store.write(batch.ns, batch.labels)
+            written += self.store.file.tell() - start
+        self.record(batch.ns)
+        self.checkpoint(batch.state)
+        return written
+
+    def checkpoint(self, state=None, force=False):
+        """
+        Save a checkpoint, if checkpoint_every seconds have passed since the
+        last one (or if force is true). state is the JSON-serializable sampler
+        state needed to continue from here.
+        """
+        if self.checkpoint_path is None:
+            return
+        if not force and time.monotonic() - self.last_checkpoint < self.checkpoint_every:
+            return
+        sizes = {}
+        for f in self.files():
+            f.flush()
+            os.fsync(f.fileno())
+            sizes[f.name] = os.fstat(f.fileno()).st_size
+        shards = {
+            target: f.sync() for target, f in self.text_files.items()
+            if isinstance(f, ShardWriter)
+        }
+        tmp = f"{self.checkpoint_path}.json.tmp"
+        with open(tmp, "w") as f:
+            json.dump({'count': self.count, 'sizes': sizes, 'shards': shards,
+                       'state': state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, f"{self.checkpoint_path}.json")
+        self.last_checkpoint = time.monotonic()
+
+    def close(self):
+        for outfile in self.text_files.values():
+            if isinstance(outfile, ShardWriter):
+                outfile.close()
+        if self.tokens is not None:
+            self.tokens.close()
+        for outfile in self.files():
+            outfile.close()
+        if self.label_cache is not None:
+            self.label_cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_checkpoint(checkpoint_path):
+    """The checkpoint saved by Outputs.checkpoint, or None if there is none."""
+    try:
+        with open(f"{checkpoint_path}.json") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# Targets with few enough values to keep a histogram of in metrics
+HISTOGRAM_TARGETS = ('mu', 'musq', 'omega', 'bigomega', 'liouville')
+
+
+def label_stage(targets, nthreads=1, cache=None, histograms=False):
+    """
+    Pipeline stage computing the labels in targets (see make_labels). With
+    histograms=True, the number of samples with each label value is counted
+    as "{target}={value}", for the targets in HISTOGRAM_TARGETS.
+    """
+    def label(batch):
+        hits = cache.hits if cache is not None else 0
+        batch.labels = make_labels(
+            batch.ns, targets, nthreads, batch.known, cache
+        )
+        if cache is not None:
+            batch.counts['cache_hits'] = cache.hits - hits
+        if histograms:
+            for target in targets:
+                if target in HISTOGRAM_TARGETS:
+                    values, counts = np.unique(batch.labels[target], return_counts=True)
+                    for value, count in zip(values.tolist(), counts.tolist()):
+                        batch.counts[f"{target}={value}"] = count
+        return batch
+    return label
+
+
+def encode_stage(input_batch_encoder, targets):
+    """Pipeline stage rendering the text lines of each target of a batch."""
+    def encode(batch):
+        inputs = input_batch_encoder(batch.ns)
+        batch.lines = {
+            target: make_lines(inputs, [str(x) for x in batch.labels[target].tolist()])
+            for target in targets
+        }
+        return batch
+    return encode
+
+
+def tokenize_stage(tokenizer):
+    """Pipeline stage computing the token ids of the inputs of a batch."""
+    def tokenize(batch):
+        batch.tokens = tokenizer(batch.ns)
+        return batch
+    return tokenize
+
+
+def write_stage(outputs, pbar=None):
+    """Pipeline stage writing each batch to an Outputs."""
+    def write(batch):
+        batch.counts['bytes'] = outputs.write(batch)
+        if pbar is not None:
+            pbar.update(len(batch))
+        return batch
+    return write
+
+
+def output_pipeline(outputs, input_batch_encoder, batches, nthreads=1,
+                    pbar=None, histograms=False):
+    """
+    The Pipeline that labels, encodes, and writes batches to outputs. Inputs
+    are only encoded if there are text files to write, and only tokenized if
+    there are tokens to write.
+    """
+    stages = [
+        ("label", label_stage(outputs.targets, nthreads, outputs.label_cache,
+                              histograms))
+    ]
+    if outputs.text_files:
+        stages.append(
+            ("encode", encode_stage(input_batch_encoder, list(outputs.text_files)))
+        )
+    if outputs.tokens is not None:
+        stages.append(("tokenize", tokenize_stage(encoding_tokenizer(
+            outputs.tokens.encoding, outputs.tokens.length
+        ))))
+    stages.append(("write", write_stage(outputs, pbar)))
+    return Pipeline(batches, stages)
+
+
+class PrintProgress:
+    """Stand-in for a tqdm progress bar that prints a line per update."""
+
+    def __init__(self, total):
+        self.total = total
+        self.n = 0
+
+    def update(self, k):
+        self.n += k
+        progress = 100 * self.n / self.total
+        print(f"  Progress: {self.n:,}/{self.total:,} ({progress:.1f}%)")
+
+    def close(self):
+        pass
+
+
+def make_progress_bar(total):
+    if HAS_TQDM:
+        return tqdm(total=total, desc="Generating samples", unit="samples")
+    return PrintProgress(total)
+
+
+def make_batch_sampler(dataset_type, min_value, max_value, rng, owner=None):
+    """
+    Select the batch number generator for the dataset type. The result maps
+    a count to an int64 array of that many samples drawn with the NumPy
+    Generator rng, and adds the numbers of rejected candidates to the dict
+    counts (if given).
+
+    If owner is a pair (shard, workers), the samples are only those of that
+    shard (see owned), and there are about count of them. For non_cheat, the
+    other shards' candidates are dropped before the smoothness test. Exact
+    uniform cheat samples cannot be drawn for one shard only, so the cheat
+    samples of other shards are drawn and then discarded: (workers - 1) /
+    workers of the sampling work, which is the price of distinct samples
+    across shards.
+    """
+    if dataset_type == 'cheat':
+        if owner is None:
+            return lambda count, counts=None: generate_cheat_numbers(
+                rng, min_value, max_value, count
+            )
+        return lambda count, counts=None: owned(generate_cheat_numbers(
+            rng, min_value, max_value, count * owner[1]
+        ), owner, counts)
+    if dataset_type == 'non_cheat':
+        return lambda count, counts=None: generate_non_cheat_numbers(
+            rng, min_value, max_value, count, counts=counts, owner=owner
+        )
+    raise ValueError(f"No batch sampler for dataset type {dataset_type}")
+
+
+def sampled_batches(sample_batch, num_samples, seen, rng=None):
+    """
+    Batches of distinct values drawn with sample_batch(count), until seen
+    (the set of values already written) has num_samples values.
+
+    Each batch carries the state of rng (the Generator used by sample_batch)
+    after drawing it, for checkpoints, and counts of the values drawn, those
+    belonging to other shards, and duplicates (within the batch or of
+    earlier samples), as well as the time spent drawing.
+    """
+    counts = {}
+    while len(seen) < num_samples:
+        count = min(BLOCK_SIZE, num_samples - len(seen))
+        t = time.perf_counter()
+        candidates = sample_batch(count, counts)
+        drawn = len(candidates)
+        counts['draw_seconds'] = counts.get('draw_seconds', 0) + time.perf_counter() - t
+        counts['drawn'] = counts.get('drawn', 0) + drawn
+        # Keep the first occurrence of each new value, in order
+        _, first = np.unique(candidates, return_index=True)
+        new = [n for n in candidates[np.sort(first)].tolist() if n not in seen]
+        counts['duplicates'] = (
+            counts.get('duplicates', 0) + len(candidates) - len(new)
+        )
+        block = new[:count]
+        if not block:
+            continue
+        seen.update(block)
+        batch = Batch(
+            np.array(block, dtype=np.int64),
+            state={'rng': rng.bit_generator.state} if rng is not None else None
+        )
+        batch.counts, counts = counts, {}
+        yield batch
+
+
+def natural_batches(sampler, start, num_samples):
+    """Samples start, ..., start + num_samples - 1 of a NaturalSampler."""
+    for i in range(start, start + num_samples, BLOCK_SIZE):
+        yield Batch(sampler.take(i, min(i + BLOCK_SIZE, start + num_samples)))
+
+
+def range_batches(start, step, num_samples):
+    """The range dataset n = start, start + step, ..., with mu already known."""
+    for ns, mu in range_blocks(start, step, num_samples):
+        yield Batch(ns, known={"mu": mu})
+
+
+def shard_seeds(seed, num_shards):
+    """
+    Derive independent seeds for each shard from the global seed.
+
+    This uses NumPy's SeedSequence, so the streams of different shards do not
+    overlap, and a fixed seed always gives the same shard seeds.
+    """
+    children = np.random.SeedSequence(seed).spawn(num_shards)
+    return [int(child.generate_state(1, np.uint64)[0]) for child in children]
+
+
+def shard_counts(num_samples, num_shards):
+    """Split num_samples into num_shards nearly equal counts."""
+    base, extra = divmod(num_samples, num_shards)
+    return [base + (1 if i < extra else 0) for i in range(num_shards)]
+
+
+def store_metadata(args):
+    """Description of how a dataset was sampled, for the datastore header."""
+    return {
+        'dataset_type': args.dataset_type,
+        'min_value': args.min_value,
+        'max_value': args.max_value,
+        'step': args.step,
+        'num_samples': args.num_samples,
+        'seed': args.seed,
+        'sampler_seed': args.sampler_seed,
+        'workers': args.workers,
+    }
+
+
+def open_label_cache(args):
+    """The LabelCache given by the command line arguments, or None."""
+    if args.label_cache is None:
+        return None
+    return LabelCache(args.label_cache, args.label_cache_mb)
+
+
+def write_dataset(args, outputs, offset, num_samples, rng, owner=None,
+                  pbar=None, metrics_path=None, profile_path=None):
+    """
+    Write num_samples samples of the dataset described by args to outputs,
+    continuing after the outputs.count samples already there (when
+    resuming), and save a final checkpoint. Returns the StageStats of the
+    pipeline.
+
+    For the natural and range datasets, these are samples offset, ...,
+    offset + num_samples - 1 of the sample sequence. Otherwise they are
+    drawn with the Generator rng, keeping only those of owner (see
+    make_batch_sampler).
+
+    Metrics are streamed to metrics_path, and the pipeline is profiled into
+    profile_path, if given (see monitor).
+    """
+    done = outputs.count
+    if pbar is not None:
+        pbar.update(done)
+    state = None
+    if args.dataset_type == 'natural':
+        sampler = NaturalSampler(
+            args.min_value, args.max_value, args.sampler_seed
+        )
+        batches = natural_batches(sampler, offset + done, num_samples - done)
+    elif args.dataset_type == 'range':
+        # Every n in the window is used, so there is nothing to sample
+        batches = range_batches(
+            args.min_value + (offset + done) * args.step, args.step,
+            num_samples - done
+        )
+    else:
+        if outputs.state is not None:
+            rng.bit_generator.state = outputs.state['rng']
+        sample_batch = make_batch_sampler(
+            args.dataset_type, args.min_value, args.max_value, rng, owner
+        )
+        seen = set(outputs.written().tolist()) if done else set()
+        batches = sampled_batches(sample_batch, num_samples, seen, rng)
+    pipeline = output_pipeline(
+        outputs, BATCH_ENCODING_FORMATS[args.encoding], batches, args.threads,
+        pbar, histograms=metrics_path is not None
+    )
+    with monitor(pipeline, metrics_path, profile_path, args.metrics_every):
+        stats = pipeline.run()
+    if args.dataset_type not in ('natural', 'range'):
+        state = {'rng': rng.bit_generator.state}
+    outputs.checkpoint(state, force=True)
+    return stats
+
+
+def pipeline_metrics(stats, elapsed):
+    """
+    JSON-serializable metrics of a pipeline run after elapsed seconds: the
+    call count, busy time, and throughput of every stage, the counts it
+    recorded, the histogram of each label, and the rates of rejected and
+    duplicate samples.
+    """
+    record = {'elapsed': elapsed, 'stages': {}}
+    for stage in stats:
+        counts = dict(stage.counts)
+        entry = {
+            'calls': stage.batches,
+            'samples': stage.samples,
+            'seconds': stage.seconds,
+            'samples_per_sec': stage.samples / stage.seconds if stage.seconds else None,
+        }
+        histograms = {}
+        for key in [key for key in counts if '=' in key]:
+            target, value = key.split('=')
+            histograms.setdefault(target, {})[value] = counts.pop(key)
+        if histograms:
+            entry['histograms'] = histograms
+        if counts:
+            entry['counts'] = counts
+        record['stages'][stage.name] = entry
+
+    counts = {}
+    for stage in stats:
+        counts.update(stage.counts)
+    record['samples'] = stats[-1].samples if stats else 0
+    if counts.get('drawn'):
+        record['duplicate_rate'] = counts.get('duplicates', 0) / counts['drawn']
+    if counts.get('candidates'):
+        record['rejection_rate'] = counts.get('smooth_rejected', 0) / counts['candidates']
+    if 'bytes' in counts:
+        record['bytes_written'] = counts['bytes']
+    return record
+
+
+@contextlib.contextmanager
+def monitor(pipeline, metrics_path=None, profile_path=None, every=10.0):
+    """
+    While the pipeline runs, stream its metrics (see pipeline_metrics) as
+    JSON lines to metrics_path, and profile it with a SamplingProfiler into
+    profile_path (in collapsed stack format), if these are given.
+    """
+    profiler = None
+    with contextlib.ExitStack() as stack:
+        if metrics_path is not None:
+            stack.enter_context(MetricsStream(
+                metrics_path,
+                lambda: pipeline_metrics(pipeline.stats, pipeline.elapsed()),
+                every
+            ))
+        if profile_path is not None:
+            profiler = stack.enter_context(SamplingProfiler(
+                threads=[stage.name for stage in pipeline.stats]
+            ))
+        yield
+    if profiler is not None:
+        profiler.write(profile_path)
+        print(f"Profile written to {profile_path}; most time in:")
+        for function, fraction in profiler.top(5):
+            print(f"  {fraction:6.1%}  {function}")
+
+
+def token_options(args, tokens_path):
+    """The token arguments of Outputs, for writing tokens to tokens_path."""
+    if tokens_path is None:
+        return {}
+    return {
+        'tokens_path': tokens_path,
+        'encoding': args.encoding,
+        'token_length': sequence_length(args.encoding, args.max_value),
+    }
+
+
+def shard_path(path, shard):
+    """The file of one shard for the file path (e.g. a checkpoint)."""
+    if path is None:
+        return None
+    return f"{path}.shard{shard}"
+
+
+def generate_shard(args, shard, shard_seed, num_samples, paths, store_path,
+                   checkpoint_path=None, tokens_path=None):
+    """
+    Generate one shard of the dataset described by args into paths, a dict
+    mapping each label target to a filename, into the datastore records file
+    store_path, and into the token dataset tokens_path (if not None). This is
+    run in a worker process.
+
+    For the natural and range datasets, shards are consecutive pieces of the
+    sample sequence. Otherwise each shard draws from its own random stream,
+    seeded by shard_seed, and only keeps the integers n with
+    mix64(n) % args.workers == shard.
+
+    Returns the shard and the StageStats of its pipeline, as dicts.
+    """
+    random.seed(shard_seed)
+    rng = np.random.default_rng(shard_seed)
+    offset = sum(shard_counts(args.num_samples, args.workers)[:shard])
+    with Outputs(args.targets, paths, store_path, store_header=False,
+                 label_cache=open_label_cache(args),
+                 checkpoint_path=checkpoint_path,
+                 checkpoint_every=args.checkpoint_every,
+                 resume=args.resume, compress=args.compress,
+                 shard_lines=args.shard_lines,
+                 compress_threads=args.compress_threads,
+                 **token_options(args, tokens_path)) as outputs:
+        stats = write_dataset(
+            args, outputs, offset, num_samples, rng,
+            owner=(shard, args.workers),
+            metrics_path=shard_path(args.metrics_out, shard),
+            profile_path=shard_path(args.profile, shard)
+        )
+    return shard, [stage.as_dict() for stage in stats]
+
+
+def _generate_shard_star(task):
+    return generate_shard(*task)
+
+
+def generate_sharded(args, filenames, store_path=None, checkpoint_path=None,
+                     tokens_path=None):
+    """
+    Generate the dataset in args.workers shards in a process pool, and then
+    concatenate the shards (in order) into filenames, a dict mapping each label
+    target to its output file, and into the datastore store_path and the token
+    dataset tokens_path (if given).
+    Each shard keeps its own checkpoint (see Outputs). Returns the StageStats
+    of all shards, added up.
+    """
+    counts = shard_counts(args.num_samples, args.workers)
+    seeds = shard_seeds(args.seed, args.workers)
+    paths = [
+        {target: f"{fname}.shard{i}" for target, fname in filenames.items()}
+        for i in range(args.workers)
+    ]
+    store_paths = [
+        f"{store_path}.shard{i}" if store_path is not None else None
+        for i in range(args.workers)
+    ]
+    tasks = [
+        (args, i, seeds[i], counts[i], paths[i], store_paths[i],
+         shard_path(checkpoint_path, i), shard_path(tokens_path, i))
+        for i in range(args.workers)
+    ]
+
+    counter = None
+    if args.dataset_type == 'cheat':
+        # Count once here, and hand the counts to the workers: forked workers
+        # share them, and with other start methods they are sent once to
+        # each worker instead of being counted again there
+        counter = smooth_counter(args.min_value, args.max_value)
+
+    pbar = make_progress_bar(args.num_samples)
+    shard_stats = []
+    with multiprocessing.Pool(args.workers, initializer=use_smooth_counter,
+                              initargs=(counter,)) as pool:
+        for shard, stats in pool.imap_unordered(_generate_shard_star, tasks):
+            pbar.update(counts[shard])
+            shard_stats.append([StageStats.from_dict(d) for d in stats])
+    pbar.close()
+
+    # Shards are only deleted once every output is complete, so that an
+    # interrupted run can still be resumed
+    for target, filename in filenames.items():
+        if args.compress is not None:
+            join_shards([shard_paths[target] for shard_paths in paths], filename)
+            continue
+        remove_shards(filename)
+        with open(filename, "wb") as outfile:
+            for shard_paths in paths:
+                with open(shard_paths[target], "rb") as infile:
+                    shutil.copyfileobj(infile, outfile)
+    for shard_paths in paths:
+        for path in shard_paths.values():
+            if args.compress is not None:
+                remove_shards(path)
+            else:
+                os.remove(path)
+    if store_path is not None:
+        concatenate_stores(
+            store_path, args.targets, store_metadata(args), store_paths
+        )
+    if tokens_path is not None:
+        token_paths = [shard_path(tokens_path, i) for i in range(args.workers)]
+        join_tokens(token_paths, tokens_path)
+        for path in token_paths:
+            remove_tokens(path)
+    return merge_stats(shard_stats)
+
+
+# Source files that determine the generated data, for artifact keys
+CODE_FILES = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    for name in ('generate_datafiles.py', 'utils.py', 'datastore.py',
+                 'shards.py', 'tokens.py',
+                 os.path.join('..', 'mobius_code', 'mobius.cpp'))
+]
+
+
+def artifact_params(args):
+    """The parameters that determine the generated files."""
+    params = {
+        'encoding': args.encoding,
+        'dataset_type': args.dataset_type,
+        'min_value': args.min_value,
+        'max_value': args.max_value,
+        'num_samples': args.num_samples,
+        'seed': args.seed,
+        'targets': args.targets,
+        'format': args.format,
+    }
+    if args.dataset_type == 'range':
+        params['step'] = args.step
+    if args.dataset_type in ('cheat', 'non_cheat'):
+        # Each shard draws from its own random stream
+        params['workers'] = args.workers
+    if args.compress is not None:
+        params['compress'] = args.compress
+        params['shard_lines'] = args.shard_lines
+    if args.tokens:
+        params['tokens'] = True
+    return params
+
+
+def artifact_destinations(artifact, paths):
+    """
+    Map each file of an artifact to where it belongs: next to the path in
+    paths with the same name, or, for the shards and index of a compressed
+    text file or a token dataset, next to the path they belong to.
+    """
+    destinations = {}
+    for name in read_manifest(artifact)['files']:
+        for path in paths:
+            base = os.path.basename(path)
+            if name == base or name.startswith(base + "."):
+                destinations[name] = os.path.join(os.path.dirname(path), name)
+    return destinations
+
+
+def remove_stale_outputs(filenames, compress):
+    """
+    Delete what an earlier run left at filenames in the other form: the plain
+    files if the outputs are compressed, and the shards if not. Otherwise a
+    stale index would shadow a new plain file when reading (see
+    shards.open_text), and a stale plain file would sit next to new shards.
+    """
+    for fname in filenames.values():
+        if compress is None:
+            remove_shards(fname)
+        elif os.path.exists(fname):
+            os.remove(fname)
 
 
 def get_output_filename(encoding_format, task):
@@ -272,8 +1250,8 @@ def main():
         '--dataset_type',
         type=str,
         default='natural',
-        choices=['natural', 'cheat', 'non_cheat'],
-        help='Dataset type: natural (uniform random), cheat (only first 100 prime factors), non_cheat (at least one prime factor outside first 100)'
+        choices=['natural', 'cheat', 'non_cheat', 'range'],
+        help='Dataset type: natural (uniform random), cheat (only first 100 prime factors), non_cheat (at least one prime factor outside first 100), range (every step-th n starting at min_value, labelled by sieving)'
     )
     parser.add_argument(
         '--num_samples',
@@ -293,6 +1271,12 @@ def main():
         default=10**13,
         help='Maximum value for random integers'
     )
+    parser.add_argument(
+        '--step',
+        type=int,
+        default=1,
+        help='Spacing between consecutive n (only used for the range dataset)'
+    )
     parser.add_argument(
         '--output_dir',
         type=str,
@@ -305,84 +1289,318 @@ def main():
         default=None,
         help='Random seed for reproducibility'
     )
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=1,
+        help='Number of OpenMP threads for computing mu (0 means all cores)'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of worker processes; each generates one shard of the data'
+    )
+    parser.add_argument(
+        '--targets',
+        type=str,
+        default='mu,musq',
+        help=f'Comma-separated label targets, each written to its own file (from {", ".join(LABEL_TARGETS)})'
+    )
+    parser.add_argument(
+        '--format',
+        type=str,
+        default='text',
+        choices=['text', 'binary', 'both'],
+        help='Write Int2Int text files, a binary datastore (see datastore.py), or both'
+    )
+    parser.add_argument(
+        '--artifact_dir',
+        type=str,
+        default=None,
+        help='Directory of cached datasets (default: OUTPUT_DIR/artifacts); see artifacts.py'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Regenerate the dataset even if it is cached'
+    )
+    parser.add_argument(
+        '--verify',
+        action='store_true',
+        help='Verify the checksums of a cached dataset before using it'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continue an interrupted run (with the same arguments) from its last checkpoint'
+    )
+    parser.add_argument(
+        '--checkpoint_every',
+        type=float,
+        default=300,
+        help='Seconds between checkpoints of a run with --seed'
+    )
+    parser.add_argument(
+        '--label_cache',
+        type=str,
+        default=None,
+        help='Directory of a persistent label cache (see label_cache.py) to look up labels in and add new labels to'
+    )
+    parser.add_argument(
+        '--label_cache_mb',
+        type=float,
+        default=DEFAULT_MAX_MB,
+        help='Size bound of the label cache in MB; the entries used least recently are evicted'
+    )
+    parser.add_argument(
+        '--compress',
+        type=str,
+        default='none',
+        choices=['none', *CODECS],
+        help='Write text files as compressed shards with an index (see shards.py)'
+    )
+    parser.add_argument(
+        '--shard_lines',
+        type=int,
+        default=DEFAULT_SHARD_LINES,
+        help='Lines in each compressed shard'
+    )
+    parser.add_argument(
+        '--compress_threads',
+        type=int,
+        default=None,
+        help='Threads compressing shards (default: up to 4)'
+    )
+    parser.add_argument(
+        '--tokens',
+        action='store_true',
+        help='Also write the token ids of the inputs and the labels as .npy shards, for tokens.TokenDataset'
+    )
+    parser.add_argument(
+        '--metrics_out',
+        type=str,
+        default=None,
+        help='Append the time, call counts, rejection rates, label histograms, and bytes written of each stage to this file as JSON lines while running'
+    )
+    parser.add_argument(
+        '--metrics_every',
+        type=float,
+        default=10,
+        help='Seconds between lines of --metrics_out'
+    )
+    parser.add_argument(
+        '--profile',
+        type=str,
+        default=None,
+        help='Profile the generation with a sampling profiler, and write the stacks to this file (collapsed format, for flamegraph.pl or speedscope)'
+    )
 
     args = parser.parse_args()
 
-    # Set random seed if provided
+    if args.workers < 1:
+        parser.error("--workers must be positive")
+    args.targets = list(dict.fromkeys(args.targets.split(',')))
+    for target in args.targets:
+        if target not in LABEL_TARGETS:
+            parser.error(f"unknown label target {target}")
+
+    args.compress = None if args.compress == 'none' else args.compress
+    if args.compress == 'zstd' and not HAS_ZSTD:
+        parser.error("--compress zstd needs the zstandard package: pip install zstandard")
+    if args.shard_lines < 1:
+        parser.error("--shard_lines must be positive")
+
+    if args.resume and args.seed is None:
+        parser.error("--resume needs the --seed of the interrupted run")
+
+    # Labels can be computed for any n, but samples are stored as int64
+    if args.max_value >= 2**63:
+        parser.error("--max_value must be below 2^63")
+
+    if args.dataset_type == 'range':
+        if args.step < 1:
+            parser.error("--step must be positive")
+        last_value = args.min_value + args.step * (args.num_samples - 1)
+        if args.min_value < 1 or last_value > args.max_value:
+            parser.error(
+                f"range dataset [{args.min_value}, {last_value}] does not fit "
+                f"in [1, {args.max_value}]"
+            )
+
+    if args.dataset_type == 'natural':
+        if args.num_samples > args.max_value - args.min_value + 1:
+            parser.error(
+                f"cannot draw {args.num_samples} distinct integers from "
+                f"[{args.min_value}, {args.max_value}]"
+            )
+
+    if args.dataset_type == 'cheat':
+        num_smooth = smooth_counter(args.min_value, args.max_value).count()
+        if args.num_samples > num_smooth:
+            parser.error(
+                f"cannot draw {args.num_samples} distinct integers from the "
+                f"{num_smooth} integers in [{args.min_value}, {args.max_value}] "
+                f"with only the first 100 primes as factors"
+            )
+
+    # Set random seed if provided (shards derive their own seeds from it)
     if args.seed is not None:
         random.seed(args.seed)
         print(f"Random seed set to: {args.seed}")
-
-    # Select number generator based on dataset type
-    if args.dataset_type == 'natural':
-        generate_number = lambda: generate_natural_number(args.min_value, args.max_value)
-    elif args.dataset_type == 'cheat':
-        generate_number = lambda: generate_cheat_number(args.min_value, args.max_value)
-    elif args.dataset_type == 'non_cheat':
-        generate_number = lambda: generate_non_cheat_number(args.min_value, args.max_value)
+    # Key for the natural sampler's permutation, shared by all shards
+    if args.seed is not None:
+        args.sampler_seed = args.seed
+    else:
+        args.sampler_seed = np.random.SeedSequence().entropy
 
     # Create encoding-specific subdirectory with dataset type
     encoding_dir = os.path.join(args.output_dir, f"input_dir_{args.encoding}_{args.dataset_type}")
     os.makedirs(encoding_dir, exist_ok=True)
 
-    # Get encoding function
-    input_encoder = ENCODING_FORMATS[args.encoding]
-
-    # Generate filenames with dataset type suffix
-    base_mu_filename = get_output_filename(args.encoding, "mu")
-    base_musq_filename = get_output_filename(args.encoding, "musq")
-
-    # Add dataset type to filename (before .txt extension)
-    mu_filename = os.path.join(encoding_dir, base_mu_filename.replace('.txt', f'_{args.dataset_type}.txt'))
-    musq_filename = os.path.join(encoding_dir, base_musq_filename.replace('.txt', f'_{args.dataset_type}.txt'))
-
-    # Check if files already exist
-    if os.path.exists(mu_filename) and os.path.exists(musq_filename):
-        print(f"Data files already exist for {args.encoding} with dataset type {args.dataset_type}:")
-        print(f"  - {mu_filename}")
-        print(f"  - {musq_filename}")
-        print("Skipping generation. Delete these files if you want to regenerate.")
-        return
+    # Generate filenames with dataset type suffix (before .txt extension)
+    filenames = {}
+    if args.format in ('text', 'both'):
+        filenames = {
+            target: os.path.join(
+                encoding_dir,
+                get_output_filename(args.encoding, target).replace('.txt', f'_{args.dataset_type}.txt')
+            )
+            for target in args.targets
+        }
+    # The datastore does not depend on the encoding
+    store_path = None
+    if args.format in ('binary', 'both'):
+        store_path = os.path.join(args.output_dir, f"store_{args.dataset_type}.bin")
+    all_files = list(filenames.values()) + ([store_path] if store_path else [])
+    tokens_path = None
+    if args.tokens:
+        tokens_path = os.path.join(
+            encoding_dir, f"tokens_{args.encoding}_{args.dataset_type}"
+        )
 
     print(f"Generating {args.num_samples} samples with encoding: {args.encoding}")
     print(f"Dataset type: {args.dataset_type}")
-    print(f"Integer range: [{args.min_value}, {args.max_value}]")
+    if args.dataset_type == 'range':
+        print(f"Integer range: [{args.min_value}, {last_value}] with step {args.step}")
+    else:
+        print(f"Integer range: [{args.min_value}, {args.max_value}]")
     print(f"Output files:")
-    print(f"  - {mu_filename}")
-    print(f"  - {musq_filename}")
-
-    seen = set()
-    with (
-        open(mu_filename, "w", encoding="utf8") as mufile,
-        open(musq_filename, "w", encoding="utf8") as musqfile,
-    ):
-        if HAS_TQDM:
-            # Use tqdm progress bar
-            pbar = tqdm(total=args.num_samples, desc="Generating samples", unit="samples")
-            while len(seen) < args.num_samples:
-                n = generate_number()
-                if n in seen:
-                    continue
-                seen.add(n)
-                mufile.write(make_line(input_encoder, make_output_mu, n))
-                musqfile.write(make_line(input_encoder, make_output_musq, n))
-                pbar.update(1)
-            pbar.close()
-        else:
-            # Fallback to simple progress messages
-            while len(seen) < args.num_samples:
-                n = generate_number()
-                if n in seen:
-                    continue
-                seen.add(n)
-                mufile.write(make_line(input_encoder, make_output_mu, n))
-                musqfile.write(make_line(input_encoder, make_output_musq, n))
-
-                # Progress indicator every 10,000 samples
-                if len(seen) % 10000 == 0:
-                    progress = 100 * len(seen) / args.num_samples
-                    print(f"  Progress: {len(seen):,}/{args.num_samples:,} ({progress:.1f}%)")
+    for fname in all_files:
+        sharded = args.compress is not None and fname in filenames.values()
+        print(f"  - {fname}" + (f" ({args.compress} shards)" if sharded else ""))
+    if tokens_path is not None:
+        print(f"  - {tokens_path}.*.npy (tokens)")
+
+    remove_stale_outputs(filenames, args.compress)
+    if args.seed is None:
+        # Without a seed the dataset is not reproducible, so it is neither
+        # cached nor checkpointed. Files are only renamed once complete.
+        generate(
+            args,
+            {target: f"{fname}.partial" for target, fname in filenames.items()},
+            f"{store_path}.partial" if store_path else None,
+            tokens_path=f"{tokens_path}.partial" if tokens_path else None
+        )
+        for fname in all_files:
+            if args.compress is not None and fname in filenames.values():
+                join_shards([f"{fname}.partial"], fname)
+                remove_shards(f"{fname}.partial")
+            else:
+                os.replace(f"{fname}.partial", fname)
+        if tokens_path is not None:
+            join_tokens([f"{tokens_path}.partial"], tokens_path)
+            remove_tokens(f"{tokens_path}.partial")
+        print_summary(args)
+        return
+
+    # Datasets are cached under a hash of their parameters and the code
+    artifact_dir = args.artifact_dir or os.path.join(args.output_dir, "artifacts")
+    store = ArtifactStore(artifact_dir, code_version(CODE_FILES))
+    params = artifact_params(args)
+    artifact = None if args.force else store.lookup(params, args.verify)
+    if artifact is not None:
+        materialize(artifact, artifact_destinations(
+            artifact, all_files + ([tokens_path] if tokens_path else [])
+        ))
+        print(f"Using the cached dataset {artifact}")
+        return
+
+    staging = store.stage(params, keep=args.resume)
+    checkpoint_dir = os.path.join(staging, "checkpoint")
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    generate(
+        args,
+        {target: os.path.join(staging, os.path.basename(fname))
+         for target, fname in filenames.items()},
+        os.path.join(staging, os.path.basename(store_path)) if store_path else None,
+        os.path.join(checkpoint_dir, "outputs"),
+        os.path.join(staging, os.path.basename(tokens_path)) if tokens_path else None
+    )
+    shutil.rmtree(checkpoint_dir)
+    artifact = store.commit(staging, params)
+    materialize(artifact, artifact_destinations(
+        artifact, all_files + ([tokens_path] if tokens_path else [])
+    ))
+    print(f"Cached as {artifact}")
+    print_summary(args)
+
+
+def generate(args, filenames, store_path, checkpoint_path=None,
+             tokens_path=None):
+    """
+    Generate the dataset described by args into filenames, a dict mapping each
+    label target to a text file, and into the datastore store_path and the
+    token dataset tokens_path (if not None), with checkpoints at
+    checkpoint_path (if not None).
+    """
+    if args.workers > 1:
+        print(f"Using {args.workers} worker processes")
+        start = time.perf_counter()
+        stats = generate_sharded(
+            args, filenames, store_path, checkpoint_path, tokens_path
+        )
+        print_stage_stats(stats, "summed over workers")
+        if args.metrics_out is not None:
+            # Each shard streams its own metrics; add up the totals here
+            record = pipeline_metrics(stats, time.perf_counter() - start)
+            with open(args.metrics_out, "a", encoding="utf8") as f:
+                f.write(json.dumps({'time': time.time(), **record,
+                                    'workers': args.workers, 'final': True}) + "\n")
+        return
 
+    label_cache = open_label_cache(args)
+    with Outputs(args.targets, filenames, store_path, store_metadata(args),
+                 label_cache=label_cache, checkpoint_path=checkpoint_path,
+                 checkpoint_every=args.checkpoint_every,
+                 resume=args.resume, compress=args.compress,
+                 shard_lines=args.shard_lines,
+                 compress_threads=args.compress_threads,
+                 **token_options(args, tokens_path)) as outputs:
+        if outputs.count:
+            print(f"Resuming after {outputs.count:,} samples")
+        pbar = make_progress_bar(args.num_samples)
+        stats = write_dataset(
+            args, outputs, 0, args.num_samples,
+            np.random.default_rng(args.seed), pbar=pbar,
+            metrics_path=args.metrics_out, profile_path=args.profile
+        )
+        pbar.close()
+    print_stage_stats(stats)
+
+    if label_cache is not None:
+        print(f"Label cache: {label_cache.hits:,} hits, "
+              f"{label_cache.misses:,} integers factored")
+
+
+def print_stage_stats(stats, note=None):
+    """Print the throughput of each pipeline stage."""
+    print("Pipeline stages" + (f" ({note})" if note else "") + ":")
+    for stage in stats:
+        print(f"  {stage}")
+
+
+def print_summary(args):
     print(f"\nDone! Generated {args.num_samples:,} samples.")
     print(f"\nEncoding format details ({args.encoding}):")
     if args.encoding == 'interCRT100':
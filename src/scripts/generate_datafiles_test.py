@@ -0,0 +1,130 @@
+import contextlib
+import functools
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import generate_datafiles
+from generate_datafiles import BATCH_ENCODING_FORMATS, ENCODING_FORMATS, Outputs
+from tokens import TokenDataset, TokenWriter
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupted_write(checkpoint_after, stop_after):
+    """
+    Outputs.write, saving a checkpoint after checkpoint_after batches and
+    raising Interrupted after stop_after batches, so that the batches in
+    between are written but lost.
+    """
+    write = Outputs.write
+
+    def wrapper(self, batch):
+        written = write(self, batch)
+        self.test_batches = getattr(self, 'test_batches', 0) + 1
+        if self.test_batches == checkpoint_after:
+            self.checkpoint(batch.state, force=True)
+        if self.test_batches == stop_after:
+            raise Interrupted
+        return written
+    return wrapper
+
+
+def output_files(output_dir):
+    """Relative path -> contents of every output file (but not the cache)."""
+    files = {}
+    for root, dirs, names in os.walk(output_dir):
+        dirs[:] = [d for d in dirs if d != 'artifacts']
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, output_dir)] = f.read()
+    return files
+
+
+class TestEncodings(unittest.TestCase):
+    def test_batch_encodings(self):
+        rng = np.random.default_rng(1)
+        ns = [0, 1, 2, 999, 1000, 1001, 2 * 3 * 5 * 7 * 541, 2**63 - 1]
+        ns += rng.integers(2, 10**13, 200).tolist()
+        ns += rng.integers(2, 2**63 - 1, 200, dtype=np.int64).tolist()
+        self.assertEqual(sorted(BATCH_ENCODING_FORMATS), sorted(ENCODING_FORMATS))
+        for name, encode in ENCODING_FORMATS.items():
+            self.assertEqual(
+                BATCH_ENCODING_FORMATS[name](np.array(ns, dtype=np.int64)),
+                [encode(n) for n in ns], name
+            )
+            self.assertEqual(BATCH_ENCODING_FORMATS[name](np.array([], dtype=np.int64)), [])
+
+
+class TestResume(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_main(self, output_dir, options, resume=False):
+        argv = ['generate_datafiles.py', '--output_dir', output_dir,
+                '--num_samples', '6000', '--max_value', str(10**12),
+                '--seed', '5', '--format', 'both', '--tokens',
+                '--checkpoint_every', '3600', *options]
+        if resume:
+            argv.append('--resume')
+        with mock.patch('sys.argv', argv), \
+                contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            generate_datafiles.main()
+
+    def check_resume(self, *options):
+        complete = os.path.join(self.tmpdir.name, "complete")
+        resumed = os.path.join(self.tmpdir.name, "resumed")
+        # Small batches and token shards, so that the run is interrupted in
+        # the middle of a token shard, after its checkpoint
+        with mock.patch('generate_datafiles.BLOCK_SIZE', 500), \
+                mock.patch('generate_datafiles.TokenWriter',
+                           functools.partial(TokenWriter, shard_rows=2000)):
+            self.run_main(complete, options)
+            with mock.patch.object(Outputs, 'write', interrupted_write(2, 3)):
+                with self.assertRaises(Interrupted):
+                    self.run_main(resumed, options)
+            self.run_main(resumed, options, resume=True)
+
+        expected = output_files(complete)
+        self.assertTrue(any(name.endswith(".bin") for name in expected))
+        self.assertTrue(any(name.endswith(".npy") for name in expected))
+        files = output_files(resumed)
+        self.assertEqual(sorted(files), sorted(expected))
+        for name, contents in expected.items():
+            # Compare without a diff, which is far too slow for these files
+            self.assertTrue(files[name] == contents, f"{name} differs")
+
+        [index] = [name for name in expected
+                   if os.path.basename(name).startswith("tokens_")
+                   and name.endswith(".index.json")]
+        dataset = TokenDataset(os.path.join(resumed, index[:-len(".index.json")]))
+        self.assertEqual(len(dataset), 6000)
+        tokens, _ = dataset.batch(np.arange(6000))
+        for i in (0, 2500, 5999):
+            self.assertEqual(np.asarray(dataset[i][0]).tolist(),
+                             np.asarray(tokens)[i].tolist())
+
+    def test_resume(self):
+        self.check_resume('--dataset_type', 'non_cheat')
+
+    def test_resume_workers(self):
+        self.check_resume('--dataset_type', 'non_cheat', '--workers', '2')
+
+    def test_resume_compressed(self):
+        self.check_resume('--dataset_type', 'natural', '--workers', '2',
+                          '--compress', 'gzip', '--shard_lines', '700')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,302 @@
+"""
+label_cache.py - a persistent on-disk cache of the labels of n
+
+Every label target is derived from the statistics of utils.factor_stats
+(omega, bigomega, squarefree, spf, rad). A LabelCache keeps these statistics
+for every n it has seen in a directory, as one memory-mapped .npy file per
+column, sorted by n:
+
+    cache_dir/CURRENT            name of the current table directory
+    cache_dir/table.{k}/n.npy    sorted int64 array of n
+    cache_dir/table.{k}/*.npy    the statistics, and the epoch (run) in which
+                                 each n was last used
+
+Lookups are batched binary searches in the memory-mapped n column. Newly
+computed labels are kept in memory and merged into a new table directory on
+flush, which then replaces the old one. When the cache is larger than its size
+bound, the entries from the oldest runs are evicted. A lock file makes this
+safe for several processes (e.g. shards) sharing one cache.
+
+To see what a cache holds, or to delete it, run
+
+    python label_cache.py ../../input/label_cache [--clear]
+
+## License Information ##
+
+Copyright © 2025 David Lowry-Duda <david@lowryduda.com>
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import argparse
+import contextlib
+import fcntl
+import os
+import shutil
+
+import numpy as np
+
+from utils import label_factor_stats
+
+
+# The statistics of utils.factor_stats, with their types
+STAT_DTYPES = {
+    'omega': np.int8,
+    'bigomega': np.int8,
+    'squarefree': np.int8,
+    'spf': np.int64,
+    'rad': np.int64,
+}
+
+# Every column of the table
+COLUMN_DTYPES = {'n': np.int64, **STAT_DTYPES, 'epoch': np.uint32}
+
+# Bytes per cached n
+ENTRY_BYTES = sum(np.dtype(dt).itemsize for dt in COLUMN_DTYPES.values())
+
+DEFAULT_MAX_MB = 1024
+
+# Newly computed labels are merged into the table once this many are pending,
+# and the epochs of the cached n looked up are updated once this many are
+FLUSH_ENTRIES = 2**22
+
+
+class LabelCache:
+    """
+    The cache in the directory path, holding at most max_mb megabytes of
+    labels. Use factor_stats in place of utils.label_factor_stats, and close
+    (or flush) to write newly computed labels to disk.
+
+    Integers that do not fit in an int64 are never cached.
+    """
+
+    def __init__(self, path, max_mb=DEFAULT_MAX_MB):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_entries = max(1, int(max_mb * 2**20) // ENTRY_BYTES)
+        self.pending = []
+        self.touched = []
+        self.num_pending = 0
+        self.num_touched = 0
+        self.hits = 0
+        self.misses = 0
+        with self._lock(fcntl.LOCK_SH):
+            self.columns = self._load()
+        epochs = self.columns['epoch']
+        self.epoch = int(epochs.max()) + 1 if len(epochs) else 1
+
+    @contextlib.contextmanager
+    def _lock(self, operation):
+        with open(os.path.join(self.path, "lock"), "a") as lockfile:
+            fcntl.flock(lockfile, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def _current(self):
+        """Name of the current table directory, or None if there is none."""
+        try:
+            with open(os.path.join(self.path, "CURRENT")) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _load(self, mode='r'):
+        """Memory-map the columns of the current table (under a lock)."""
+        current = self._current()
+        if current is None:
+            return {
+                key: np.empty(0, dtype=dt) for key, dt in COLUMN_DTYPES.items()
+            }
+        return {
+            key: np.load(
+                os.path.join(self.path, current, f"{key}.npy"), mmap_mode=mode
+            )
+            for key in COLUMN_DTYPES
+        }
+
+    def __len__(self):
+        return len(self.columns['n'])
+
+    def lookup(self, ns):
+        """
+        Look up an int64 array of n. Returns a boolean array of which n were
+        found, and a dict of statistics arrays which are filled in where found.
+        """
+        ns = np.asarray(ns, dtype=np.int64)
+        table = self.columns['n']
+        stats = {
+            key: np.zeros(len(ns), dtype=dt) for key, dt in STAT_DTYPES.items()
+        }
+        if len(table) == 0:
+            return np.zeros(len(ns), dtype=bool), stats
+        idx = np.searchsorted(table, ns)
+        idx[idx == len(table)] = 0
+        found = table[idx] == ns
+        idx = idx[found]
+        for key in STAT_DTYPES:
+            stats[key][found] = self.columns[key][idx]
+        self.touched.append(ns[found])
+        self.num_touched += len(idx)
+        if self.num_touched >= FLUSH_ENTRIES:
+            self.flush()
+        return found, stats
+
+    def add(self, ns, stats):
+        """Add labels computed for the int64 array ns, merged on flush."""
+        self.pending.append(
+            (np.asarray(ns, dtype=np.int64),
+             {key: np.asarray(stats[key], dtype=STAT_DTYPES[key])
+              for key in STAT_DTYPES})
+        )
+        self.num_pending += len(ns)
+        if self.num_pending >= FLUSH_ENTRIES:
+            self.flush()
+
+    def factor_stats(self, ns, nthreads=1):
+        """
+        utils.label_factor_stats, computing only the n not already cached.
+        """
+        ns = np.asarray(ns)
+        if ns.dtype == object:
+            return label_factor_stats(ns, nthreads)
+        found, stats = self.lookup(ns)
+        missing = ~found
+        self.hits += int(np.count_nonzero(found))
+        self.misses += int(np.count_nonzero(missing))
+        if missing.any():
+            computed = label_factor_stats(ns[missing], nthreads)
+            for key in STAT_DTYPES:
+                stats[key][missing] = computed[key]
+            self.add(ns[missing], computed)
+        return stats
+
+    def flush(self):
+        """
+        Merge the pending labels into the table on disk, mark the entries
+        used in this run, and evict the oldest entries if the table is too
+        large.
+        """
+        if not self.pending and not self.touched:
+            return
+        with self._lock(fcntl.LOCK_EX):
+            if not self.pending:
+                # Only the epochs change, so update them in place
+                columns = self._load(mode='r+')
+                idx, found = self._find(columns['n'], self.touched)
+                columns['epoch'][idx[found]] = self.epoch
+                columns['epoch'].flush()
+            else:
+                self._write(self._merge(self._load()))
+            self.columns = self._load()
+        self.pending = []
+        self.touched = []
+        self.num_pending = 0
+        self.num_touched = 0
+
+    @staticmethod
+    def _find(table, arrays):
+        ns = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+        if len(table) == 0:
+            return np.zeros(len(ns), dtype=np.int64), np.zeros(len(ns), dtype=bool)
+        idx = np.searchsorted(table, ns)
+        idx[idx == len(table)] = 0
+        return idx, table[idx] == ns
+
+    def _merge(self, columns):
+        """The table columns with the pending labels merged in, in memory."""
+        new = {'n': np.concatenate([ns for ns, _ in self.pending])}
+        for key in STAT_DTYPES:
+            new[key] = np.concatenate([stats[key] for _, stats in self.pending])
+        new['epoch'] = np.full(len(new['n']), self.epoch, dtype=np.uint32)
+
+        merged = {
+            key: np.concatenate([np.asarray(columns[key]), new[key]])
+            for key in COLUMN_DTYPES
+        }
+        idx, found = self._find(columns['n'], self.touched)
+        merged['epoch'][idx[found]] = self.epoch
+
+        # Sort by n, and keep one entry for each n
+        order = np.argsort(merged['n'], kind='stable')
+        keep = np.ones(len(order), dtype=bool)
+        keep[1:] = merged['n'][order[1:]] != merged['n'][order[:-1]]
+        order = order[keep]
+
+        if len(order) > self.max_entries:
+            # Evict the entries last used in the oldest runs
+            newest = np.argsort(merged['epoch'][order], kind='stable')
+            order = order[np.sort(newest[-self.max_entries:])]
+        return {key: merged[key][order] for key in COLUMN_DTYPES}
+
+    def _write(self, columns):
+        """Write columns as a new table directory, and make it current."""
+        old = self._current()
+        generation = int(old.split(".")[1]) + 1 if old else 0
+        name = f"table.{generation}"
+        os.makedirs(os.path.join(self.path, name), exist_ok=True)
+        for key, column in columns.items():
+            np.save(os.path.join(self.path, name, f"{key}.npy"), column)
+        tmp = os.path.join(self.path, "CURRENT.tmp")
+        with open(tmp, "w") as f:
+            f.write(name)
+        os.replace(tmp, os.path.join(self.path, "CURRENT"))
+        if old is not None:
+            # Open memory maps of the old table stay valid after this
+            shutil.rmtree(os.path.join(self.path, old), ignore_errors=True)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Summarize or delete a persistent label cache'
+    )
+    parser.add_argument('path', type=str, help='Cache directory')
+    parser.add_argument(
+        '--clear',
+        action='store_true',
+        help='Delete the cache'
+    )
+    args = parser.parse_args()
+
+    if args.clear:
+        shutil.rmtree(args.path, ignore_errors=True)
+        print(f"Deleted {args.path}")
+        return
+
+    cache = LabelCache(args.path)
+    ns = cache.columns['n']
+    print(f"{len(ns):,} cached integers ({len(ns) * ENTRY_BYTES / 2**20:.1f} MB)")
+    if len(ns):
+        print(f"  range: [{ns[0]}, {ns[-1]}]")
+        print(f"  last run: {cache.epoch - 1}")
+
+
+if __name__ == "__main__":
+    main()
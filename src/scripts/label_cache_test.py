@@ -0,0 +1,80 @@
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import label_cache
+from label_cache import ENTRY_BYTES, LabelCache, STAT_DTYPES
+from utils import factor_stats
+
+
+def cache_mb(entries):
+    """The max_mb of a cache of exactly this many entries."""
+    return entries * ENTRY_BYTES / 2**20
+
+
+class TestLabelCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def assertStats(self, stats, ns):
+        expected = factor_stats(ns)
+        for key in STAT_DTYPES:
+            self.assertEqual(stats[key].tolist(), expected[key].tolist(), key)
+
+    def test_hits_and_merge(self):
+        ns = np.arange(1000, 1100, dtype=np.int64)
+        with LabelCache(self.path) as cache:
+            self.assertStats(cache.factor_stats(ns), ns)
+            self.assertEqual((cache.hits, cache.misses), (0, 100))
+        # Another run finds the first labels, and merges the new ones
+        more = np.arange(1050, 1200, dtype=np.int64)
+        with LabelCache(self.path) as cache:
+            self.assertEqual(len(cache), 100)
+            self.assertStats(cache.factor_stats(more[::-1]), more[::-1])
+            self.assertEqual((cache.hits, cache.misses), (50, 100))
+        cache = LabelCache(self.path)
+        self.assertEqual(cache.columns['n'].tolist(), list(range(1000, 1200)))
+        self.assertEqual(cache.epoch, 3)
+        found, stats = cache.lookup(np.array([999, 1000, 1199, 1200]))
+        self.assertEqual(found.tolist(), [False, True, True, False])
+        self.assertStats({key: stats[key][1:3] for key in stats}, [1000, 1199])
+
+    def test_eviction(self):
+        with LabelCache(self.path, cache_mb(100)) as cache:
+            cache.factor_stats(np.arange(0, 60))
+        with LabelCache(self.path, cache_mb(100)) as cache:
+            cache.factor_stats(np.arange(0, 30))
+            cache.factor_stats(np.arange(100, 160))
+        # Of the entries only used in the first run, the first ones are evicted
+        cache = LabelCache(self.path, cache_mb(100))
+        self.assertEqual(
+            cache.columns['n'].tolist(),
+            list(range(0, 30)) + list(range(50, 60)) + list(range(100, 160))
+        )
+        self.assertEqual(cache.columns['epoch'][:30].tolist(), [2] * 30)
+        self.assertEqual(cache.columns['epoch'][30:40].tolist(), [1] * 10)
+
+    def test_flush_touched(self):
+        with LabelCache(self.path) as cache:
+            cache.factor_stats(np.arange(0, 100))
+        with mock.patch.object(label_cache, 'FLUSH_ENTRIES', 64):
+            cache = LabelCache(self.path)
+            for start in range(0, 100, 10):
+                cache.factor_stats(np.arange(start, start + 10))
+                # Runs where every n is found must not grow without bound
+                self.assertLess(cache.num_touched, 64)
+                self.assertLess(sum(len(ns) for ns in cache.touched), 64)
+            self.assertEqual(cache.misses, 0)
+            self.assertEqual(LabelCache(self.path).columns['epoch'][:60].tolist(), [2] * 60)
+            cache.close()
+        self.assertEqual(LabelCache(self.path).columns['epoch'].tolist(), [2] * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
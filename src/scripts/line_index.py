@@ -0,0 +1,356 @@
+"""
+line_index.py - line offsets of datafiles, and splits as lists of lines
+
+A LineIndex records where every line of a text datafile starts, as a uint64
+array saved next to it (`mu_*.txt.lines.npy`, built in one pass and about 8
+bytes per line), and serves any list of lines straight from a memory map of
+the file, without reading the rest of it.
+
+A split is then just a few arrays of line numbers: shuffled train and test
+sets, a stratified split (with the same label proportions in both parts),
+k-fold cross validation, or a random subsample. These are saved as small
+.npz split files instead of copies of the data:
+
+    python line_index.py mu_interCRT100_natural.txt --ntest 100000 --stratify --output split.npz
+    python line_index.py mu_interCRT100_natural.txt --kfold 5 --output folds.npz
+    python line_index.py mu_interCRT100_natural.txt --subsample 100000 --output eval.npz
+
+Pass --write to also write the lines of each part (`{file}.{part}`), e.g. to
+give Int2Int a --train_data and --eval_data. Paired files (such as the mu and
+musq files of the same integers) have the same lines, so one split serves
+both.
+
+Only plain text files can be memory mapped, so compressed shards (see
+shards.py) are not indexed.
+
+## License Information ##
+
+Copyright © 2025 David Lowry-Duda <david@lowryduda.com>
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import argparse
+import mmap
+import os
+
+import numpy as np
+
+from shards import is_sharded
+
+
+# Bytes read at a time while indexing
+READ_SIZE = 2**24
+
+INDEX_SUFFIX = ".lines.npy"
+
+# Lines written at a time by LineIndex.write
+WRITE_LINES = 100_000
+
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+
+def build_offsets(path):
+    """
+    uint64 array of the offset of the start of every line of the file path,
+    followed by the size of the file, in one pass over the file.
+    """
+    pieces = [np.zeros(1, dtype=np.uint64)]
+    position = 0
+    with open(path, "rb", buffering=0) as f:
+        while chunk := f.read(READ_SIZE):
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n"))
+            pieces.append((newlines + position + 1).astype(np.uint64))
+            position += len(chunk)
+    offsets = np.concatenate(pieces)
+    if offsets[-1] != position:
+        # The last line has no newline
+        offsets = np.append(offsets, np.uint64(position))
+    return offsets
+
+
+class LineIndex:
+    """
+    Random access to the lines of the text file path, through a memory map.
+
+    The offsets are loaded from the saved index if it is up to date (it
+    ends at the size of the file, and is newer than it), and otherwise built
+    and saved (if save is true).
+    """
+
+    def __init__(self, path, save=True):
+        if is_sharded(path):
+            raise ValueError(f"{path} is sharded; only plain text files can be indexed")
+        self.path = path
+        size = os.path.getsize(path)
+        self.offsets = None
+        try:
+            if os.path.getmtime(index_path(path)) >= os.path.getmtime(path):
+                offsets = np.load(index_path(path), mmap_mode='r')
+                if len(offsets) and int(offsets[-1]) == size:
+                    self.offsets = offsets
+        except (OSError, ValueError):
+            pass
+        if self.offsets is None:
+            self.offsets = build_offsets(path)
+            if save:
+                tmp = index_path(path) + ".tmp.npy"
+                np.save(tmp, self.offsets)
+                os.replace(tmp, index_path(path))
+        self.file = open(path, "rb")
+        # An empty file cannot be mapped
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def line(self, i):
+        """Line i, as bytes (with its newline)."""
+        i = range(len(self))[i]
+        return self.map[int(self.offsets[i]):int(self.offsets[i + 1])]
+
+    def __getitem__(self, i):
+        return self.line(i)
+
+    def lines(self, indices):
+        """The lines with the given indices, in order, as a list of bytes."""
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[indices].tolist()
+        ends = self.offsets[indices + 1].tolist()
+        return [self.map[start:end] for start, end in zip(starts, ends)]
+
+    def labels(self):
+        """
+        The label of every line (the text after its last tab), as an array of
+        small integers, and the list of distinct labels they number.
+        """
+        # A line without a tab is all label
+        tabs = np.asarray(self.offsets[:-1], dtype=np.int64) - 1
+        data = np.frombuffer(self.map, dtype=np.uint8) if len(self.map) else np.empty(0, np.uint8)
+        ends = np.asarray(self.offsets[1:], dtype=np.int64)
+        for start in range(0, len(data), READ_SIZE):
+            positions = np.flatnonzero(data[start:start + READ_SIZE] == ord("\t")) + start
+            # The last tab of each line wins
+            tabs[np.searchsorted(ends, positions, side='right')] = positions
+        labels = [self.map[t + 1:e].strip() for t, e in zip(tabs.tolist(), ends.tolist())]
+        values, ids = np.unique(np.array(labels, dtype=bytes), return_inverse=True)
+        return ids, [value.decode() for value in values]
+
+    def write(self, indices, out_path):
+        """Write the lines with the given indices, in order, to out_path."""
+        indices = np.asarray(indices, dtype=np.int64)
+        with open(out_path, "wb") as f:
+            for start in range(0, len(indices), WRITE_LINES):
+                f.write(b"".join(self.lines(indices[start:start + WRITE_LINES])))
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Splits: functions of the number of lines (and labels) returning arrays of
+# line numbers
+
+def shuffled(num_lines, seed=None):
+    return np.random.default_rng(seed).permutation(num_lines).astype(np.uint64)
+
+
+def subsample(num_lines, size, seed=None):
+    """size distinct random lines, in random order."""
+    rng = np.random.default_rng(seed)
+    return rng.choice(num_lines, size=min(size, num_lines), replace=False).astype(np.uint64)
+
+
+def train_test_split(num_lines, ntest, seed=None, labels=None):
+    """
+    Shuffled train and test lines, with ntest test lines. If labels (an array
+    of label ids, one per line) is given, the split is stratified: each label
+    is split in the same proportion, so both parts have the label
+    distribution of the whole file (up to rounding).
+    """
+    rng = np.random.default_rng(seed)
+    if labels is None:
+        perm = rng.permutation(num_lines)
+        return perm[ntest:].astype(np.uint64), perm[:ntest].astype(np.uint64)
+    folds = _stratified_folds(labels, [num_lines - ntest, ntest], rng)
+    return folds[0], folds[1]
+
+
+def kfold(num_lines, k, seed=None, labels=None):
+    """
+    k (train, test) pairs of shuffled lines, whose test parts partition the
+    lines into k nearly equal folds, stratified by labels if given.
+    """
+    rng = np.random.default_rng(seed)
+    sizes = [num_lines // k + (1 if i < num_lines % k else 0) for i in range(k)]
+    if labels is None:
+        perm = rng.permutation(num_lines)
+        folds = np.split(perm, np.cumsum(sizes)[:-1])
+    else:
+        folds = _stratified_folds(labels, sizes, rng)
+    return [
+        (rng.permutation(np.concatenate(folds[:i] + folds[i + 1:])).astype(np.uint64),
+         folds[i].astype(np.uint64))
+        for i in range(k)
+    ]
+
+
+def _stratified_folds(labels, sizes, rng):
+    """
+    Split the lines into parts of the given sizes, with each label spread
+    over the parts in proportion to their sizes. Each part is shuffled.
+    """
+    labels = np.asarray(labels)
+    total = len(labels)
+    # Deal the lines out in a random order within each label, so that every
+    # label is cut at the same fractions of its lines
+    order = np.lexsort((rng.random(total), labels))
+    ranks = np.empty(total, dtype=np.float64)
+    _, starts, counts = np.unique(labels[order], return_index=True, return_counts=True)
+    for start, count in zip(starts.tolist(), counts.tolist()):
+        ranks[order[start:start + count]] = (np.arange(count) + 0.5) / count
+    # Sorting by rank interleaves the labels evenly; cut that order by size
+    even = np.argsort(ranks, kind='stable')
+    parts = np.split(even, np.cumsum(sizes)[:-1])
+    return [rng.permutation(part).astype(np.uint64) for part in parts]
+
+
+def save_split(path, source, **parts):
+    """
+    Save the parts of a split of the file source (arrays of line numbers,
+    by name) to the .npz file path, with the size of the source.
+    """
+    np.savez(path, source_bytes=np.uint64(os.path.getsize(source)),
+             **{name: np.asarray(part, dtype=np.uint64) for name, part in parts.items()})
+
+
+def load_split(path, source=None):
+    """
+    The parts of a split saved by save_split, as a dict. If the file source is
+    given, check that it has the size the split was made for.
+    """
+    with np.load(path) as data:
+        parts = {name: data[name] for name in data.files if name != 'source_bytes'}
+        if source is not None and int(data['source_bytes']) != os.path.getsize(source):
+            raise ValueError(f"{path} is a split of a different version of {source}")
+    return parts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Index the lines of datafiles, and split them into lists of lines'
+    )
+    parser.add_argument('files', nargs='+', help='Text datafiles with the same lines (e.g. the mu and musq files)')
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help='Save the split to this .npz file'
+    )
+    parser.add_argument(
+        '--ntest',
+        type=int,
+        default=None,
+        help='Split into shuffled train and test parts, with this many test lines'
+    )
+    parser.add_argument(
+        '--kfold',
+        type=int,
+        default=None,
+        help='Split into this many folds for cross validation'
+    )
+    parser.add_argument(
+        '--subsample',
+        type=int,
+        default=None,
+        help='Take this many random lines'
+    )
+    parser.add_argument(
+        '--stratify',
+        action='store_true',
+        help='Keep the label proportions of the first file in every part (with --ntest or --kfold)'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=None,
+        help='Random seed for reproducibility'
+    )
+    parser.add_argument(
+        '--write',
+        action='store_true',
+        help='Also write the lines of each part of the split, to FILE.PART'
+    )
+    args = parser.parse_args()
+
+    if sum(x is not None for x in (args.ntest, args.kfold, args.subsample)) > 1:
+        parser.error("choose one of --ntest, --kfold, and --subsample")
+
+    indexes = [LineIndex(path) for path in args.files]
+    num_lines = len(indexes[0])
+    for path, index in zip(args.files, indexes):
+        print(f"{path}: {len(index):,} lines")
+        if len(index) != num_lines:
+            parser.error(f"{path} does not have the same number of lines as {args.files[0]}")
+
+    labels = None
+    if args.stratify:
+        labels, values = indexes[0].labels()
+        counts = np.bincount(labels, minlength=len(values))
+        print("Labels: " + ", ".join(f"{v}: {c:,}" for v, c in zip(values, counts.tolist())))
+
+    parts = {}
+    if args.ntest is not None:
+        if not 0 <= args.ntest <= num_lines:
+            parser.error(f"--ntest must be between 0 and {num_lines}")
+        parts['train'], parts['test'] = train_test_split(num_lines, args.ntest, args.seed, labels)
+    elif args.kfold is not None:
+        if not 2 <= args.kfold <= num_lines:
+            parser.error(f"--kfold must be between 2 and {num_lines}")
+        for i, (train, test) in enumerate(kfold(num_lines, args.kfold, args.seed, labels)):
+            parts[f"train{i}"], parts[f"test{i}"] = train, test
+    elif args.subsample is not None:
+        parts['sample'] = subsample(num_lines, args.subsample, args.seed)
+
+    for name, part in parts.items():
+        print(f"  {name}: {len(part):,} lines")
+    if parts and args.output is not None:
+        save_split(args.output, args.files[0], **parts)
+        print(f"Wrote {args.output}")
+    if args.write:
+        for path, index in zip(args.files, indexes):
+            for name, part in parts.items():
+                index.write(part, f"{path}.{name}")
+                print(f"Wrote {path}.{name}")
+    for index in indexes:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+pipeline.py - a streaming pipeline of threaded stages
+
+Generating a datafile is a sequence of stages applied to blocks of samples:
+
+    sampler -> labeler -> encoder -> writer
+
+A Pipeline runs the source (an iterable of Batch) and each stage in its own
+thread, connected by bounded queues, so that sampling, factoring, encoding,
+and file I/O overlap. The factoring in mobius.so, most NumPy operations, and
+writes all release the GIL. The queues hold at most a few blocks, so memory
+use stays bounded, and a slow stage simply makes the others wait.
+
+Stages are plain functions of a Batch, so other scripts can reuse them or
+plug in their own, e.g.
+
+    stats = Pipeline(batches, [("label", label), ("write", write)]).run()
+
+Each stage reports how many samples it processed and how long it was busy,
+which shows where a run spends its time.
+
+## License Information ##
+
+Copyright © 2025 David Lowry-Duda <david@lowryduda.com>
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import queue
+import threading
+import time
+
+
+# Number of batches that can wait between two stages
+QUEUE_SIZE = 4
+
+# Seconds between checks for a failed stage while waiting on a queue
+POLL_INTERVAL = 0.1
+
+# Marks the end of the stream of batches
+_DONE = object()
+
+
+class Batch:
+    """
+    A block of samples passing through a pipeline.
+
+    ns is the array of integers. known is an optional dict of labels that are
+    already computed, and state is whatever the source needs to continue
+    after this batch (for checkpoints). Stages fill in labels (a dict target
+    -> array), lines (a dict of encoded text, keyed by output), and tokens
+    (an array of token ids).
+
+    The source and each stage may also add numbers to counts (such as
+    rejected candidates or bytes written), which are added to the counts of
+    its StageStats once it is done with the batch.
+    """
+
+    def __init__(self, ns, known=None, state=None):
+        self.ns = ns
+        self.known = known
+        self.state = state
+        self.labels = None
+        self.lines = None
+        self.tokens = None
+        self.counts = {}
+
+    def __len__(self):
+        return len(self.ns)
+
+
+class StageStats:
+    """
+    Number of batches and samples a stage processed, its busy time, and the
+    totals of the counts it added to batches.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.batches = 0
+        self.samples = 0
+        self.seconds = 0.0
+        self.counts = {}
+
+    def add(self, other):
+        self.batches += other.batches
+        self.samples += other.samples
+        self.seconds += other.seconds
+        self.add_counts(other.counts)
+
+    def add_counts(self, counts):
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    @property
+    def throughput(self):
+        """Samples per busy second."""
+        return self.samples / self.seconds if self.seconds > 0 else float('inf')
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'batches': self.batches,
+            'samples': self.samples,
+            'seconds': self.seconds,
+            'counts': dict(self.counts),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls(d['name'])
+        stats.batches = d['batches']
+        stats.samples = d['samples']
+        stats.seconds = d['seconds']
+        stats.counts = dict(d.get('counts', {}))
+        return stats
+
+    def __str__(self):
+        return (f"{self.name:>8}: {self.samples:,} samples in "
+                f"{self.seconds:.2f}s busy ({self.throughput:,.0f} samples/s)")
+
+
+def merge_stats(stats_lists):
+    """Add up the stats of several runs of the same pipeline, stage by stage."""
+    merged = {}
+    for stats in stats_lists:
+        for stage in stats:
+            merged.setdefault(stage.name, StageStats(stage.name)).add(stage)
+    return list(merged.values())
+
+
+class _Stopped(Exception):
+    """Raised in a stage thread when another stage has failed."""
+
+
+class Pipeline:
+    """
+    Batches from source, passed through each (name, function) in stages in
+    order. Each function takes a Batch and returns the Batch to pass on (or
+    None to drop it); the result of the last stage is discarded. Batches are
+    processed in order, one at a time in each stage.
+
+    If threaded is false, everything runs in the calling thread instead,
+    which is easier to debug and profile.
+    """
+
+    def __init__(self, source, stages, queue_size=QUEUE_SIZE,
+                 source_name="sample", threaded=True):
+        self.source = source
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.threaded = threaded
+        self.stats = [StageStats(source_name)]
+        self.stats += [StageStats(name) for name, _ in self.stages]
+        self.wall_seconds = 0.0
+        self._start = None
+        self._failed = threading.Event()
+        self._errors = []
+
+    def run(self):
+        """Run the pipeline to the end. Returns the list of StageStats."""
+        self._start = time.perf_counter()
+        if self.threaded:
+            self._run_threaded()
+        else:
+            self._run_serial()
+        self.wall_seconds = time.perf_counter() - self._start
+        return self.stats
+
+    def _run_serial(self):
+        for batch in self._timed_source():
+            for (_, function), stats in zip(self.stages, self.stats[1:]):
+                batch = self._apply(function, batch, stats)
+                if batch is None:
+                    break
+
+    def _timed_source(self):
+        """Iterate over the source, timing each batch."""
+        stats = self.stats[0]
+        iterator = iter(self.source)
+        while True:
+            t = time.perf_counter()
+            batch = next(iterator, _DONE)
+            stats.seconds += time.perf_counter() - t
+            if batch is _DONE:
+                return
+            stats.batches += 1
+            stats.samples += len(batch)
+            stats.add_counts(batch.counts)
+            batch.counts = {}
+            yield batch
+
+    @staticmethod
+    def _apply(function, batch, stats):
+        t = time.perf_counter()
+        samples = len(batch)
+        batch = function(batch)
+        stats.seconds += time.perf_counter() - t
+        stats.batches += 1
+        stats.samples += samples
+        if batch is not None:
+            stats.add_counts(batch.counts)
+            batch.counts = {}
+        return batch
+
+    def _run_threaded(self):
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        threads = [threading.Thread(
+            target=self._guard, args=(self._produce, queues[0] if queues else None),
+            name=self.stats[0].name, daemon=True
+        )]
+        for i, (name, function) in enumerate(self.stages):
+            outqueue = queues[i + 1] if i + 1 < len(queues) else None
+            threads.append(threading.Thread(
+                target=self._guard,
+                args=(self._consume, function, self.stats[i + 1], queues[i], outqueue),
+                name=name, daemon=True
+            ))
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except BaseException:
+            # e.g. KeyboardInterrupt: stop the stages before giving up
+            self._failed.set()
+            raise
+        if self._errors:
+            raise self._errors[0]
+
+    def _guard(self, target, *args):
+        try:
+            target(*args)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            self._errors.append(e)
+            self._failed.set()
+
+    def _put(self, q, item):
+        while True:
+            if self._failed.is_set():
+                raise _Stopped
+            try:
+                q.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, q):
+        while True:
+            if self._failed.is_set():
+                raise _Stopped
+            try:
+                return q.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                pass
+
+    def _produce(self, outqueue):
+        for batch in self._timed_source():
+            if outqueue is not None:
+                self._put(outqueue, batch)
+            elif self._failed.is_set():
+                raise _Stopped
+        if outqueue is not None:
+            self._put(outqueue, _DONE)
+
+    def _consume(self, function, stats, inqueue, outqueue):
+        while (batch := self._get(inqueue)) is not _DONE:
+            batch = self._apply(function, batch, stats)
+            if batch is not None and outqueue is not None:
+                self._put(outqueue, batch)
+        if outqueue is not None:
+            self._put(outqueue, _DONE)
+
+    def elapsed(self):
+        """Seconds since the pipeline started (or its total run time)."""
+        if self.wall_seconds or self._start is None:
+            return self.wall_seconds
+        return time.perf_counter() - self._start
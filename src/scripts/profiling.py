@@ -0,0 +1,162 @@
+"""
+profiling.py - metrics streams and a sampling profiler for long runs
+
+A MetricsStream appends a JSON object, one per line, to a file every few
+seconds while a run is in progress, and once more when it ends. Each line is
+whatever its snapshot function returns (for generate_datafiles.py, the time
+and counts of every pipeline stage), so a run can be watched with e.g.
+
+    tail -f metrics.jsonl | jq .stages.label
+
+A SamplingProfiler periodically records the Python stack of every other
+thread. It needs no instrumentation and covers the pipeline threads, which
+cProfile does not. The stacks are written in the "collapsed" format read by
+flamegraph.pl and speedscope:
+
+    thread;module.py:function;module.py:function count
+
+## License Information ##
+
+Copyright © 2025 David Lowry-Duda <david@lowryduda.com>
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+
+class MetricsStream:
+    """
+    Append snapshot() as a JSON line to path every `every` seconds, from a
+    background thread, and a final line (with "final": true) on close.
+    """
+
+    def __init__(self, path, snapshot, every=10.0):
+        self.path = path
+        self.snapshot = snapshot
+        self.every = every
+        self.file = open(path, "a", encoding="utf8")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="metrics", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.every):
+            self.emit()
+
+    def emit(self, final=False):
+        record = {'time': time.time(), **self.snapshot()}
+        if final:
+            record['final'] = True
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.emit(final=True)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SamplingProfiler:
+    """
+    Record the stack of every other thread (or only of the threads with
+    the given names) every `interval` seconds, until stopped. Use as a
+    context manager around the code to profile.
+    """
+
+    def __init__(self, interval=0.005, threads=None):
+        self.interval = interval
+        self.threads = None if threads is None else set(threads)
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                if ident == me or (self.threads is not None
+                                   and name not in self.threads):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{os.path.basename(code.co_filename)}:{code.co_name}"
+                    )
+                    frame = frame.f_back
+                stack.append(name)
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write(self, path):
+        """Write the stacks in collapsed format."""
+        with open(path, "w", encoding="utf8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top(self, k=10):
+        """
+        The k functions on top of the most stacks (i.e. where the time was
+        spent), ignoring threads that were only waiting, as a list of
+        (function, fraction of samples).
+        """
+        idle = ('threading.py:wait', 'threading.py:_wait_for_tstate_lock')
+        leaves = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            if leaf not in idle:
+                leaves[leaf] += count
+        total = sum(leaves.values()) or 1
+        return [(leaf, count / total) for leaf, count in leaves.most_common(k)]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
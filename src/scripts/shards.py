@@ -0,0 +1,501 @@
+"""
+shards.py - datafiles as compressed shards, and streaming them back
+
+Datafiles are large and very repetitive (interCRT100 repeats the same prime
+tokens on every line), so they compress well. A ShardWriter writes a text
+file with base name `base` as a sequence of compressed shards of a fixed
+number of lines, compressed in parallel by a pool of threads:
+
+    base.00000.gz, base.00001.gz, ...   the shards (.zst with zstd)
+    base.index.json                     codec, and the lines and sizes of
+                                        each shard
+
+The index is written last, so a sharded file is complete if and only if it
+has an index. gzip is always available; zstd (which compresses better and
+faster) is used if the zstandard package is installed.
+
+open_text(base) reads a sharded file back as one text stream (and a plain
+file as itself), and running this module streams it, decompressed, to a file,
+stdout, or a named pipe that Int2Int reads as its --train_data or --eval_data:
+
+    python shards.py ../../input/.../mu_interCRT100_natural.txt.train --output /tmp/train.pipe --mkfifo
+
+## License Information ##
+
+Copyright © 2025 David Lowry-Duda <david@lowryduda.com>
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import argparse
+import collections
+import concurrent.futures
+import glob
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import zlib
+
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+
+CODECS = ('gzip', 'zstd')
+
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+# gzip is slow at high levels; level 1 already shrinks datafiles about 3x
+DEFAULT_LEVELS = {'gzip': 1, 'zstd': 3}
+
+# Lines in each shard (about 100 MB of interCRT100 text)
+DEFAULT_SHARD_LINES = 100_000
+
+INDEX_SUFFIX = ".index.json"
+
+# Bytes of compressed data decompressed at a time when reading
+READ_SIZE = 2**20
+
+
+def default_codec():
+    return 'zstd' if HAS_ZSTD else 'gzip'
+
+
+def index_path(base):
+    return base + INDEX_SUFFIX
+
+
+def is_sharded(base):
+    """Whether base is a complete sharded file."""
+    return os.path.exists(index_path(base))
+
+
+def shard_file(base, k, codec):
+    return f"{base}.{k:05d}{EXTENSIONS[codec]}"
+
+
+def _tail_file(base, k):
+    return f"{base}.{k:05d}.tail"
+
+
+def _check_codec(codec):
+    if codec not in CODECS:
+        raise ValueError(f"unknown codec {codec}")
+    if codec == 'zstd' and not HAS_ZSTD:
+        raise ValueError("zstd needs the zstandard package: pip install zstandard")
+
+
+def compress(data, codec, level=None):
+    """Compress bytes (deterministically, so equal inputs give equal files)."""
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def decompressed_chunks(path, codec):
+    """Iterate over the decompressed contents of a shard, in chunks."""
+    with open(path, "rb") as f:
+        if codec == 'zstd':
+            reader = zstandard.ZstdDecompressor().stream_reader(f)
+            while chunk := reader.read(READ_SIZE):
+                yield chunk
+            return
+        decompressor = zlib.decompressobj(wbits=31)
+        while chunk := f.read(READ_SIZE):
+            yield decompressor.decompress(chunk)
+        yield decompressor.flush()
+
+
+def read_index(base):
+    with open(index_path(base)) as f:
+        return json.load(f)
+
+
+def _write_index(base, index):
+    tmp = index_path(base) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp, index_path(base))
+
+
+def _pieces(base):
+    """Every shard, tail, and index file of base (complete or not)."""
+    pattern = re.compile(re.escape(os.path.basename(base))
+                         + r"\.(\d{5}(\.gz|\.zst|\.tail)|index\.json)$")
+    return [path for path in glob.glob(glob.escape(base) + ".*")
+            if pattern.match(os.path.basename(path))]
+
+
+def remove_shards(base):
+    """Delete the sharded file base, and any leftovers of writing it."""
+    for path in _pieces(base):
+        os.remove(path)
+
+
+def remove_text(path):
+    """
+    Delete the text file path, whether it is sharded or not. The index of a
+    sharded file takes precedence over a plain file of the same name when
+    reading, so writing either form has to remove the other.
+    """
+    remove_shards(path)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class ShardWriter:
+    """
+    Write text to the sharded file base, shard_lines lines per shard,
+    compressed with codec by a pool of `threads` threads.
+
+    write() takes whole lines. close() compresses the last shard and writes
+    the index. For checkpoints, sync() makes everything written so far
+    durable: the lines of the shard in progress are appended uncompressed to
+    a tail file. It returns the state to pass as resume to continue from
+    that point after an interruption.
+    """
+
+    def __init__(self, base, codec=None, shard_lines=DEFAULT_SHARD_LINES,
+                 level=None, threads=None, resume=None):
+        self.base = base
+        self.name = base
+        self.codec = codec or default_codec()
+        _check_codec(self.codec)
+        self.shard_lines = shard_lines
+        self.level = level
+        threads = threads or min(4, os.cpu_count() or 1)
+        self.pool = concurrent.futures.ThreadPoolExecutor(threads)
+        # Shards waiting to be compressed are held in memory
+        self.max_pending = 2 * threads
+        self.pending = collections.deque()
+        self.entries = []
+        self.buffer = []
+        self.buffer_lines = 0
+        self.buffer_bytes = 0
+        self.tail_bytes = 0
+        self.synced_shards = 0
+
+        if resume is None:
+            remove_text(base)
+        else:
+            self.entries = list(resume['shards'])
+            k = len(self.entries)
+            tail = _tail_file(base, k)
+            data = b""
+            if resume['tail_bytes']:
+                data = self._read_tail(k, resume['tail_bytes'])
+            keep = {shard_file(base, i, self.codec) for i in range(k)}
+            keep.add(tail)
+            for path in _pieces(base):
+                if path not in keep:
+                    os.remove(path)
+            if data and os.path.exists(tail):
+                os.truncate(tail, len(data))
+            elif data:
+                with open(tail, "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            elif os.path.exists(tail):
+                os.remove(tail)
+            if data:
+                self.buffer = [data]
+                self.buffer_lines = data.count(b"\n")
+                self.buffer_bytes = len(data)
+                self.tail_bytes = len(data)
+            self.synced_shards = k
+
+    def _read_tail(self, k, size):
+        """
+        The first size bytes of shard k, which were synced to its tail file.
+        If the interrupted run closed the writer, the tail was compressed
+        into shard k and deleted, so they are read back from the shard.
+        """
+        tail = _tail_file(self.base, k)
+        if os.path.exists(tail):
+            with open(tail, "rb") as f:
+                data = f.read(size)
+        else:
+            data = bytearray()
+            path = shard_file(self.base, k, self.codec)
+            if os.path.exists(path):
+                for chunk in decompressed_chunks(path, self.codec):
+                    data += chunk
+                    if len(data) >= size:
+                        break
+            data = bytes(data[:size])
+        if len(data) < size:
+            raise ValueError(f"cannot resume {self.base}: its last shard is incomplete")
+        return data
+
+    def write(self, text):
+        """Write whole lines of text. Returns the number of characters."""
+        data = text.encode("utf8")
+        lines = data.count(b"\n")
+        start = 0
+        while self.buffer_lines + lines >= self.shard_lines:
+            # Split off exactly the lines that complete the current shard
+            end = start
+            for _ in range(self.shard_lines - self.buffer_lines):
+                end = data.index(b"\n", end) + 1
+            self.buffer.append(data[start:end])
+            self.buffer_bytes += end - start
+            lines -= self.shard_lines - self.buffer_lines
+            self.buffer_lines = self.shard_lines
+            self._finish_shard()
+            start = end
+        if start < len(data):
+            self.buffer.append(data[start:])
+            self.buffer_bytes += len(data) - start
+            self.buffer_lines += lines
+        return len(text)
+
+    def writelines(self, lines):
+        self.write("".join(lines))
+
+    def _finish_shard(self):
+        """Hand the buffered lines to the pool, as the next shard."""
+        k = len(self.entries) + len(self.pending)
+        data = b"".join(self.buffer)
+        self.pending.append(self.pool.submit(self._compress, k, data))
+        self.buffer = []
+        self.buffer_lines = 0
+        self.buffer_bytes = 0
+        self.tail_bytes = 0
+        while len(self.pending) > self.max_pending:
+            self._collect(self.pending.popleft())
+
+    def _compress(self, k, data):
+        path = shard_file(self.base, k, self.codec)
+        compressed = compress(data, self.codec, self.level)
+        with open(path, "wb") as f:
+            f.write(compressed)
+        return {
+            'file': os.path.basename(path),
+            'lines': data.count(b"\n"),
+            'bytes': len(data),
+            'compressed_bytes': len(compressed),
+        }
+
+    def _collect(self, future):
+        self.entries.append(future.result())
+
+    def _wait(self):
+        while self.pending:
+            self._collect(self.pending.popleft())
+
+    def sync(self):
+        """
+        Flush everything written so far to disk, and return the state to
+        resume from.
+        """
+        self._wait()
+        for entry in self.entries[self.synced_shards:]:
+            with open(os.path.join(os.path.dirname(self.base), entry['file']), "rb") as f:
+                os.fsync(f.fileno())
+        # Tails of shards completed at the last sync are no longer needed,
+        # since the checkpoint of that sync was saved before this one
+        for k in range(self.synced_shards):
+            if os.path.exists(_tail_file(self.base, k)):
+                os.remove(_tail_file(self.base, k))
+        tail = _tail_file(self.base, len(self.entries))
+        if self.buffer_bytes > self.tail_bytes:
+            data = b"".join(self.buffer)
+            with open(tail, "ab") as f:
+                f.write(data[self.tail_bytes:])
+                f.flush()
+                os.fsync(f.fileno())
+            self.buffer = [data]
+            self.tail_bytes = len(data)
+        self.synced_shards = len(self.entries)
+        return {'shards': list(self.entries), 'tail_bytes': self.tail_bytes}
+
+    def close(self):
+        if self.buffer_lines:
+            self._finish_shard()
+        self._wait()
+        self.pool.shutdown()
+        _write_index(self.base, {
+            'codec': self.codec,
+            'shard_lines': self.shard_lines,
+            'lines': sum(entry['lines'] for entry in self.entries),
+            'bytes': sum(entry['bytes'] for entry in self.entries),
+            'shards': self.entries,
+        })
+        for path in _pieces(self.base):
+            if path.endswith(".tail"):
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def join_shards(sources, dest):
+    """
+    Join the sharded files sources, in order, into the sharded file dest, by
+    hard linking (or copying) their shards. The sources are left in place.
+    """
+    remove_text(dest)
+    entries = []
+    codec = shard_lines = None
+    for base in sources:
+        index = read_index(base)
+        codec = index['codec']
+        shard_lines = index['shard_lines']
+        for entry in index['shards']:
+            src = os.path.join(os.path.dirname(base), entry['file'])
+            target = shard_file(dest, len(entries), codec)
+            try:
+                os.link(src, target)
+            except OSError:
+                shutil.copyfile(src, target)
+            entries.append(dict(entry, file=os.path.basename(target)))
+    _write_index(dest, {
+        'codec': codec,
+        'shard_lines': shard_lines,
+        'lines': sum(entry['lines'] for entry in entries),
+        'bytes': sum(entry['bytes'] for entry in entries),
+        'shards': entries,
+    })
+
+
+class ShardReader(io.RawIOBase):
+    """The decompressed contents of the sharded file base, as a binary file."""
+
+    def __init__(self, base):
+        index = read_index(base)
+        directory = os.path.dirname(base)
+        self.chunks = (
+            chunk
+            for entry in index['shards']
+            for chunk in decompressed_chunks(
+                os.path.join(directory, entry['file']), index['codec']
+            )
+        )
+        # The rest of the current chunk; a memoryview, so that taking a read
+        # off the front does not copy the rest of the chunk again
+        self.leftover = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.leftover:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.leftover = memoryview(chunk)
+        n = min(len(b), len(self.leftover))
+        b[:n] = self.leftover[:n]
+        self.leftover = self.leftover[n:]
+        return n
+
+
+def open_binary(path):
+    """Open the file path for reading bytes, whether it is sharded or not."""
+    if is_sharded(path):
+        return io.BufferedReader(ShardReader(path), READ_SIZE)
+    return open(path, "rb")
+
+
+def open_text(path):
+    """Open the text file path for reading, whether it is sharded or not."""
+    if is_sharded(path):
+        return io.TextIOWrapper(open_binary(path), encoding="utf8")
+    return open(path, "r", encoding="utf8")
+
+
+def text_exists(path):
+    return is_sharded(path) or os.path.exists(path)
+
+
+def text_size(path):
+    """Size in bytes of the (decompressed) text file path."""
+    if is_sharded(path):
+        return read_index(path)['bytes']
+    return os.path.getsize(path)
+
+
+def open_text_writer(path, codec=None, shard_lines=DEFAULT_SHARD_LINES,
+                     threads=None):
+    """
+    Open the text file path for writing: as a ShardWriter if codec is given,
+    and otherwise as a plain file.
+    """
+    if codec is None:
+        remove_shards(path)
+        return open(path, "w", encoding="utf8")
+    return ShardWriter(path, codec, shard_lines, threads=threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Stream a sharded datafile, decompressed'
+    )
+    parser.add_argument('base', type=str, help='Sharded file (without the shard suffixes)')
+    parser.add_argument(
+        '--output',
+        type=str,
+        default='-',
+        help='Output file, or - for stdout'
+    )
+    parser.add_argument(
+        '--mkfifo',
+        action='store_true',
+        help='Create --output as a named pipe first (if it does not exist)'
+    )
+    parser.add_argument(
+        '--info',
+        action='store_true',
+        help='Print the size of the file and of its shards instead'
+    )
+    args = parser.parse_args()
+
+    if args.info:
+        index = read_index(args.base)
+        compressed = sum(entry['compressed_bytes'] for entry in index['shards'])
+        print(f"{index['lines']:,} lines in {len(index['shards'])} {index['codec']} shards")
+        print(f"{index['bytes'] / 2**20:.1f} MB, compressed to "
+              f"{compressed / 2**20:.1f} MB ({index['bytes'] / max(compressed, 1):.1f}x)")
+        return
+
+    reader = open_binary(args.base)
+    if args.output == '-':
+        shutil.copyfileobj(reader, sys.stdout.buffer, READ_SIZE)
+        return
+    if args.mkfifo and not os.path.exists(args.output):
+        os.mkfifo(args.output)
+    # Opening a named pipe blocks until the reader (e.g. Int2Int) opens it
+    with open(args.output, "wb") as outfile:
+        shutil.copyfileobj(reader, outfile, READ_SIZE)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import os
+import tempfile
+import unittest
+
+from shards import (
+    is_sharded, join_shards, open_text, open_text_writer, read_index,
+    ShardReader, ShardWriter,
+)
+
+
+def make_lines(start, stop):
+    return [f"V2 + {n} + {n % 7}\n" for n in range(start, stop)]
+
+
+def read_lines(path):
+    with open_text(path) as f:
+        return f.readlines()
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.base = os.path.join(self.tmpdir.name, "mu.txt")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_sharded(self, path, lines, shard_lines=100):
+        with ShardWriter(path, 'gzip', shard_lines, threads=2) as writer:
+            writer.write("".join(lines))
+
+    def write_plain(self, path, lines):
+        with open_text_writer(path) as f:
+            f.write("".join(lines))
+
+    def test_round_trip(self):
+        lines = make_lines(0, 1050)
+        self.write_sharded(self.base, lines)
+        self.assertEqual(read_lines(self.base), lines)
+        index = read_index(self.base)
+        self.assertEqual(index['lines'], 1050)
+        self.assertEqual(len(index['shards']), 11)
+
+    def test_small_reads(self):
+        lines = make_lines(0, 1050)
+        self.write_sharded(self.base, lines)
+        reader = ShardReader(self.base)
+        data = bytearray()
+        buffer = bytearray(7)
+        while n := reader.readinto(buffer):
+            data += buffer[:n]
+        self.assertEqual(data.decode(), "".join(lines))
+        self.assertEqual(reader.readinto(buffer), 0)
+
+    def test_plain_file_replaces_shards(self):
+        self.write_sharded(self.base, make_lines(0, 3000))
+        lines = make_lines(5000, 7000)
+        self.write_plain(self.base, lines)
+        self.assertFalse(is_sharded(self.base))
+        self.assertEqual(os.listdir(self.tmpdir.name), ["mu.txt"])
+        self.assertEqual(read_lines(self.base), lines)
+
+    def test_shards_replace_plain_file(self):
+        self.write_plain(self.base, make_lines(0, 3000))
+        lines = make_lines(5000, 7000)
+        self.write_sharded(self.base, lines)
+        self.assertFalse(os.path.exists(self.base))
+        self.assertEqual(read_lines(self.base), lines)
+
+    def test_join_shards(self):
+        sources = [os.path.join(self.tmpdir.name, f"mu.txt.{k}") for k in range(3)]
+        for k, source in enumerate(sources):
+            self.write_sharded(source, make_lines(1000*k, 1000*k + 250))
+        self.write_plain(self.base, make_lines(0, 10))
+        join_shards(sources, self.base)
+        self.assertFalse(os.path.exists(self.base))
+        self.assertEqual(
+            read_lines(self.base),
+            sum((make_lines(1000*k, 1000*k + 250) for k in range(3)), [])
+        )
+        # The sources are left in place
+        self.assertEqual(read_lines(sources[1]), make_lines(1000, 1250))
+
+    def test_resume(self):
+        lines = make_lines(0, 1000)
+        for stop in (250, 300, 330):
+            # Lines written after the last sync are lost in an interruption,
+            # whether they were in the tail or already in a shard
+            writer = ShardWriter(self.base, 'gzip', 100, threads=2)
+            writer.write("".join(lines[:stop]))
+            state = writer.sync()
+            writer.write("".join(lines[stop:stop + 20]))
+            writer.sync()
+            writer.write("".join(lines[stop + 20:stop + 150]))
+            writer.pool.shutdown()
+
+            with ShardWriter(self.base, 'gzip', 100, threads=2, resume=state) as writer:
+                writer.write("".join(lines[stop:]))
+            self.assertEqual(read_lines(self.base), lines)
+            self.assertFalse(
+                [name for name in os.listdir(self.tmpdir.name) if name.endswith(".tail")]
+            )
+
+    def test_resume_after_close(self):
+        # An interrupted run closes its writer on the way out, compressing
+        # the lines of its tail file into a shard
+        lines = make_lines(0, 1000)
+        for stop in (250, 300):
+            writer = ShardWriter(self.base, 'gzip', 100, threads=2)
+            writer.write("".join(lines[:stop]))
+            state = writer.sync()
+            writer.write("".join(lines[stop:stop + 30]))
+            writer.close()
+
+            with ShardWriter(self.base, 'gzip', 100, threads=2, resume=state) as writer:
+                writer.write("".join(lines[stop:]))
+            self.assertEqual(read_lines(self.base), lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
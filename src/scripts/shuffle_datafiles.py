@@ -35,6 +35,7 @@ try:
 except ImportError:
     HAS_TQDM = False
 
+from shards import CODECS, DEFAULT_SHARD_LINES, HAS_ZSTD, text_exists
 from utils import shuffle_and_create
 
 
@@ -52,8 +53,8 @@ def main():
         '--dataset_type',
         type=str,
         default='natural',
-        choices=['natural', 'cheat', 'non_cheat'],
-        help='Dataset type: natural (for train/test split), cheat (test only), non_cheat (test only)'
+        choices=['natural', 'cheat', 'non_cheat', 'range'],
+        help='Dataset type: natural (for train/test split), cheat (test only), non_cheat (test only), range (consecutive n)'
     )
     parser.add_argument(
         '--input_dir',
@@ -73,8 +74,35 @@ def main():
         default=100000,
         help='Number of test samples'
     )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=None,
+        help='Random seed for reproducibility'
+    )
+    parser.add_argument(
+        '--keep_shuffled',
+        action='store_true',
+        help='Also write the full shuffled files (*.shuf.txt)'
+    )
+    parser.add_argument(
+        '--compress',
+        type=str,
+        default='none',
+        choices=['none', *CODECS],
+        help='Write the splits as compressed shards with an index (see shards.py)'
+    )
+    parser.add_argument(
+        '--shard_lines',
+        type=int,
+        default=DEFAULT_SHARD_LINES,
+        help='Lines in each compressed shard'
+    )
 
     args = parser.parse_args()
+    args.compress = None if args.compress == 'none' else args.compress
+    if args.compress == 'zstd' and not HAS_ZSTD:
+        parser.error("--compress zstd needs the zstandard package: pip install zstandard")
 
     # Create encoding-specific subdirectory with dataset type
     encoding_dir = os.path.join(args.input_dir, f"input_dir_{args.encoding}_{args.dataset_type}")
@@ -95,19 +123,19 @@ def main():
     print(f"  Training samples: {args.ntrain}")
     print(f"  Test samples: {args.ntest}")
 
-    # Process mu files
-    if os.path.exists(mu_filename):
-        print(f"\nProcessing: {mu_filename}")
-        shuffle_and_create(mu_filename, args.ntrain, args.ntest)
-    else:
-        print(f"Warning: {mu_filename} not found!")
-
-    # Process musq files
-    if os.path.exists(musq_filename):
-        print(f"\nProcessing: {musq_filename}")
-        shuffle_and_create(musq_filename, args.ntrain, args.ntest)
-    else:
-        print(f"Warning: {musq_filename} not found!")
+    # Process mu and musq files together, with one shared permutation
+    # Datafiles may be plain or compressed shards
+    found = [f for f in (mu_filename, musq_filename) if text_exists(f)]
+    for fname in (mu_filename, musq_filename):
+        if fname not in found:
+            print(f"Warning: {fname} not found!")
+    if found:
+        print(f"\nProcessing: {', '.join(found)}")
+        shuffle_and_create(
+            found[0], args.ntrain, args.ntest, paired=found[1:],
+            seed=args.seed, keep_shuffled=args.keep_shuffled,
+            compress=args.compress, shard_lines=args.shard_lines
+        )
 
     print("\nDone!")
 
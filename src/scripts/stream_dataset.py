@@ -0,0 +1,201 @@
+"""
+stream_dataset.py - labelled samples generated on the fly, for training
+
+Instead of writing a datafile, shuffling it, and reading it back, a
+StreamDataset draws integers with the samplers of generate_datafiles.py,
+labels them, and tokenizes them (see tokens.py) inside the DataLoader
+workers, one batch at a time:
+
+    dataset = StreamDataset('natural', targets=['mu'], seed=0)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=None, num_workers=4)
+    for tokens, labels in loader:
+        ...
+
+Samples are independent uniform draws, so the stream never ends and needs no
+shuffling. Each worker (and each process of a distributed run, given rank and
+world_size) draws from its own random stream, spawned from seed, so workers
+do not duplicate each other's samples and runs are reproducible.
+
+Test integers are held out by hash: n is in the test split if mix64(n ^ key)
+is below test_fraction of the range of the hash. This does not depend on
+the seed, so every run with the same key and test_fraction agrees on which
+integers are test integers, and the train split never contains one of them.
+Pass num_samples to make a stream finite, e.g. for a fixed test set.
+
+## License Information ##
+
+Copyright © 2025 David Lowry-Duda <david@lowryduda.com>
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import numpy as np
+
+try:
+    import torch
+    from torch.utils.data import IterableDataset, get_worker_info
+    HAS_TORCH = True
+except ImportError:
+    HAS_TORCH = False
+    IterableDataset = object
+
+from generate_datafiles import (
+    BATCH_ENCODING_FORMATS, make_batch_sampler, make_labels, make_lines,
+    shard_counts,
+)
+from tokens import encoding_tokenizer, LABEL_OFFSETS, sequence_length
+from utils import mix64_array
+
+
+SPLITS = ('train', 'test')
+
+# Mixed into n before hashing, so that the holdout is independent of the
+# shard ownership mix64(n) % workers
+HOLDOUT_SALT = 0x5DEECE66DA3B9F01
+
+
+def holdout_mask(ns, test_fraction, key=0):
+    """Boolean array: which integers of ns are held out for the test split."""
+    salt = np.uint64((HOLDOUT_SALT ^ key) & (2**64 - 1))
+    hashes = mix64_array(np.asarray(ns).astype(np.uint64) ^ salt)
+    # The hashes are uniform on [0, 2^64); compare in floating point, which
+    # is exact enough for any fraction of practical interest
+    return hashes.astype(np.float64) < test_fraction * 2.0**64
+
+
+def stream_sampler(dataset_type, min_value, max_value, rng):
+    """
+    Like make_batch_sampler, but for a stream: natural samples are independent
+    uniform draws (with repetition), rather than distinct.
+    """
+    if dataset_type == 'natural':
+        return lambda count, counts=None: rng.integers(
+            min_value, max_value, count, dtype=np.int64, endpoint=True
+        )
+    return make_batch_sampler(dataset_type, min_value, max_value, rng)
+
+
+class StreamDataset(IterableDataset):
+    """
+    An endless (or, with num_samples, finite) stream of batches of
+    batch_size samples of the dataset type ('natural', 'cheat', or
+    'non_cheat') in [min_value, max_value], from the given split.
+
+    Each batch is a pair (tokens, labels): the int64 token ids of the inputs
+    in the given encoding, one padded row per sample, and the label ids of
+    each target (a vector for one target, else one column per target). With
+    text=True, batches are instead the Int2Int lines of the first target, as
+    in the datafiles. Tensors are returned if PyTorch is installed, and NumPy
+    arrays otherwise.
+
+    Batches are already batched, so pass batch_size=None to the DataLoader.
+    threads is the number of OpenMP threads each worker uses for factoring.
+    """
+
+    def __init__(self, dataset_type='natural', encoding='interCRT100',
+                 targets=('mu',), split='train', min_value=2, max_value=10**13,
+                 seed=0, batch_size=1024, test_fraction=0.01, holdout_key=0,
+                 num_samples=None, rank=0, world_size=1, text=False, threads=1):
+        if split not in SPLITS:
+            raise ValueError(f"split must be one of {SPLITS}, not {split}")
+        if dataset_type not in ('natural', 'cheat', 'non_cheat'):
+            raise ValueError(f"cannot stream the {dataset_type} dataset")
+        if not 0 < test_fraction < 1:
+            raise ValueError("test_fraction must be between 0 and 1")
+        self.dataset_type = dataset_type
+        self.encoding = encoding
+        self.targets = list(targets)
+        self.split = split
+        self.min_value = min_value
+        self.max_value = max_value
+        self.seed = seed
+        self.batch_size = batch_size
+        self.test_fraction = test_fraction
+        self.holdout_key = holdout_key
+        self.num_samples = num_samples
+        self.rank = rank
+        self.world_size = world_size
+        self.text = text
+        self.threads = threads
+
+    def _stream(self):
+        """The index of this worker's stream, and the number of streams."""
+        worker, num_workers = 0, 1
+        if HAS_TORCH:
+            info = get_worker_info()
+            if info is not None:
+                worker, num_workers = info.id, info.num_workers
+        return self.rank * num_workers + worker, self.world_size * num_workers
+
+    def _rng(self, stream, num_streams):
+        # The splits draw from unrelated streams, so that a test set is not
+        # just the held out integers of the training stream
+        root = np.random.SeedSequence([self.seed, SPLITS.index(self.split)])
+        return np.random.default_rng(root.spawn(num_streams)[stream])
+
+    def samples(self, stream=0, num_streams=1):
+        """
+        The integers of one stream (of num_streams), in batches of at most
+        batch_size, as int64 arrays.
+        """
+        rng = self._rng(stream, num_streams)
+        sample = stream_sampler(self.dataset_type, self.min_value, self.max_value, rng)
+        remaining = None
+        if self.num_samples is not None:
+            remaining = shard_counts(self.num_samples, num_streams)[stream]
+        # Draw enough candidates to fill a batch after the holdout filter
+        keep = self.test_fraction if self.split == 'test' else 1 - self.test_fraction
+        pending = np.empty(0, dtype=np.int64)
+        while remaining is None or remaining > 0:
+            count = self.batch_size if remaining is None else min(self.batch_size, remaining)
+            while len(pending) < count:
+                candidates = sample(int(1.1 * (count - len(pending)) / keep) + 1)
+                held_out = holdout_mask(candidates, self.test_fraction, self.holdout_key)
+                candidates = candidates[held_out if self.split == 'test' else ~held_out]
+                pending = np.concatenate([pending, candidates])
+            batch, pending = pending[:count], pending[count:]
+            if remaining is not None:
+                remaining -= count
+            yield batch
+
+    def encode(self, ns):
+        """A batch of integers -> (tokens, labels), or text lines."""
+        labels = make_labels(ns, self.targets, self.threads)
+        if self.text:
+            inputs = BATCH_ENCODING_FORMATS[self.encoding](ns)
+            return make_lines(inputs, [str(x) for x in labels[self.targets[0]].tolist()])
+        tokenize = encoding_tokenizer(
+            self.encoding, sequence_length(self.encoding, self.max_value)
+        )
+        tokens = tokenize(ns).astype(np.int64)
+        ids = np.stack([
+            np.asarray(labels[target], dtype=np.int64) - LABEL_OFFSETS.get(target, 0)
+            for target in self.targets
+        ], axis=1)
+        if len(self.targets) == 1:
+            ids = ids[:, 0]
+        if HAS_TORCH:
+            return torch.from_numpy(tokens), torch.from_numpy(ids)
+        return tokens, ids
+
+    def __iter__(self):
+        stream, num_streams = self._stream()
+        for ns in self.samples(stream, num_streams):
+            yield self.encode(ns)
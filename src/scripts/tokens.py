@@ -0,0 +1,423 @@
+"""
+tokens.py - pre-tokenized datasets, and a PyTorch Dataset reading them
+
+Int2Int parses every line of a text datafile (`V200 + 1 + 2 + 0 + 3 ...`)
+and maps its words to token ids on every epoch. The vocabulary is tiny and
+fixed, so the token ids can be computed once, when the data is generated.
+A TokenWriter stores them as fixed-length int16 sequences (padded with
+PAD_ID) in .npy shards, next to one label array per target:
+
+    base.00000.npy, base.00001.npy, ...       token ids, one row per sample
+    base.00000.{target}.npy, ...              the labels of each sample
+    base.index.json                           vocabulary, sequence length,
+                                              targets, and rows per shard
+
+The sequences are the words of the text datafile, so
+" ".join(VOCAB[i] for i in row if i != PAD_ID) is exactly the input of the
+same line of the text file.
+
+TokenDataset memory-maps the shards, so reading them is zero-copy and
+DataLoader workers share the page cache instead of each holding a parsed
+copy. It is a torch.utils.data.Dataset if PyTorch is installed (and returns
+tensors), and otherwise returns NumPy arrays.
+
+## License Information ##
+
+Copyright © 2025 David Lowry-Duda <david@lowryduda.com>
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"),
+to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense,
+and/or sell copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import glob
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+
+try:
+    import torch
+    from torch.utils.data import Dataset
+    HAS_TORCH = True
+except ImportError:
+    HAS_TORCH = False
+    Dataset = object
+
+from utils import PRIMES_100, residue_matrix
+
+
+# Integers are written in base 1000, as a sign followed by digits
+BASE = 1000
+
+# Vector length symbols of the encodings
+VECTOR_WORDS = ['V100', 'V103', 'V200', 'V201']
+
+VOCAB = ['<pad>', '+', '-'] + [str(d) for d in range(BASE)] + VECTOR_WORDS
+WORD_IDS = {word: i for i, word in enumerate(VOCAB)}
+PAD_ID = WORD_IDS['<pad>']
+PLUS_ID = WORD_IDS['+']
+MINUS_ID = WORD_IDS['-']
+DIGIT0_ID = WORD_IDS['0']
+
+# Label ids are label - offset, so that Int2Int's range(-1,2) labels of mu
+# become the classes 0, 1, 2
+LABEL_OFFSETS = {'mu': -1, 'liouville': -1}
+
+# Rows of each shard (about 100 MB of interCRT100 tokens)
+DEFAULT_SHARD_ROWS = 2**17
+
+# Every .npy file is written with a header of exactly this many bytes, so
+# that the shape can be fixed up in place once the last shard is complete
+NPY_HEADER_BYTES = 128
+
+INDEX_SUFFIX = ".index.json"
+
+
+def _interCRT100_values(ns):
+    residues = residue_matrix(ns)
+    values = np.empty((len(residues), 2*residues.shape[1]), dtype=np.int64)
+    values[:, 0::2] = residues
+    values[:, 1::2] = PRIMES_100
+    return values
+
+
+def _CRT100_with_stats_values(ns):
+    residues = residue_matrix(ns)
+    num_dividing_primes = np.count_nonzero(residues == 0, axis=1)
+    stats = np.empty((len(residues), 3), dtype=np.int64)
+    stats[:, 0] = num_dividing_primes
+    stats[:, 1] = len(PRIMES_100)
+    stats[:, 2] = num_dividing_primes % 2
+    return np.concatenate([residues, stats], axis=1)
+
+
+# The integer vector encoded by each encoding (see generate_datafiles.py)
+ENCODING_VALUES = {
+    'interCRT100': _interCRT100_values,
+    'CRT100': residue_matrix,
+    'interCRT100_with_n': lambda ns: np.concatenate(
+        [_interCRT100_values(ns), np.asarray(ns, dtype=np.int64)[:, None]], axis=1
+    ),
+    'CRT100_with_stats': _CRT100_with_stats_values,
+}
+
+# Length of the vector of each encoding
+ENCODING_COLUMNS = {
+    'interCRT100': 200,
+    'CRT100': 100,
+    'interCRT100_with_n': 201,
+    'CRT100_with_stats': 103,
+}
+
+
+def num_digits(x):
+    """Number of base 1000 digits of each entry of an array of integers."""
+    x = np.abs(np.asarray(x, dtype=np.int64))
+    digits = np.ones(x.shape, dtype=np.int64)
+    power = BASE
+    while power <= x.max(initial=0):
+        digits += x >= power
+        power *= BASE
+    return digits
+
+
+def sequence_length(encoding, max_value):
+    """
+    Number of tokens of the longest input of the encoding for n up to
+    max_value: the vector length symbol, and a sign and digits per entry.
+    Every entry but n itself is below 1000, so has a single digit.
+    """
+    length = 1 + 2 * ENCODING_COLUMNS[encoding]
+    if encoding == 'interCRT100_with_n':
+        length += int(num_digits([max_value])[0]) - 1
+    return length
+
+
+def token_ids(values, header, length):
+    """
+    Integer matrix -> int16 matrix of token ids, one padded row of `length`
+    tokens per row of values, starting with the word header.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    N, M = values.shape
+    digits = num_digits(values)
+    D = int(digits.max(initial=1))
+    # slots[i, j] holds the sign and then the digits of values[i, j], most
+    # significant first, or -1 past the last digit
+    slots = np.full((N, M, 1 + D), -1, dtype=np.int64)
+    slots[..., 0] = np.where(values < 0, MINUS_ID, PLUS_ID)
+    x = np.abs(values)
+    for k in range(D):
+        # digit k (from the least significant) goes to slot digits - k
+        slot = digits - k
+        digit = DIGIT0_ID + x % BASE
+        i, j = np.nonzero(slot >= 1)
+        slots[i, j, slot[i, j]] = digit[i, j]
+        x //= BASE
+    flat = slots.reshape(N, -1)
+    used = flat >= 0
+    if N and 1 + used.sum(axis=1).max() > length:
+        raise ValueError(f"inputs need more than {length} tokens")
+    tokens = np.full((N, length), PAD_ID, dtype=np.int16)
+    tokens[:, 0] = WORD_IDS[header]
+    rows = np.nonzero(used)[0]
+    tokens[rows, np.cumsum(used, axis=1)[used]] = flat[used]
+    return tokens
+
+
+def encoding_tokenizer(encoding, length):
+    """The function mapping an array of n to their token id matrix."""
+    values = ENCODING_VALUES[encoding]
+    header = f"V{ENCODING_COLUMNS[encoding]}"
+    return lambda ns: token_ids(values(ns), header, length)
+
+
+def decode(row):
+    """Token ids -> the words of the Int2Int input (for checking)."""
+    return " ".join(VOCAB[i] for i in np.asarray(row).tolist() if i != PAD_ID)
+
+
+def index_path(base):
+    return base + INDEX_SUFFIX
+
+
+def _shard(base, k, target=None):
+    return f"{base}.{k:05d}.npy" if target is None else f"{base}.{k:05d}.{target}.npy"
+
+
+def _pattern(base):
+    return re.compile(re.escape(os.path.basename(base))
+                      + r"\.((\d{5})(\.\w+)?\.npy|index\.json)$")
+
+
+def _pieces(base):
+    """Every shard and index file of base (complete or not)."""
+    pattern = _pattern(base)
+    return [path for path in glob.glob(glob.escape(base) + ".*")
+            if pattern.match(os.path.basename(path))]
+
+
+def remove_tokens(base):
+    """Delete the token dataset base, and any leftovers of writing it."""
+    for path in _pieces(base):
+        os.remove(path)
+
+
+def _npy_header(dtype, shape):
+    """A .npy (version 1.0) header padded to exactly NPY_HEADER_BYTES."""
+    header = repr({
+        'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+        'fortran_order': False,
+        'shape': tuple(shape),
+    })
+    prefix = b"\x93NUMPY\x01\x00"
+    size = NPY_HEADER_BYTES - len(prefix) - 2
+    header = header.ljust(size - 1) + "\n"
+    return prefix + len(header).to_bytes(2, "little") + header.encode("latin1")
+
+
+class TokenWriter:
+    """
+    Write token id rows (of `length` int16 tokens) and their labels (a dict
+    target -> array) to the shards of base, shard_rows rows per shard.
+
+    Rows are appended to the .npy files as they come, and the shape in the
+    header of the last shard is fixed up on close. To resume after the first
+    `rows` rows, pass rows: anything written after them is dropped.
+    """
+
+    def __init__(self, base, targets, length, encoding,
+                 shard_rows=DEFAULT_SHARD_ROWS, rows=0):
+        self.base = base
+        self.targets = list(targets)
+        self.length = length
+        self.encoding = encoding
+        self.shard_rows = shard_rows
+        self.dtypes = {None: np.int16, **{t: np.int64 for t in self.targets}}
+        self.rows = rows
+        self.handles = {}
+
+        k, rows_in_shard = divmod(rows, shard_rows)
+        pattern = _pattern(base)
+        for path in _pieces(base):
+            shard = pattern.match(os.path.basename(path)).group(2)
+            if shard is None or int(shard) > k or (int(shard) == k and not rows_in_shard):
+                os.remove(path)
+        if rows_in_shard:
+            self._open(k, truncate_rows=rows_in_shard)
+
+    def _row_bytes(self, key):
+        width = self.length if key is None else 1
+        return width * np.dtype(self.dtypes[key]).itemsize
+
+    def _shape(self, key, rows):
+        return (rows, self.length) if key is None else (rows,)
+
+    def _open(self, k, truncate_rows=None):
+        """Open the files of shard k for appending."""
+        for f in self.handles.values():
+            f.close()
+        self.handles = {}
+        for key in [None, *self.targets]:
+            path = _shard(self.base, k, key)
+            header = _npy_header(self.dtypes[key], self._shape(key, self.shard_rows))
+            if truncate_rows is None:
+                with open(path, "wb") as f:
+                    f.write(header)
+            else:
+                os.truncate(path, NPY_HEADER_BYTES + truncate_rows * self._row_bytes(key))
+                # An interrupted run may have closed the shard, and written
+                # its short shape into the header
+                with open(path, "r+b") as f:
+                    f.write(header)
+            self.handles[key] = open(path, "ab")
+
+    def files(self):
+        """The open files (for checkpoints)."""
+        return list(self.handles.values())
+
+    def write(self, tokens, labels):
+        """Append rows of token ids and their labels. Returns the bytes written."""
+        start = 0
+        while start < len(tokens):
+            k, offset = divmod(self.rows, self.shard_rows)
+            if offset == 0:
+                self._open(k)
+            end = min(len(tokens), start + self.shard_rows - offset)
+            self.handles[None].write(np.ascontiguousarray(tokens[start:end], dtype=np.int16).tobytes())
+            for target in self.targets:
+                self.handles[target].write(
+                    np.ascontiguousarray(labels[target][start:end], dtype=np.int64).tobytes()
+                )
+            self.rows += end - start
+            start = end
+        return len(tokens) * sum(self._row_bytes(key) for key in self.dtypes)
+
+    def close(self):
+        for f in self.handles.values():
+            f.close()
+        self.handles = {}
+        num_shards, last = divmod(self.rows, self.shard_rows)
+        shards = [self.shard_rows] * num_shards
+        if last:
+            shards.append(last)
+            # The last shard is short; fix the shape in its headers
+            for key in [None, *self.targets]:
+                with open(_shard(self.base, num_shards, key), "r+b") as f:
+                    f.write(_npy_header(self.dtypes[key], self._shape(key, last)))
+        _write_index(self.base, {
+            'encoding': self.encoding,
+            'length': self.length,
+            'vocab': VOCAB,
+            'pad_id': PAD_ID,
+            'targets': self.targets,
+            'label_offsets': {t: LABEL_OFFSETS.get(t, 0) for t in self.targets},
+            'rows': self.rows,
+            'shards': shards,
+        })
+
+
+def read_index(base):
+    with open(index_path(base)) as f:
+        return json.load(f)
+
+
+def _write_index(base, index):
+    tmp = index_path(base) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp, index_path(base))
+
+
+def join_tokens(sources, dest):
+    """
+    Join the token datasets sources, in order, into dest, by hard linking
+    (or copying) their shards. The sources are left in place.
+    """
+    remove_tokens(dest)
+    index = None
+    shards = []
+    for base in sources:
+        source_index = read_index(base)
+        index = index or source_index
+        for k, rows in enumerate(source_index['shards']):
+            for key in [None, *source_index['targets']]:
+                src, target = _shard(base, k, key), _shard(dest, len(shards), key)
+                try:
+                    os.link(src, target)
+                except OSError:
+                    shutil.copyfile(src, target)
+            shards.append(rows)
+    _write_index(dest, dict(index, rows=sum(shards), shards=shards))
+
+
+class TokenDataset(Dataset):
+    """
+    The samples of the token dataset base, as (tokens, label id) pairs for
+    the given label target, read from memory-mapped shards.
+    """
+
+    def __init__(self, base, target='mu'):
+        self.index = read_index(base)
+        if target not in self.index['targets']:
+            raise ValueError(f"{base} has no labels for {target}")
+        self.tokens = [np.load(_shard(base, k), mmap_mode='r')
+                       for k in range(len(self.index['shards']))]
+        self.labels = [np.load(_shard(base, k, target), mmap_mode='r')
+                       for k in range(len(self.index['shards']))]
+        self.offset = self.index['label_offsets'][target]
+        self.starts = np.cumsum([0] + self.index['shards'])
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def _locate(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        i %= len(self)
+        k = int(np.searchsorted(self.starts, i, side='right')) - 1
+        return k, i - int(self.starts[k])
+
+    def __getitem__(self, i):
+        k, j = self._locate(i)
+        tokens = np.array(self.tokens[k][j], dtype=np.int64)
+        label = int(self.labels[k][j]) - self.offset
+        if HAS_TORCH:
+            return torch.from_numpy(tokens), torch.tensor(label)
+        return tokens, label
+
+    def batch(self, indices):
+        """
+        (tokens, label ids) of many samples at once, as arrays (or tensors),
+        which is faster than indexing one sample at a time.
+        """
+        indices = np.asarray(indices, dtype=np.int64) % max(len(self), 1)
+        shard = np.searchsorted(self.starts, indices, side='right') - 1
+        tokens = np.empty((len(indices), self.index['length']), dtype=np.int64)
+        labels = np.empty(len(indices), dtype=np.int64)
+        for k in np.unique(shard).tolist():
+            where = np.nonzero(shard == k)[0]
+            rows = indices[where] - self.starts[k]
+            tokens[where] = self.tokens[k][rows]
+            labels[where] = self.labels[k][rows] - self.offset
+        if HAS_TORCH:
+            return torch.from_numpy(tokens), torch.from_numpy(labels)
+        return tokens, labels
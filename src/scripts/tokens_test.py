@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from tokens import (
+    decode, encoding_tokenizer, join_tokens, sequence_length, TokenDataset,
+    TokenWriter,
+)
+
+
+MAX_VALUE = 10**13
+LENGTH = sequence_length('interCRT100', MAX_VALUE)
+
+
+def make_rows(start, stop):
+    ns = np.arange(start, stop, dtype=np.int64) * 7919 + 2
+    tokens = encoding_tokenizer('interCRT100', LENGTH)(ns)
+    return tokens, {'mu': ns % 3 - 1}
+
+
+class TestTokens(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.base = os.path.join(self.tmpdir.name, "tokens")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, base, start, stop, rows=0):
+        writer = TokenWriter(base, ['mu'], LENGTH, 'interCRT100',
+                             shard_rows=100, rows=rows)
+        tokens, labels = make_rows(start, stop)
+        writer.write(tokens, labels)
+        writer.close()
+
+    def check(self, base, rows):
+        dataset = TokenDataset(base)
+        self.assertEqual(len(dataset), rows)
+        tokens, labels = make_rows(0, rows)
+        batch_tokens, batch_labels = dataset.batch(np.arange(rows))
+        self.assertTrue(np.array_equal(np.asarray(batch_tokens), tokens))
+        self.assertTrue(np.array_equal(np.asarray(batch_labels), labels['mu'] + 1))
+        for i in (0, 99, 100, 150, rows - 1, -1):
+            row, label = dataset[i]
+            self.assertEqual(decode(np.asarray(row)), decode(tokens[i]))
+            self.assertEqual(int(label), labels['mu'][i] + 1)
+
+    def test_round_trip(self):
+        self.write(self.base, 0, 250)
+        self.check(self.base, 250)
+
+    def test_resume(self):
+        # Checkpoints at 120 and 200 rows; the interrupted run closes its
+        # files after 150 and 290 rows, writing the short shapes of the shard
+        # it was in, which the resumed run then fills
+        for checkpoint, interrupted in ((120, 150), (200, 290), (200, 200)):
+            self.write(self.base, 0, interrupted)
+            tokens, labels = make_rows(checkpoint, 330)
+            writer = TokenWriter(self.base, ['mu'], LENGTH, 'interCRT100',
+                                 shard_rows=100, rows=checkpoint)
+            writer.write(tokens, labels)
+            writer.close()
+            self.check(self.base, 330)
+            for k in range(3):
+                shard = np.load(f"{self.base}.{k:05d}.npy", mmap_mode='r')
+                self.assertEqual(shard.shape, (100, LENGTH))
+
+    def test_join(self):
+        sources = [os.path.join(self.tmpdir.name, f"part{k}") for k in range(2)]
+        self.write(sources[0], 0, 200)
+        self.write(sources[1], 200, 250)
+        join_tokens(sources, self.base)
+        self.check(self.base, 250)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -24,12 +24,98 @@ TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
 OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 import ctypes
+import itertools
+import math
 import os
 
+import numpy as np
 
-dldlib = ctypes.CDLL(os.path.abspath('../mobius_code/mobius.so'))
-dldmobius = dldlib.mobius
-dldmobius.argtypes = [ctypes.c_longlong]
+from shards import DEFAULT_SHARD_LINES, open_text, open_text_writer, text_size
+
+# mobius.so is optional: without it, the pure NumPy backend
+# (numpy_factor_stats) is used instead.
+MOBIUS_SO_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'mobius_code', 'mobius.so'
+)
+try:
+    dldlib = ctypes.CDLL(MOBIUS_SO_PATH)
+    HAS_MOBIUS_SO = True
+except OSError:
+    dldlib = None
+    HAS_MOBIUS_SO = False
+    print("Note: mobius.so not found, using the (slower) NumPy backend."
+          " Build it with make in src/mobius_code.")
+
+if HAS_MOBIUS_SO:
+    dldmobius = dldlib.mobius
+    dldmobius.argtypes = [ctypes.c_longlong]
+    dldmobius_array = dldlib.mobius_array
+    dldmobius_array.argtypes = [
+        ctypes.c_void_p, ctypes.c_void_p, ctypes.c_longlong, ctypes.c_int
+    ]
+    dldmobius_array.restype = None
+
+    dldfactor_stats_array = dldlib.factor_stats_array
+    dldfactor_stats_array.argtypes = [ctypes.c_void_p] * 6 + [
+        ctypes.c_longlong, ctypes.c_int
+    ]
+    dldfactor_stats_array.restype = None
+
+    dldrho_factor_stats_array = dldlib.rho_factor_stats_array
+    dldrho_factor_stats_array.argtypes = [ctypes.c_void_p] * 6 + [
+        ctypes.c_longlong, ctypes.c_int
+    ]
+    dldrho_factor_stats_array.restype = None
+else:
+    def dldmobius(n):
+        """mu(n), from the NumPy backend."""
+        return int(numpy_mobius_array([n])[0])
+
+
+def factor_stats(ns, nthreads=1):
+    """
+    Factor each n once and return a dict of arrays with
+      omega:      number of distinct prime factors (int8),
+      bigomega:   number of prime factors with multiplicity (int8),
+      squarefree: 1 if n is squarefree, else 0 (int8),
+      spf:        smallest prime factor, or 1 for n = 1 (int64),
+      rad:        squarefree kernel, the product of the primes dividing n
+                  (int64).
+    Everything is 0 for n < 1. Threads are used as in mobius_array.
+    """
+    if not HAS_MOBIUS_SO:
+        return numpy_factor_stats(ns)
+    ns = np.ascontiguousarray(ns, dtype=np.int64)
+    out = {
+        'omega': np.empty(len(ns), dtype=np.int8),
+        'bigomega': np.empty(len(ns), dtype=np.int8),
+        'squarefree': np.empty(len(ns), dtype=np.int8),
+        'spf': np.empty(len(ns), dtype=np.int64),
+        'rad': np.empty(len(ns), dtype=np.int64),
+    }
+    dldfactor_stats_array(
+        ns.ctypes.data, *(arr.ctypes.data for arr in out.values()), len(ns),
+        nthreads
+    )
+    return out
+
+
+def mobius_array(ns, nthreads=1):
+    """
+    Batch version of dldmobius: array of n -> int8 array of mu(n).
+
+    This is a single call into mobius.so. ctypes releases the GIL for the
+    duration of the call, and if mobius.so was built with OpenMP then the work
+    is split across `nthreads` threads (0 means use every core).
+
+    Without mobius.so, this uses numpy_mobius_array (and ignores nthreads).
+    """
+    if not HAS_MOBIUS_SO:
+        return numpy_mobius_array(ns)
+    ns = np.ascontiguousarray(ns, dtype=np.int64)
+    out = np.empty(len(ns), dtype=np.int8)
+    dldmobius_array(ns.ctypes.data, out.ctypes.data, len(ns), nthreads)
+    return out
 
 
 def encode_integer(val, base=1000, digit_sep=" "):
@@ -52,6 +138,107 @@ def encode_integer_array(x, base=1000):
     return f'V{len(x)} ' + " ".join(encode_integer(int(z), base) for z in x)
 
 
+MASK64 = (1 << 64) - 1
+
+
+def mix64(x):
+    """
+    The splitmix64 finalizer: a fast, well-mixed hash of a 64-bit integer.
+    """
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+def mix64_array(x):
+    """
+    Vectorized mix64 on a NumPy array, computed in wrapping uint64 arithmetic.
+    """
+    x = np.asarray(x).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class KeyedPermutation:
+    """
+    A seeded bijection of [0, size), which can be evaluated at any index.
+
+    This is a balanced Feistel network on the smallest even number of bits
+    covering [0, size), restricted to [0, size) by cycle walking: values that
+    land outside the range are encrypted again until they land inside. It uses
+    O(1) memory, and taking the images of 0, 1, ..., N-1 gives N distinct
+    pseudorandom values without checking for (or rejecting) duplicates.
+    """
+
+    def __init__(self, size, seed=None, rounds=4):
+        if not 0 < size <= 2**63:
+            raise ValueError(f"Cannot permute a range of size {size}")
+        self.size = size
+        bits = max(2, (size - 1).bit_length())
+        bits += bits % 2
+        self.half_bits = np.uint64(bits // 2)
+        self.half_mask = np.uint64((1 << (bits // 2)) - 1)
+        self.keys = np.random.SeedSequence(seed).generate_state(rounds, np.uint64)
+
+    def _encrypt(self, x):
+        left = x >> self.half_bits
+        right = x & self.half_mask
+        for key in self.keys:
+            left, right = right, left ^ (mix64_array(right ^ key) & self.half_mask)
+        return (left << self.half_bits) | right
+
+    def __call__(self, indices):
+        """Array of indices in [0, size) -> uint64 array of their images."""
+        out = self._encrypt(np.asarray(indices, dtype=np.uint64))
+        outside = np.flatnonzero(out >= np.uint64(self.size))
+        while len(outside):
+            out[outside] = self._encrypt(out[outside])
+            outside = outside[out[outside] >= np.uint64(self.size)]
+        return out
+
+    def __getitem__(self, index):
+        return int(self(np.array([index]))[0])
+
+
+def small_integer_tokens(x):
+    """
+    Array of integers in [0, 1000) -> array of Int2Int tokens (as strings).
+
+    This is a table lookup, so it agrees with `encode_integer` on that range.
+    """
+    return _small_integer_tokens[x]
+
+
+def encode_token_matrix(tokens):
+    """
+    2d array of Int2Int tokens -> list of Int2Int vectors, one for each row.
+    """
+    prefix = f'V{tokens.shape[1]} '
+    return [prefix + " ".join(row) for row in tokens.tolist()]
+
+
+def residue_matrix(ns, primes=None):
+    """
+    Compute [[n mod p for p in primes] for n in ns] in one vectorized step.
+
+    `primes` defaults to the first 100 primes. An object array of Python
+    integers (e.g. beyond int64) is also accepted.
+    """
+    if primes is None:
+        primes = PRIMES_100
+    ns = np.asarray(ns)
+    if ns.dtype == object:
+        # Python integers, possibly beyond int64
+        return np.array(
+            [[n % int(p) for p in primes] for n in ns.tolist()],
+            dtype=np.int64
+        ).reshape(len(ns), len(primes))
+    ns = ns.astype(np.int64)
+    return ns[:, None] % np.asarray(primes, dtype=np.int64)[None, :]
+
+
 def primes_up_to(X):
     """
     A basic implementation of Eratosthenes.
@@ -82,7 +269,577 @@ def mobius_up_to(X):
     return arr
 
 
+def primes_array_up_to(X):
+    """
+    Eratosthenes in NumPy: int64 array of the primes <= X.
+    """
+    if X < 2:
+        return np.array([], dtype=np.int64)
+    arr = np.ones(X + 1, dtype=bool)
+    arr[:2] = False
+    for p in range(2, math.isqrt(X) + 1):
+        if arr[p]:
+            arr[p*p::p] = False
+    return np.flatnonzero(arr).astype(np.int64)
+
+
+_base_primes = np.array([], dtype=np.int64)
+_base_primes_limit = 1
+
+
+def base_primes_up_to(X):
+    """
+    Cached int64 array of the primes <= X.
+
+    The sieve is only rerun when X exceeds every previous request, and then it
+    at least doubles the cached range, so a run over many windows computes its
+    base primes essentially once.
+    """
+    global _base_primes, _base_primes_limit
+    if X > _base_primes_limit:
+        _base_primes_limit = max(X, 2 * _base_primes_limit)
+        _base_primes = primes_array_up_to(_base_primes_limit)
+    return _base_primes[:np.searchsorted(_base_primes, X, side='right')]
+
+
+def mobius_segment(L, W):
+    """
+    Segmented sieve: int8 array of mu(n) for n in [L, L + W).
+
+    Memory use is O(W) plus the cached base primes up to sqrt(L + W), so this
+    works for windows anywhere below 2^63. Values n < 1 get mu(n) = 0, to
+    agree with dldmobius.
+    """
+    R = L + W
+    mu = np.ones(W, dtype=np.int8)
+    # product of the distinct primes up to sqrt(R) dividing each n
+    prod = np.ones(W, dtype=np.int64)
+    primes = base_primes_up_to(math.isqrt(max(R - 1, 0)))
+
+    # Primes below W hit the window many times; stride through it.
+    num_small = np.searchsorted(primes, W)
+    for p in primes[:num_small].tolist():
+        start = (-L) % p
+        mu[start::p] *= -1
+        prod[start::p] *= p
+        start = (-L) % (p*p)
+        mu[start::p*p] = 0
+
+    # Primes at least W hit the window at most once; do them all at once.
+    large = primes[num_small:]
+    idx = (-L) % large
+    hit = idx < W
+    idx, large = idx[hit], large[hit]
+    mu[np.bincount(idx, minlength=W) % 2 == 1] *= -1
+    np.multiply.at(prod, idx, large)
+    large = primes[num_small:]
+    idx = (-L) % (large * large)
+    mu[idx[idx < W]] = 0
+
+    # Anything left over is a single prime larger than sqrt(R).
+    ns = np.arange(L, R, dtype=np.int64)
+    mu[prod != ns] *= -1
+    mu[ns < 1] = 0
+    return mu
+
+
+# Number of (candidate, prime) pairs tested at a time in numpy_factor_stats
+TRIAL_DIVISION_BLOCK = 2**20
+
+
+def numpy_factor_stats(ns):
+    """
+    Pure NumPy version of factor_stats, by vectorized trial division.
+
+    The cofactors of all n still being factored (the active set) are tested
+    against a block of the cached base primes at a time. A cofactor r is
+    divisible by p exactly when rint(r * (1/p)) * p == r, which is a fast
+    floating point test for r < 2^53 (larger cofactors use integer %). After
+    each block, n leaves the active set once its cofactor r satisfies
+    r < p^2, so that r is 1 or prime.
+    """
+    ns = np.asarray(ns, dtype=np.int64)
+    size = len(ns)
+    omega = np.zeros(size, dtype=np.int8)
+    bigomega = np.zeros(size, dtype=np.int8)
+    spf = np.zeros(size, dtype=np.int64)
+    rad = np.zeros(size, dtype=np.int64)
+    positive = ns >= 1
+    spf[positive] = 1
+    rad[positive] = 1
+
+    rem = ns.copy()
+    active = np.flatnonzero(ns >= 4)
+    primes = base_primes_up_to(math.isqrt(int(ns.max())) if size else 1)
+    start = 0
+    while len(active) and start < len(primes):
+        width = max(1, TRIAL_DIVISION_BLOCK // len(active))
+        block = primes[start:start + width]
+        start += width
+
+        r = rem[active]
+        if r.max() < 2**53:
+            rf = r.astype(np.float64)[:, None]
+            bf = block.astype(np.float64)
+            divides = np.rint(rf * (1 / bf)) * bf == rf
+        else:
+            divides = r[:, None] % block == 0
+        rows, cols = np.nonzero(divides)
+        if len(rows):
+            # rows is sorted, and for each n its primes come in increasing order
+            idx = active[rows]
+            p = block[cols]
+            exponent = np.ones(len(idx), dtype=np.int8)
+            power = p.copy()
+            q = rem[idx] // p
+            repeat = q % p == 0
+            while repeat.any():
+                exponent[repeat] += 1
+                power[repeat] *= p[repeat]
+                q[repeat] //= p[repeat]
+                repeat[repeat] = q[repeat] % p[repeat] == 0
+            np.add.at(omega, idx, 1)
+            np.add.at(bigomega, idx, exponent)
+            np.multiply.at(rad, idx, p)
+            np.floor_divide.at(rem, idx, power)
+            first = np.ones(len(idx), dtype=bool)
+            first[1:] = idx[1:] != idx[:-1]
+            new = first & (spf[idx] == 1)
+            spf[idx[new]] = p[new]
+
+        if start < len(primes):
+            bound = primes[start]
+            still = rem[active] >= bound * bound
+            active = active[still]
+
+    # What is left of each cofactor is 1 or a single prime
+    big = positive & (rem > 1)
+    omega[big] += 1
+    bigomega[big] += 1
+    rad[big] *= rem[big]
+    spf[big & (spf == 1)] = rem[big & (spf == 1)]
+    return {
+        'omega': omega,
+        'bigomega': bigomega,
+        'squarefree': (positive & (omega == bigomega)).astype(np.int8),
+        'spf': spf,
+        'rad': rad,
+    }
+
+
+def numpy_mobius_array(ns):
+    """Pure NumPy version of mobius_array, from numpy_factor_stats."""
+    return stats_mobius(numpy_factor_stats(ns))
+
+
 primes_100 = primes_up_to(542)
+PRIMES_100 = np.array(primes_100, dtype=np.int64)
+
+
+def _primorial_chunks(primes, bound=2**62):
+    """Split the product of primes into factors below bound."""
+    chunks = [1]
+    for p in primes:
+        if chunks[-1] * p >= bound:
+            chunks.append(1)
+        chunks[-1] *= p
+    return chunks
+
+
+_primorial_100_chunks = _primorial_chunks(primes_100)
+
+
+def is_smooth_array(ns):
+    """
+    Boolean array: is each n composed only of the first 100 primes?
+
+    This is a vectorized version of repeated trial division. The product of
+    primes_100 is split into a few int64 factors P, and each n is repeatedly
+    divided by gcd(n, P) until no prime factor from that P remains. Values
+    n < 1 are never smooth.
+    """
+    ns = np.asarray(ns, dtype=np.int64)
+    positive = ns >= 1
+    rem = np.where(positive, ns, 1)
+    for chunk in _primorial_100_chunks:
+        g = np.gcd(rem, chunk)
+        active = np.flatnonzero(g > 1)
+        while len(active):
+            rem[active] //= g[active]
+            g[active] = np.gcd(rem[active], g[active])
+            active = active[g[active] > 1]
+    return positive & (rem == 1)
+
+
+# Miller-Rabin with these bases is deterministic for n < 3.3 * 10^24
+MILLER_RABIN_BASES = primes_100[:12]
+MILLER_RABIN_LIMIT = 3317044064679887385961981
+
+
+def is_probable_prime(n):
+    """
+    Miller-Rabin test for a Python integer n. This is exact for
+    n < MILLER_RABIN_LIMIT (and so for every 64-bit n). Larger n are tested
+    with the first 50 primes as bases.
+    """
+    if n < 2:
+        return False
+    for p in MILLER_RABIN_BASES:
+        if n % p == 0:
+            return n == p
+    d = n - 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    bases = MILLER_RABIN_BASES if n < MILLER_RABIN_LIMIT else primes_100[:50]
+    for a in bases:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def pollard_brent(n):
+    """
+    A nontrivial factor of the odd composite n, by Pollard rho with Brent's
+    cycle detection. This is the Python version of pollard_brent in mobius.so.
+    """
+    m = 128
+    for c in itertools.count(1):
+        y, q, g, r = 2, 1, 1, 1
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y * y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(m, r - k)):
+                    y = (y * y + c) % n
+                    q = q * abs(x - y) % n
+                g = math.gcd(q, n)
+                k += m
+            r *= 2
+        if g == n:
+            # The batched product overshot; redo the last batch one step at a time
+            while True:
+                ys = (ys * ys + c) % n
+                g = math.gcd(abs(x - ys), n)
+                if g > 1:
+                    break
+        if g != n:
+            return g
+
+
+def factorize(n):
+    """
+    Prime factorization of a Python integer n >= 1, as a dict {p: e} sorted by
+    p. Primes below 1000 are removed by trial division, and the rest of n is
+    split by Miller-Rabin and Pollard rho.
+    """
+    factors = {}
+    for p in primes_up_to(1000):
+        if p * p > n:
+            break
+        while n % p == 0:
+            factors[p] = factors.get(p, 0) + 1
+            n //= p
+    stack = [n] if n > 1 else []
+    while stack:
+        m = stack.pop()
+        if m < 1000 * 1000 or is_probable_prime(m):
+            factors[m] = factors.get(m, 0) + 1
+            continue
+        d = pollard_brent(m)
+        stack.extend([d, m // d])
+    return dict(sorted(factors.items()))
+
+
+# Above this size, labels are computed with Pollard rho instead of trial
+# division (see label_factor_stats)
+RHO_THRESHOLD = 10**8
+
+# Without mobius.so, Pollard rho runs in pure Python, and vectorized trial
+# division (numpy_factor_stats) is faster for n up to this size
+NUMPY_FACTOR_LIMIT = 10**14
+
+
+def rho_factor_stats(ns, nthreads=1):
+    """
+    The same statistics as factor_stats, computed by Miller-Rabin and Pollard
+    rho, so that the cost grows like n^(1/4) instead of sqrt(n).
+
+    ns may hold any integers: 1 <= n < 2^64 are handled by
+    rho_factor_stats_array in mobius.so (with threads as in mobius_array),
+    and larger n (in an object array of Python integers) by factorize, as is
+    everything if mobius.so is missing. The spf and rad columns are int64 if
+    every n is below 2^63, and object arrays of Python integers otherwise.
+    """
+    ns = np.asarray(ns)
+    if ns.dtype != object:
+        ns = ns.astype(np.int64)
+    values = ns.tolist()
+    size = len(values)
+    out = {
+        'omega': np.zeros(size, dtype=np.int8),
+        'bigomega': np.zeros(size, dtype=np.int8),
+        'squarefree': np.zeros(size, dtype=np.int8),
+        'spf': np.zeros(size, dtype=np.uint64),
+        'rad': np.zeros(size, dtype=np.uint64),
+    }
+
+    fast = [i for i, n in enumerate(values) if 1 <= n < 2**64]
+    slow = [i for i, n in enumerate(values) if n >= 2**64]
+    if HAS_MOBIUS_SO:
+        fast_ns = np.array([values[i] for i in fast], dtype=np.uint64)
+        fast_out = {key: np.empty(len(fast), dtype=arr.dtype)
+                    for key, arr in out.items()}
+        dldrho_factor_stats_array(
+            fast_ns.ctypes.data, *(arr.ctypes.data for arr in fast_out.values()),
+            len(fast), nthreads
+        )
+        for key, arr in fast_out.items():
+            out[key][fast] = arr
+    else:
+        slow = fast + slow
+
+    wide_type = np.int64 if max(values, default=0) < 2**63 else object
+    out['spf'] = np.array(out['spf'].tolist(), dtype=wide_type)
+    out['rad'] = np.array(out['rad'].tolist(), dtype=wide_type)
+    for i in slow:
+        factors = factorize(values[i])
+        out['omega'][i] = len(factors)
+        out['bigomega'][i] = sum(factors.values())
+        out['squarefree'][i] = all(e == 1 for e in factors.values())
+        out['spf'][i] = next(iter(factors), 1)
+        out['rad'][i] = math.prod(factors)
+    return out
+
+
+def stats_mobius(stats):
+    """int8 array of mu(n) from the statistics of factor_stats."""
+    mu = np.where(stats['omega'] % 2 == 0, 1, -1).astype(np.int8)
+    return mu * stats['squarefree']
+
+
+def rho_mobius_array(ns, nthreads=1):
+    """Version of mobius_array by Pollard rho, from rho_factor_stats."""
+    return stats_mobius(rho_factor_stats(ns, nthreads))
+
+
+def _use_rho(ns):
+    """Whether Pollard rho is the fastest way to factor the array ns."""
+    if not len(ns):
+        return False
+    if ns.dtype == object:
+        return True
+    limit = RHO_THRESHOLD if HAS_MOBIUS_SO else NUMPY_FACTOR_LIMIT
+    return ns.max() >= limit
+
+
+def label_factor_stats(ns, nthreads=1):
+    """
+    factor_stats by the fastest method for the size of n: trial division if
+    every n is below RHO_THRESHOLD (or, without mobius.so, below
+    NUMPY_FACTOR_LIMIT), and Pollard rho otherwise. Unlike factor_stats,
+    this accepts integers beyond int64 (see rho_factor_stats).
+    """
+    ns = np.asarray(ns)
+    if _use_rho(ns):
+        return rho_factor_stats(ns, nthreads)
+    return factor_stats(ns, nthreads)
+
+
+def label_mobius_array(ns, nthreads=1):
+    """mobius_array by the fastest method for the size of n."""
+    ns = np.asarray(ns)
+    if _use_rho(ns):
+        return rho_mobius_array(ns, nthreads)
+    return mobius_array(ns, nthreads)
+
+
+def mobius(n):
+    """mu(n) for any Python integer n, by the fastest method for its size."""
+    if n < RHO_THRESHOLD:
+        return dldmobius(n)
+    return int(rho_mobius_array(np.array([n], dtype=object))[0])
+
+
+class SmoothCounter:
+    """
+    Counts of, and exact uniform samples from, the integers in [lo, hi] whose
+    prime factors are all among primes (by default primes_100).
+
+    Write psi(x, k) for the number of n <= x whose prime factors are among
+    the first k primes. Every such n is p_k^e * m with m composed of the
+    first k - 1 primes, so
+
+        psi(x, k) = sum over e >= 0 of psi(x // p_k^e, k - 1).
+
+    Starting from x = hi and x = lo - 1, this recursion only ever needs x of
+    the form hi // m or (lo - 1) // m. For each k, the needed x >= small_limit
+    are kept in a sorted array levels[k] with their counts in values[k], and
+    the counts for x < small_limit come from a table of all k at once.
+
+    To sample, the exponents of p_100, p_99, ..., p_1 are drawn in turn, each
+    with probability proportional to the number of smooth n in the remaining
+    interval with that exponent. This is exactly uniform, with no rejection.
+
+    For [2, 10^13] there are about 10^7 needed (x, k), which take about 10
+    seconds and 200MB to count.
+    """
+
+    def __init__(self, lo, hi, primes=None, small_limit=2**16):
+        if primes is None:
+            primes = primes_100
+        self.lo = max(lo, 1)
+        self.hi = hi
+        self.primes = list(primes)
+        self.small_limit = small_limit
+        self.small_table = self._small_table()
+        self.levels, self.values = self._count()
+
+    def _small_table(self):
+        """int32 array of psi(x, k) for x < small_limit and all k."""
+        T = self.small_limit
+        table = np.empty((len(self.primes) + 1, T), dtype=np.int32)
+        smooth = np.zeros(T, dtype=np.int32)
+        smooth[1] = 1
+        table[0] = np.cumsum(smooth)
+        for k, p in enumerate(self.primes, start=1):
+            # smooth[n] counts n = p^e * m for smooth m
+            new = smooth.copy()
+            pe = p
+            while pe < T:
+                new[pe::pe] += smooth[1:(T - 1) // pe + 1]
+                pe *= p
+            smooth = new
+            table[k] = np.cumsum(smooth)
+        return table
+
+    def _count(self):
+        T = self.small_limit
+        K = len(self.primes)
+        levels = [None] * (K + 1)
+        current = np.array([self.hi, self.lo - 1], dtype=np.int64)
+        current = np.unique(current[current >= T])
+        for k in range(K, 0, -1):
+            p = self.primes[k - 1]
+            parts = [current]
+            frontier = current
+            while len(frontier):
+                frontier = frontier // p
+                frontier = frontier[frontier >= T]
+                parts.append(frontier)
+            current = np.unique(np.concatenate(parts))
+            levels[k] = current
+
+        values = [None] * (K + 1)
+        for k in range(1, K + 1):
+            p = self.primes[k - 1]
+            x = levels[k].copy()
+            counts = np.zeros(len(x), dtype=np.int64)
+            while len(x) and x[-1] >= 1:
+                # x is sorted, so x >= 1 in a suffix
+                start = np.searchsorted(x, 1)
+                counts[start:] += self._psi(x[start:], k - 1, levels, values)
+                x //= p
+            values[k] = counts
+        return levels, values
+
+    def _psi(self, x, k, levels=None, values=None):
+        if levels is None:
+            levels, values = self.levels, self.values
+        x = np.asarray(x, dtype=np.int64)
+        out = np.zeros(x.shape, dtype=np.int64)
+        small = (x >= 0) & (x < self.small_limit)
+        out[small] = self.small_table[k][x[small]]
+        large = x >= self.small_limit
+        if k == 0:
+            out[large] = 1
+        elif large.any():
+            out[large] = values[k][np.searchsorted(levels[k], x[large])]
+        return out
+
+    def psi(self, x, k=None):
+        """
+        Array of psi(x, k) for an array of x. Every x must be hi // m or
+        (lo - 1) // m for a product m of the primes after the first k.
+        """
+        if k is None:
+            k = len(self.primes)
+        return self._psi(x, k)
+
+    def count(self):
+        """Number of smooth n in [lo, hi]."""
+        return int(self.psi(self.hi) - self.psi(self.lo - 1))
+
+    def sample(self, rng, size):
+        """
+        int64 array of size independent uniform random smooth n in [lo, hi],
+        drawn with the NumPy Generator rng.
+        """
+        total = self.count()
+        if total == 0:
+            raise ValueError(f"no smooth integers in [{self.lo}, {self.hi}]")
+        n = np.ones(size, dtype=np.int64)
+        hi = np.full(size, self.hi, dtype=np.int64)
+        below = np.full(size, self.lo - 1, dtype=np.int64)
+        for k in range(len(self.primes), 0, -1):
+            p = self.primes[k - 1]
+            remaining = self._psi(hi, k) - self._psi(below, k)
+            # The exponent e of p_k is the first e whose cumulative count
+            # exceeds u
+            u = rng.integers(0, remaining)
+            chosen = np.zeros(size, dtype=bool)
+            pe = np.ones(size, dtype=np.int64)
+            while not chosen.all():
+                active = ~chosen
+                h = hi[active] // pe[active]
+                b = below[active] // pe[active]
+                u[active] -= self._psi(h, k - 1) - self._psi(b, k - 1)
+                done = np.zeros(size, dtype=bool)
+                done[active] = u[active] < 0
+                hi[done] //= pe[done]
+                below[done] //= pe[done]
+                n[done] *= pe[done]
+                chosen |= done
+                pe[~chosen] *= p
+        return n
+
+
+# The most recent SmoothCounter, kept since it is slow to build
+_smooth_counter = None
+
+
+def smooth_counter(lo, hi):
+    """Cached SmoothCounter over primes_100 for [lo, hi]."""
+    global _smooth_counter
+    if _smooth_counter is None or (_smooth_counter.lo, _smooth_counter.hi) != (max(lo, 1), hi):
+        _smooth_counter = SmoothCounter(lo, hi)
+    return _smooth_counter
+
+
+def use_smooth_counter(counter):
+    """
+    Make counter (if not None) the cached SmoothCounter of smooth_counter,
+    e.g. in a worker process, with the counter built by its parent.
+    """
+    global _smooth_counter
+    if counter is not None:
+        _smooth_counter = counter
+
+
+_small_integer_tokens = np.array(
+    [encode_integer(k) for k in range(1000)], dtype=object
+)
 
 
 def wheel_mobius(n):
@@ -128,73 +885,133 @@ def wheel_mobius(n):
     return ret
 
 
-def shuffle_and_create(fname, ntrain=900_000, ntest=100_000):
+def _split_name(fname):
+    if not fname.endswith(".txt"):
+        raise ValueError("Incorrect filename assumption.")
+    return fname[:-4]  # remove ".txt"
+
+
+def shuffle_and_create(fname, ntrain=900_000, ntest=100_000, paired=(),
+                       seed=None, bucket_bytes=256 * 2**20,
+                       keep_shuffled=False, compress=None,
+                       shard_lines=DEFAULT_SHARD_LINES):
     """
     Shuffle a datafile and separate into separate testing and training files.
-    Uses pure Python with tqdm for progress bars.
-    """
-    import random
 
+    This is an external-memory shuffle, so memory use is bounded by roughly
+    `bucket_bytes` instead of the size of the file. In one streaming pass,
+    each line is sent to a uniformly random bucket file; then each bucket is
+    read back, shuffled in memory, and written directly to `{name}.txt.train`
+    (the first ntrain shuffled lines) and `{name}.txt.test` (the last ntest).
+
+    Files listed in `paired` must have the same number of lines as fname (such
+    as the mu and musq files for the same integers). They are shuffled with
+    the same permutation in the same pass, so line i of each output still
+    describes the same n.
+
+    The full shuffled file `{name}.shuf.txt` is only written if keep_shuffled.
+
+    Inputs may be plain or sharded (see shards.py). If compress is a codec,
+    the outputs are written as compressed shards of shard_lines lines.
+    """
     try:
         from tqdm import tqdm
         has_tqdm = True
     except ImportError:
         has_tqdm = False
 
-    if not fname.endswith(".txt"):
-        raise ValueError("Incorrect filename assumption.")
-    name = fname[:-4]  # remove ".txt"
-
-    # Read all lines
-    print("Reading data...")
-    with open(f"{name}.txt", 'r') as f:
-        if has_tqdm:
-            # Count lines first for progress bar
-            print("Counting lines...")
-            num_lines = sum(1 for _ in f)
-            f.seek(0)
-            lines = list(tqdm(f, total=num_lines, desc="Loading lines", unit="lines"))
-        else:
-            lines = f.readlines()
-            print(f"  Loaded {len(lines):,} lines")
-
-    # Shuffle
-    print("Shuffling...")
-    if has_tqdm:
-        random.shuffle(lines)
-        print(f"  Shuffled {len(lines):,} lines")
-    else:
-        random.shuffle(lines)
-        print(f"  Shuffled {len(lines):,} lines")
-
-    # Write shuffled file
-    print("Writing shuffled data...")
-    with open(f"{name}.shuf.txt", 'w') as f:
-        if has_tqdm:
-            for line in tqdm(lines, desc="Writing shuffled", unit="lines"):
-                f.write(line)
-        else:
-            f.writelines(lines)
-            print(f"  Wrote {len(lines):,} lines")
-
-    # Write training data
-    print("Making training data...")
-    with open(f"{name}.txt.train", 'w') as f:
-        if has_tqdm:
-            for line in tqdm(lines[:ntrain], desc="Writing train", unit="lines"):
-                f.write(line)
-        else:
-            f.writelines(lines[:ntrain])
-            print(f"  Wrote {ntrain:,} training samples")
-
-    # Write testing data
-    print("Making testing data...")
-    with open(f"{name}.txt.test", 'w') as f:
-        if has_tqdm:
-            for line in tqdm(lines[-ntest:], desc="Writing test", unit="lines"):
-                f.write(line)
-        else:
-            f.writelines(lines[-ntest:])
-            print(f"  Wrote {ntest:,} testing samples")
+    import shutil
+    import tempfile
+
+    fnames = [fname, *paired]
+    names = [_split_name(f) for f in fnames]
+    rng = np.random.default_rng(seed)
+    num_buckets = max(1, math.ceil(text_size(fname) / bucket_bytes))
+    tmpdir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(fname)))
+
+    try:
+        # Scatter lines to random buckets
+        print(f"Scattering lines into {num_buckets} buckets...")
+        buckets = [
+            [open(os.path.join(tmpdir, f"{k}.{j}"), "w") for k in range(num_buckets)]
+            for j in range(len(fnames))
+        ]
+        infiles = [open_text(f) for f in fnames]
+        num_lines = 0
+        try:
+            chunk_size = 100_000
+            rows = itertools.zip_longest(*infiles)
+            if has_tqdm:
+                rows = tqdm(rows, desc="Scattering", unit="lines")
+            chunk = []
+            for row in rows:
+                if None in row:
+                    raise ValueError(f"Paired files {fnames} differ in length")
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    _scatter(chunk, buckets, rng)
+                    num_lines += len(chunk)
+                    chunk = []
+            _scatter(chunk, buckets, rng)
+            num_lines += len(chunk)
+        finally:
+            for f in infiles:
+                f.close()
+            for bucket_files in buckets:
+                for f in bucket_files:
+                    f.close()
+        print(f"  Scattered {num_lines:,} lines")
 
+        # Shuffle each bucket and write the splits
+        print("Shuffling buckets and writing training and testing data...")
+        outfiles = []
+        for name in names:
+            files = {
+                "train": open_text_writer(f"{name}.txt.train", compress, shard_lines),
+                "test": open_text_writer(f"{name}.txt.test", compress, shard_lines),
+            }
+            if keep_shuffled:
+                files["shuf"] = open_text_writer(f"{name}.shuf.txt", compress, shard_lines)
+            outfiles.append(files)
+        try:
+            test_start = num_lines - ntest
+            position = 0
+            bucket_range = range(num_buckets)
+            if has_tqdm:
+                bucket_range = tqdm(bucket_range, desc="Shuffling buckets", unit="buckets")
+            for k in bucket_range:
+                contents = []
+                for j in range(len(fnames)):
+                    with open(os.path.join(tmpdir, f"{k}.{j}"), "r") as f:
+                        contents.append(f.readlines())
+                perm = rng.permutation(len(contents[0]))
+                end = position + len(perm)
+                train = perm[:max(0, ntrain - position)]
+                test = perm[max(0, test_start - position):]
+                for lines, files in zip(contents, outfiles):
+                    files["train"].writelines([lines[i] for i in train])
+                    files["test"].writelines([lines[i] for i in test])
+                    if keep_shuffled:
+                        files["shuf"].writelines([lines[i] for i in perm])
+                position = end
+        finally:
+            for files in outfiles:
+                for f in files.values():
+                    f.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print(f"  Wrote {min(ntrain, num_lines):,} training samples")
+    print(f"  Wrote {min(ntest, num_lines):,} testing samples")
     print("Done!")
+
+
+def _scatter(rows, buckets, rng):
+    """
+    Send each row (a tuple of paired lines) to a random bucket. buckets[j][k]
+    is bucket k for the j-th paired file.
+    """
+    targets = rng.integers(len(buckets[0]), size=len(rows))
+    for row, k in zip(rows, targets.tolist()):
+        for line, bucket_files in zip(row, buckets):
+            bucket_files[k].write(line)
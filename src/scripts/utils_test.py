@@ -0,0 +1,168 @@
+import unittest
+
+import numpy as np
+
+from utils import (
+    factor_stats, HAS_MOBIUS_SO, KeyedPermutation, mobius_array,
+    mobius_segment, numpy_factor_stats, numpy_mobius_array, primes_100,
+    rho_factor_stats, smooth_counter, SmoothCounter, use_smooth_counter,
+)
+
+
+# The largest prime whose square is below 2^53, and the next prime
+P53, Q53 = 94906249, 94906297
+
+
+class TestFactorStats(unittest.TestCase):
+    def assertStatsEqual(self, stats, expected):
+        self.assertEqual(sorted(stats), sorted(expected))
+        for key in expected:
+            self.assertEqual(
+                np.asarray(stats[key]).tolist(), np.asarray(expected[key]).tolist(), key
+            )
+
+    def test_numpy_factor_stats(self):
+        n = 2**3 * 3 * 7**2 * 101
+        stats = numpy_factor_stats([-4, 0, 1, 2, 3, 97, n, 999983**2, 3 * 999983])
+        self.assertStatsEqual(stats, {
+            'omega': [0, 0, 0, 1, 1, 1, 4, 1, 2],
+            'bigomega': [0, 0, 0, 1, 1, 1, 7, 2, 2],
+            'squarefree': [0, 0, 1, 1, 1, 1, 0, 0, 1],
+            'spf': [0, 0, 1, 2, 3, 97, 2, 999983, 3],
+            'rad': [0, 0, 1, 2, 3, 97, 2 * 3 * 7 * 101, 999983, 3 * 999983],
+        })
+
+    def test_backends_agree(self):
+        ns = list(range(-5, 3000)) + [10**12 - k for k in range(300)]
+        ns += [p * p for p in (2, 3, 999983, 1000003)] + [2 * 999983**2]
+        stats = numpy_factor_stats(ns)
+        self.assertStatsEqual(rho_factor_stats(ns), stats)
+        self.assertStatsEqual(factor_stats(ns, nthreads=2), stats)
+
+    def test_backends_agree_near_2_53(self):
+        # Cofactors at least 2^53 are tested with integer arithmetic instead
+        # of floating point
+        ns = [2**53 + k for k in range(-20, 20)]
+        ns += [P53 * P53, Q53 * Q53, P53 * Q53, 2 * P53 * P53]
+        stats = numpy_factor_stats(ns)
+        self.assertStatsEqual(rho_factor_stats(ns), stats)
+        self.assertStatsEqual(factor_stats(ns), stats)
+        self.assertEqual(stats['spf'][-4:].tolist(), [P53, Q53, P53, 2])
+        self.assertEqual(stats['squarefree'][-4:].tolist(), [0, 0, 1, 0])
+
+    @unittest.skipUnless(HAS_MOBIUS_SO, "needs mobius.so")
+    def test_numpy_mobius_array(self):
+        from utils import dldmobius
+        ns = list(range(-5, 2000)) + [10**13 - k for k in range(200)]
+        self.assertEqual(numpy_mobius_array(ns).tolist(), [dldmobius(n) for n in ns])
+
+
+class TestMobiusSegment(unittest.TestCase):
+    def assertSegment(self, L, W):
+        self.assertEqual(
+            mobius_segment(L, W).tolist(),
+            mobius_array(np.arange(L, L + W, dtype=np.int64)).tolist(), (L, W)
+        )
+
+    def test_small(self):
+        for L, W in [(1, 1), (-10, 30), (0, 2), (1, 5000), (997, 3)]:
+            self.assertSegment(L, W)
+
+    def test_wide(self):
+        # W > sqrt(L + W): every base prime hits the window more than once
+        for L, W in [(2, 100), (10**4, 10**4), (10**6, 3000)]:
+            self.assertSegment(L, W)
+
+    def test_large_primes(self):
+        # The base primes above W hit the window at most once, and their
+        # squares are in it
+        for p in (999983, 1000003):
+            self.assertSegment(p * p - 10, 20)
+            self.assertSegment(2 * p * p - 7, 15)
+
+    def test_near_2_53(self):
+        self.assertSegment(2**53 - 100, 200)
+        self.assertSegment(P53 * P53 - 50, 100)
+
+
+class TestKeyedPermutation(unittest.TestCase):
+    def test_bijection(self):
+        for size in (1, 2, 3, 5, 7, 100, 1000, 4097, 65537):
+            for seed in (0, 1, 12345):
+                perm = KeyedPermutation(size, seed)
+                images = perm(np.arange(size))
+                self.assertEqual(images.dtype, np.uint64)
+                self.assertEqual(sorted(images.tolist()), list(range(size)),
+                                 (size, seed))
+                self.assertEqual(perm[size - 1], int(images[-1]))
+
+    def test_keys(self):
+        size = 4097
+        images = {seed: KeyedPermutation(size, seed)(np.arange(size)).tolist()
+                  for seed in (0, 1, 12345)}
+        self.assertEqual(KeyedPermutation(size, 1)(np.arange(size)).tolist(), images[1])
+        self.assertNotEqual(images[0], images[1])
+        self.assertNotEqual(images[1], images[12345])
+
+    def test_large(self):
+        for size in (2**40 + 3, 2**63):
+            images = KeyedPermutation(size, 7)(np.arange(10**4))
+            self.assertTrue((images < np.uint64(size)).all())
+            self.assertEqual(len(np.unique(images)), 10**4)
+        for size in (0, 2**63 + 1):
+            with self.assertRaises(ValueError):
+                KeyedPermutation(size)
+
+
+def is_smooth(n, primes):
+    for p in primes:
+        while n % p == 0:
+            n //= p
+    return n == 1
+
+
+class TestSmoothCounter(unittest.TestCase):
+    RANGES = [(1, 5000), (2, 5000), (100, 4096), (777, 778), (4000, 5000)]
+
+    def test_count(self):
+        for primes in ([2, 3, 5, 7], primes_100[:20]):
+            smooth = [n for n in range(1, 5001) if is_smooth(n, primes)]
+            for lo, hi in self.RANGES:
+                # small_limit is below hi, so that the levels are used too
+                counter = SmoothCounter(lo, hi, primes, small_limit=64)
+                expected = sum(1 for n in smooth if lo <= n <= hi)
+                self.assertEqual(counter.count(), expected, (primes, lo, hi))
+
+    def test_count_large(self):
+        # With the default small_limit and primes
+        counter = SmoothCounter(10**6, 2**20)
+        smooth = [n for n in range(10**6, 2**20 + 1) if is_smooth(n, primes_100)]
+        self.assertEqual(counter.count(), len(smooth))
+
+    def test_sample(self):
+        primes = [2, 3, 5, 7]
+        rng = np.random.default_rng(0)
+        for lo, hi in [(1, 5000), (100, 4096)]:
+            counter = SmoothCounter(lo, hi, primes, small_limit=64)
+            smooth = {n for n in range(lo, hi + 1) if is_smooth(n, primes)}
+            sample = counter.sample(rng, 100 * len(smooth))
+            self.assertEqual(sample.dtype, np.int64)
+            self.assertLessEqual(set(sample.tolist()), smooth)
+            # Each of the smooth n is drawn about 100 times
+            values, counts = np.unique(sample, return_counts=True)
+            self.assertEqual(set(values.tolist()), smooth)
+            self.assertLess(counts.max(), 160)
+            self.assertGreater(counts.min(), 50)
+        with self.assertRaises(ValueError):
+            SmoothCounter(9_999_991, 9_999_991, primes).sample(rng, 1)
+
+    def test_use_smooth_counter(self):
+        counter = SmoothCounter(2, 10**4)
+        use_smooth_counter(counter)
+        self.assertIs(smooth_counter(2, 10**4), counter)
+        use_smooth_counter(None)
+        self.assertIs(smooth_counter(2, 10**4), counter)
+
+
+if __name__ == '__main__':
+    unittest.main()